@@ -1,9 +1,11 @@
+import functools
 import os
 import re
+import secrets
 import sqlite3
 from urllib.parse import parse_qs, unquote, urlparse
 from contextlib import contextmanager
-from typing import Optional
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
 
 DB_URL = (os.getenv("DATABASE_URL") or "sqlite:///local.db").strip()
 DB_SCHEMA = (os.getenv("DB_SCHEMA") or "").strip()
@@ -14,6 +16,10 @@ def _is_postgres(url: str) -> bool:
     return scheme in {"postgres", "postgresql", "postgresql+psycopg", "postgres+psycopg"}
 
 
+def is_postgres() -> bool:
+    return _is_postgres(DB_URL)
+
+
 def _extract_search_path(url: str) -> Optional[str]:
     if DB_SCHEMA:
         return DB_SCHEMA
@@ -34,20 +40,59 @@ def _extract_search_path(url: str) -> Optional[str]:
     return None
 
 
-def _rewrite_query(query: str) -> str:
+# psycopg prepares a statement server-side once it has run this many times on a connection.
+PG_PREPARE_THRESHOLD = int(os.getenv("PG_PREPARE_THRESHOLD", "2") or 2)
+
+
+# Tables keyed by something other than a serial id; inserts into them get no RETURNING clause.
+_TABLES_WITHOUT_ID = frozenset(
+    {
+        "ad_account_finance_snapshots",
+        "billing_issuers",
+        "client_summary",
+        "invoice_counters",
+        "schema_version",
+        "topup_profit_facts",
+        "user_legal_entities",
+        "user_notification_counters",
+        "user_profiles",
+        "user_token_epochs",
+        "user_visible_accounts",
+        "user_visible_accounts_state",
+    }
+)
+_INSERT_VALUES_RE = re.compile(r"(?is)^\s*INSERT\s+INTO\s+(?:\w+\.)?(\w+)\b.*\bVALUES\b")
+
+
+# Queries are mostly literals, so rewrites are memoized per source string.
+@functools.lru_cache(maxsize=2048)
+def _rewrite_query(query: str, returning_id: bool = False) -> str:
     q = query.replace("?", "%s")
     q = q.replace("json(%s)", "%s::jsonb")
     if re.search(r"(?i)\bINSERT\s+OR\s+IGNORE\b", q):
         q = re.sub(r"(?i)INSERT\s+OR\s+IGNORE\s+INTO\s+", "INSERT INTO ", q)
         if "ON CONFLICT" not in q.upper():
             q = q.rstrip().rstrip(";") + " ON CONFLICT DO NOTHING"
+    if returning_id and _returns_id(q):
+        q = q.rstrip().rstrip(";") + " RETURNING id"
     return q
 
 
+def _returns_id(query: str) -> bool:
+    """True for single-statement INSERT ... VALUES into a table with an id column."""
+    match = _INSERT_VALUES_RE.match(query)
+    if not match or match.group(1).lower() in _TABLES_WITHOUT_ID:
+        return False
+    return not re.search(r"(?i)\bRETURNING\b", query)
+
+
 class PgCursor:
-    def __init__(self, cursor, conn):
+    def __init__(self, cursor, conn, returning_id: bool = False):
         self._cursor = cursor
         self._conn = conn
+        self._returning_id = returning_id
+        self._id_fetched = False
+        self._lastrowid = None
 
     def fetchone(self):
         return self._cursor.fetchone()
@@ -55,8 +100,25 @@ class PgCursor:
     def fetchall(self):
         return self._cursor.fetchall()
 
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
     @property
     def lastrowid(self):
+        if self._returning_id:
+            # The INSERT was sent with RETURNING id; like lastval(), report the last row inserted.
+            # Rows skipped by ON CONFLICT DO NOTHING return nothing, so lastrowid is None.
+            if not self._id_fetched:
+                rows = self._cursor.fetchall()
+                if rows:
+                    row = rows[-1]
+                    self._lastrowid = row.get("id") if isinstance(row, dict) else row[0]
+                self._id_fetched = True
+            return self._lastrowid
         try:
             row = self._conn.execute("SELECT lastval() AS id").fetchone()
             if isinstance(row, dict):
@@ -73,20 +135,53 @@ class PgConn:
         self._conn = conn
 
     def execute(self, query, params=None):
-        q = _rewrite_query(query)
+        q = _rewrite_query(query, returning_id=True)
+        returning_id = q != _rewrite_query(query)
         if params is None:
             cur = self._conn.execute(q)
         else:
             cur = self._conn.execute(q, params)
-        return PgCursor(cur, self._conn)
+        return PgCursor(cur, self._conn, returning_id=returning_id)
 
     def executemany(self, query, params):
         q = _rewrite_query(query)
         return self._conn.executemany(q, params)
 
+    def iter_rows(self, query, params=None, batch_size: int = 500):
+        # Named cursors live server-side, so only batch_size rows are held in the worker at a time.
+        with self._conn.cursor(name=f"stream_{secrets.token_hex(6)}") as cur:
+            cur.itersize = batch_size
+            cur.execute(_rewrite_query(query), params)
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield from batch
+
+    def bulk_upsert(self, table, columns, rows, conflict, update, set_sql=""):
+        if len(rows) < BULK_COPY_MIN_ROWS:
+            self.executemany(_upsert_sql(table, columns, conflict, update, set_sql), rows)
+            return
+        # COPY into a scratch table, then merge it in one statement; the scratch table copies only
+        # column types so the target's serial id sequence and constraints are left alone.
+        staging = f"bulk_{table}_{secrets.token_hex(4)}"
+        col_list = ", ".join(columns)
+        self._conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {col_list} FROM {table} WITH NO DATA")
+        with self._conn.cursor() as cur:
+            with cur.copy(f"COPY {staging} ({col_list}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        self._conn.execute(
+            _upsert_sql(table, columns, conflict, update, set_sql, source=f"SELECT {col_list} FROM {staging}")
+        )
+        self._conn.execute(f"DROP TABLE {staging}")
+
     def commit(self):
         self._conn.commit()
 
+    def rollback(self):
+        self._conn.rollback()
+
     def close(self):
         self._conn.close()
 
@@ -104,6 +199,7 @@ def _connect():
         except Exception as exc:
             raise RuntimeError("psycopg is required for Postgres support") from exc
         conn = psycopg.connect(DB_URL, row_factory=dict_row)
+        conn.prepare_threshold = PG_PREPARE_THRESHOLD
         schema_name = _extract_search_path(DB_URL)
         if schema_name:
             conn.execute(f"SET search_path TO {schema_name}")
@@ -120,7 +216,74 @@ def get_conn():
         conn.close()
 
 
-def apply_schema():
+def iter_rows(conn, query, params=None, batch_size: int = 500):
+    """Yield query rows in fetchmany batches instead of materializing the whole result."""
+    if isinstance(conn, PgConn):
+        yield from conn.iter_rows(query, params, batch_size)
+        return
+    cur = conn.execute(query, params or ())
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            break
+        yield from batch
+
+
+# Below this many rows a pipelined executemany beats the extra COPY/merge/drop round-trips.
+BULK_COPY_MIN_ROWS = int(os.getenv("BULK_COPY_MIN_ROWS", "50") or 50)
+
+
+def _upsert_sql(
+    table: str,
+    columns: Sequence[str],
+    conflict: str,
+    update: Sequence[str],
+    set_sql: str = "",
+    source: Optional[str] = None,
+) -> str:
+    assignments = [f"{column}=excluded.{column}" for column in update]
+    if set_sql:
+        assignments.append(set_sql)
+    source = source or "VALUES (" + ", ".join("?" for _ in columns) + ")"
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) {source} "
+        f"ON CONFLICT({conflict}) DO UPDATE SET {', '.join(assignments)}"
+    )
+
+
+def bulk_upsert(
+    conn,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Sequence[object]],
+    *,
+    conflict: str,
+    update: Sequence[str],
+    set_sql: str = "",
+) -> int:
+    """Insert rows, updating `update` columns of rows that hit the `conflict` key.
+
+    SQLite runs one prepared statement over all rows (executemany); Postgres
+    COPYs the rows into a temp table and merges it with INSERT ... SELECT ...
+    ON CONFLICT. Rows must be unique on the conflict key. Returns the number
+    of rows written.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    if isinstance(conn, PgConn):
+        conn.bulk_upsert(table, columns, rows, conflict, update, set_sql)
+    else:
+        conn.executemany(_upsert_sql(table, columns, conflict, update, set_sql), rows)
+    return len(rows)
+
+
+def _apply_baseline_schema(conn=None) -> None:
+    """Schema as of the switch to versioned migrations (migration 1).
+
+    Every statement is idempotent, so databases created before schema_version
+    existed are adopted by running it once. It manages its own connection.
+    """
     if _is_postgres(DB_URL):
         schema_path = os.path.join(os.path.dirname(__file__), "..", "db", "schema_postgres.sql")
         with open(schema_path, "r", encoding="utf-8") as f:
@@ -134,6 +297,7 @@ def apply_schema():
                 if stmt.strip():
                     conn.execute(stmt)
             conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_client INTEGER DEFAULT 0")
+            conn.execute("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS fact_version INTEGER DEFAULT 0")
             conn.execute("ALTER TABLE account_requests ADD COLUMN IF NOT EXISTS contract_code TEXT")
             conn.execute("ALTER TABLE account_requests ADD COLUMN IF NOT EXISTS account_code TEXT")
             conn.execute("ALTER TABLE account_requests ADD COLUMN IF NOT EXISTS comment TEXT")
@@ -329,6 +493,8 @@ def apply_schema():
             conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_stats_client_date ON ad_account_stats(client_id, stat_date)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_stats_platform_date ON ad_account_stats(platform, stat_date)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_finance_snapshots_client ON ad_account_finance_snapshots(client_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fact_rows_campaign_date ON fact_rows(campaign_id, date)")
+            _ensure_fact_rows_natural_key(conn)
             conn.commit()
         return
     schema_path = os.path.join(os.path.dirname(__file__), "..", "db", "schema.sql")
@@ -759,7 +925,9 @@ def apply_schema():
         conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_stats_client_date ON ad_account_stats(client_id, stat_date)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_stats_platform_date ON ad_account_stats(platform, stat_date)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_account_finance_snapshots_client ON ad_account_finance_snapshots(client_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fact_rows_campaign_date ON fact_rows(campaign_id, date)")
         _ensure_column(conn, "wallet_transactions", "account_id", "INTEGER")
+        _ensure_column(conn, "campaigns", "fact_version", "INTEGER")
         _ensure_column(conn, "client_finance_documents", "document_type", "TEXT")
         _ensure_column(conn, "client_finance_documents", "title", "TEXT")
         _ensure_column(conn, "client_finance_documents", "document_number", "TEXT")
@@ -845,9 +1013,435 @@ def apply_schema():
         _ensure_column(conn, "ad_account_finance_snapshots", "remaining_balance", "DOUBLE PRECISION")
         _ensure_column(conn, "ad_account_finance_snapshots", "last_synced_at", "TEXT")
         _ensure_column(conn, "ad_account_finance_snapshots", "updated_at", "TEXT")
+        _ensure_fact_rows_natural_key(conn)
         conn.commit()
 
 
+FACT_ROWS_NATURAL_KEY = "campaign_id, date, platform, COALESCE(ad_account_id, ''), COALESCE(campaign_name, '')"
+
+
+# Indexes behind the hot endpoint lookups; tests/test_query_plans.py checks the planner uses them.
+MANAGED_INDEXES: List[Tuple[str, str, str]] = [
+    ("idx_ad_accounts_user_platform", "ad_accounts", "user_id, platform"),
+    ("idx_topups_user_status_created", "topups", "user_id, status, created_at"),
+    ("idx_topups_account", "topups", "account_id"),
+    ("idx_account_requests_user_status_created", "account_requests", "user_id, status, created_at"),
+    ("idx_account_funding_events_user_account", "account_funding_events", "user_id, account_id"),
+    ("idx_account_funding_events_account", "account_funding_events", "account_id"),
+    ("idx_wallet_transactions_user_created", "wallet_transactions", "user_id, created_at"),
+    ("idx_wallet_transactions_account", "wallet_transactions", "account_id"),
+]
+
+
+def _migration_0002_managed_indexes(conn) -> None:
+    for name, table, columns in MANAGED_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+
+
+def _migration_0003_user_visible_accounts(conn) -> None:
+    # Materialized result of the agency ACL walk in app.main._list_accessible_accounts. A user's
+    # rows are valid while user_visible_accounts_state has a row for them; writers that change
+    # memberships, mappings, grants or visible_to_client delete that marker.
+    id_type = "BIGINT" if _is_postgres(DB_URL) else "INTEGER"
+    ts_type = "TIMESTAMPTZ DEFAULT NOW()" if _is_postgres(DB_URL) else "TEXT DEFAULT CURRENT_TIMESTAMP"
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS user_visible_accounts (
+          user_id {id_type} NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+          account_id {id_type} NOT NULL REFERENCES ad_accounts(id) ON DELETE CASCADE,
+          PRIMARY KEY (user_id, account_id)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_visible_accounts_account ON user_visible_accounts(account_id)")
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS user_visible_accounts_state (
+          user_id {id_type} PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+          refreshed_at {ts_type}
+        )
+        """
+    )
+
+
+def _migration_0004_user_token_epochs(conn) -> None:
+    # Signed access tokens carry the epoch they were issued in; bumping it revokes all of them.
+    id_type = "BIGINT" if _is_postgres(DB_URL) else "INTEGER"
+    ts_type = "TIMESTAMPTZ DEFAULT NOW()" if _is_postgres(DB_URL) else "TEXT DEFAULT CURRENT_TIMESTAMP"
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS user_token_epochs (
+          user_id {id_type} PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+          epoch INTEGER NOT NULL DEFAULT 0,
+          updated_at {ts_type}
+        )
+        """
+    )
+
+
+def _migration_0005_user_token_expiry(conn) -> None:
+    # token itself is already UNIQUE (its index serves get_current_user); these serve compaction.
+    if _is_postgres(DB_URL):
+        conn.execute("ALTER TABLE user_tokens ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ")
+    else:
+        _ensure_column(conn, "user_tokens", "expires_at", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_expires ON user_tokens(expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_user_created ON user_tokens(user_id, created_at)")
+
+
+def _migration_0006_user_notification_counters(conn) -> None:
+    # Unread badge of /notifications. Bumped in the same transaction that completes a topup or
+    # approves a request, zeroed by /notifications/read; a missing row means nothing unread.
+    id_type = "BIGINT" if _is_postgres(DB_URL) else "INTEGER"
+    ts_type = "TIMESTAMPTZ DEFAULT NOW()" if _is_postgres(DB_URL) else "TEXT DEFAULT CURRENT_TIMESTAMP"
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS user_notification_counters (
+          user_id {id_type} PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+          unread INTEGER NOT NULL DEFAULT 0,
+          updated_at {ts_type}
+        )
+        """
+    )
+    # Seed with what the badge showed before: items created since notifications_seen_at.
+    conn.execute(
+        """
+        INSERT INTO user_notification_counters (user_id, unread)
+        SELECT user_id, unread FROM (
+          SELECT u.id AS user_id,
+                 (SELECT COUNT(1) FROM topups t
+                  WHERE t.user_id = u.id AND t.status = 'completed'
+                    AND (p.notifications_seen_at IS NULL OR t.created_at > p.notifications_seen_at))
+               + (SELECT COUNT(1) FROM account_requests r
+                  WHERE r.user_id = u.id AND r.status = 'approved'
+                    AND (p.notifications_seen_at IS NULL OR r.created_at > p.notifications_seen_at)) AS unread
+          FROM users u
+          LEFT JOIN user_profiles p ON p.user_id = u.id
+        ) seeded
+        WHERE unread > 0
+        ON CONFLICT (user_id) DO NOTHING
+        """
+    )
+
+
+# Per-user aggregates behind /admin/clients, shared by the migration and app.main's write paths.
+CLIENT_SUMMARY_SELECT = """
+    SELECT u.id AS user_id,
+           (SELECT COUNT(1) FROM topups t WHERE t.user_id = u.id AND t.seen_by_admin = 0) AS unread_topups,
+           (SELECT COUNT(1) FROM topups t WHERE t.user_id = u.id AND t.status != 'completed') AS pending_requests,
+           (SELECT COUNT(1) FROM topups t WHERE t.user_id = u.id AND t.status = 'completed') AS completed_count,
+           (SELECT COALESCE(SUM(COALESCE(afe.amount_kzt, 0)), 0) FROM account_funding_events afe WHERE afe.user_id = u.id)
+             AS completed_total_kzt,
+           COALESCE(
+             (SELECT MAX(t.created_at) FROM topups t WHERE t.user_id = u.id),
+             (SELECT MAX(w.created_at) FROM wallet_transactions w WHERE w.user_id = u.id)
+           ) AS last_activity
+    FROM users u
+"""
+CLIENT_SUMMARY_UPSERT = f"""
+    INSERT INTO client_summary
+      (user_id, unread_topups, pending_requests, completed_count, completed_total_kzt, last_activity, updated_at)
+    SELECT s.*, CURRENT_TIMESTAMP FROM ({CLIENT_SUMMARY_SELECT} {{where}}) s
+    WHERE 1=1
+    ON CONFLICT(user_id) DO UPDATE SET
+      unread_topups=excluded.unread_topups,
+      pending_requests=excluded.pending_requests,
+      completed_count=excluded.completed_count,
+      completed_total_kzt=excluded.completed_total_kzt,
+      last_activity=excluded.last_activity,
+      updated_at=CURRENT_TIMESTAMP
+"""
+
+
+def _migration_0007_client_summary(conn) -> None:
+    # Kept current by the write paths that touch a user's topups, wallet transactions or funding
+    # events (app.main._refresh_client_summaries); app.main.rebuild_client_summaries redoes it all.
+    id_type = "BIGINT" if _is_postgres(DB_URL) else "INTEGER"
+    ts_col = "TIMESTAMPTZ" if _is_postgres(DB_URL) else "TEXT"
+    ts_type = "TIMESTAMPTZ DEFAULT NOW()" if _is_postgres(DB_URL) else "TEXT DEFAULT CURRENT_TIMESTAMP"
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS client_summary (
+          user_id {id_type} PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+          unread_topups INTEGER NOT NULL DEFAULT 0,
+          pending_requests INTEGER NOT NULL DEFAULT 0,
+          completed_count INTEGER NOT NULL DEFAULT 0,
+          completed_total_kzt DOUBLE PRECISION NOT NULL DEFAULT 0,
+          last_activity {ts_col},
+          updated_at {ts_type}
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_client_summary_unread ON client_summary(unread_topups)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_client_summary_last_activity ON client_summary(last_activity)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_client_summary_completed_total ON client_summary(completed_total_kzt)")
+    conn.execute(CLIENT_SUMMARY_UPSERT.format(where=""))
+
+
+def _migration_0008_topup_profit_facts(conn) -> None:
+    # Profit components of each completed topup, as computed by app.main._attach_topup_account_amount
+    # when it completes. day/month are "YYYY-MM-DD"/"YYYY-MM" text so rollups group the same way on
+    # both backends. Topups completed before this table existed: scripts/backfill_profit_facts.py.
+    id_type = "BIGINT" if _is_postgres(DB_URL) else "INTEGER"
+    ts_type = "TIMESTAMPTZ DEFAULT NOW()" if _is_postgres(DB_URL) else "TEXT DEFAULT CURRENT_TIMESTAMP"
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS topup_profit_facts (
+          topup_id {id_type} PRIMARY KEY REFERENCES topups(id) ON DELETE CASCADE,
+          user_id {id_type} NOT NULL,
+          account_id {id_type},
+          platform TEXT,
+          currency TEXT,
+          account_currency TEXT,
+          day TEXT NOT NULL,
+          month TEXT NOT NULL,
+          amount_input DOUBLE PRECISION NOT NULL DEFAULT 0,
+          amount_account DOUBLE PRECISION,
+          amount_account_kzt DOUBLE PRECISION,
+          fee_percent DOUBLE PRECISION NOT NULL DEFAULT 0,
+          fx_rate DOUBLE PRECISION,
+          our_rate DOUBLE PRECISION,
+          fee_base_kzt DOUBLE PRECISION NOT NULL DEFAULT 0,
+          fee_amount_kzt DOUBLE PRECISION NOT NULL DEFAULT 0,
+          fx_profit_kzt DOUBLE PRECISION NOT NULL DEFAULT 0,
+          profit_total_kzt DOUBLE PRECISION NOT NULL DEFAULT 0,
+          updated_at {ts_type}
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_topup_profit_facts_day ON topup_profit_facts(day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_topup_profit_facts_month ON topup_profit_facts(month)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_topup_profit_facts_user_day ON topup_profit_facts(user_id, day)")
+
+
+# Keyset pages of the admin list endpoints: ORDER BY created_at DESC, id DESC (wallets: balance ASC,
+# id ASC), optionally after an equality filter on status.
+ADMIN_LIST_INDEXES: List[Tuple[str, str, str]] = [
+    ("idx_topups_created_id", "topups", "created_at, id"),
+    ("idx_topups_status_created_id", "topups", "status, created_at, id"),
+    ("idx_account_requests_created_id", "account_requests", "created_at, id"),
+    ("idx_account_requests_status_created_id", "account_requests", "status, created_at, id"),
+    ("idx_wallet_transactions_created_id", "wallet_transactions", "created_at, id"),
+    ("idx_ad_accounts_created_id", "ad_accounts", "created_at, id"),
+    ("idx_users_created_id", "users", "created_at, id"),
+    ("idx_wallets_balance_id", "wallets", "balance, id"),
+]
+
+
+def _migration_0009_admin_list_indexes(conn) -> None:
+    for name, table, columns in ADMIN_LIST_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+
+
+# What /admin/search matches: kind -> (table, columns, searched text). "{row}" is the row prefix
+# ("" in indexes and queries, "new." in triggers). The kind's position is its SEARCH_KIND_CODES code.
+SEARCH_DOCUMENTS: List[Tuple[str, str, Tuple[str, ...], str]] = [
+    ("user", "users", ("email",), "{row}email"),
+    (
+        "account",
+        "ad_accounts",
+        ("name", "external_id", "account_code"),
+        "{row}name || ' ' || COALESCE({row}external_id, '') || ' ' || COALESCE({row}account_code, '')",
+    ),
+    (
+        "legal_entity",
+        "legal_entities",
+        ("name", "short_name", "full_name", "bin"),
+        "{row}name || ' ' || COALESCE({row}short_name, '') || ' ' || COALESCE({row}full_name, '')"
+        " || ' ' || COALESCE({row}bin, '')",
+    ),
+]
+SEARCH_KIND_CODES = {kind: code for code, (kind, _table, _columns, _text) in enumerate(SEARCH_DOCUMENTS)}
+
+
+def _migration_0010_admin_search(conn) -> None:
+    # Postgres: a trigram GIN index over each table's searched text serves ILIKE and word
+    # similarity. SQLite: one FTS5 trigram table, admin_search, kept current by triggers; its
+    # rowid is source id * len(SEARCH_DOCUMENTS) + the kind's code.
+    if _is_postgres(DB_URL):
+        conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for _kind, table, _columns, text in SEARCH_DOCUMENTS:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_search_trgm ON {table} "
+                f"USING gin (({text.format(row='')}) gin_trgm_ops)"
+            )
+        return
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS admin_search USING fts5(text, tokenize='trigram')")
+    stride = len(SEARCH_DOCUMENTS)
+    for kind, table, columns, text in SEARCH_DOCUMENTS:
+        code = SEARCH_KIND_CODES[kind]
+        insert = f"INSERT INTO admin_search(rowid, text) VALUES (new.id * {stride} + {code}, {text.format(row='new.')});"
+        delete = f"DELETE FROM admin_search WHERE rowid = old.id * {stride} + {code};"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN {insert} END")
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE OF {', '.join(columns)} ON {table} "
+            f"BEGIN {delete} {insert} END"
+        )
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN {delete} END")
+        conn.execute(
+            f"INSERT INTO admin_search(rowid, text) SELECT id * {stride} + {code}, {text.format(row='')} FROM {table}"
+        )
+
+
+def _migration_0011_visible_accounts_version(conn) -> None:
+    # Invalidation bumps version instead of deleting the marker; a materialized list is current
+    # only while cached_version == version, so a rebuild that raced an invalidation is not stored.
+    conn.execute("ALTER TABLE user_visible_accounts_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE user_visible_accounts_state ADD COLUMN cached_version INTEGER")
+    conn.execute("UPDATE user_visible_accounts_state SET cached_version = 0")
+
+
+def _migration_0012_notification_items(conn) -> None:
+    # When a topup/request last raised the owner's unread counter; reverting it only takes the count
+    # back down while that notification is newer than notifications_seen_at. Seeded like migration 6.
+    ts_type = "TIMESTAMPTZ" if _is_postgres(DB_URL) else "TEXT"
+    conn.execute(f"ALTER TABLE topups ADD COLUMN notified_at {ts_type}")
+    conn.execute(f"ALTER TABLE account_requests ADD COLUMN notified_at {ts_type}")
+    conn.execute("UPDATE topups SET notified_at = created_at WHERE status = 'completed'")
+    conn.execute("UPDATE account_requests SET notified_at = created_at WHERE status = 'approved'")
+
+
+# Append-only: (version, name, function taking an open connection). Applied in order by migrate().
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline", _apply_baseline_schema),
+    (2, "managed_indexes", _migration_0002_managed_indexes),
+    (3, "user_visible_accounts", _migration_0003_user_visible_accounts),
+    (4, "user_token_epochs", _migration_0004_user_token_epochs),
+    (5, "user_token_expiry", _migration_0005_user_token_expiry),
+    (6, "user_notification_counters", _migration_0006_user_notification_counters),
+    (7, "client_summary", _migration_0007_client_summary),
+    (8, "topup_profit_facts", _migration_0008_topup_profit_facts),
+    (9, "admin_list_indexes", _migration_0009_admin_list_indexes),
+    (10, "admin_search", _migration_0010_admin_search),
+    (11, "visible_accounts_version", _migration_0011_visible_accounts_version),
+    (12, "notification_items", _migration_0012_notification_items),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+_MIGRATION_LOCK_ID = 7_240_315
+
+
+def _ensure_schema_version_table(conn) -> None:
+    if _is_postgres(DB_URL):
+        schema_name = _extract_search_path(DB_URL)
+        if schema_name:
+            conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+            conn.execute(f"SET search_path TO {schema_name}")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TIMESTAMPTZ DEFAULT NOW()
+            )
+            """
+        )
+    else:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+
+def current_schema_version(conn) -> int:
+    if _is_postgres(DB_URL):
+        exists = conn.execute("SELECT to_regclass('schema_version') AS name").fetchone()["name"]
+    else:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'").fetchone()
+    if not exists:
+        return 0
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return int(row["version"] or 0)
+
+
+def migrate() -> List[int]:
+    """Apply pending migrations in order and return the versions applied."""
+    applied: List[int] = []
+    with get_conn() as conn:
+        if _is_postgres(DB_URL):
+            # Serialize concurrent runners (e.g. several instances deploying at once).
+            conn.execute("SELECT pg_advisory_lock(?)", (_MIGRATION_LOCK_ID,))
+        try:
+            _ensure_schema_version_table(conn)
+            conn.commit()
+            current = current_schema_version(conn)
+            for version, name, migration in MIGRATIONS:
+                if version <= current:
+                    continue
+                migration(conn)
+                conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+                conn.commit()
+                applied.append(version)
+        finally:
+            if _is_postgres(DB_URL):
+                # A failed migration leaves the transaction aborted; roll it back so the unlock
+                # can run and the original error is the one that propagates.
+                conn.rollback()
+                conn.execute("SELECT pg_advisory_unlock(?)", (_MIGRATION_LOCK_ID,))
+                conn.commit()
+    return applied
+
+
+def _auto_migrate_enabled() -> bool:
+    default = "0" if _is_postgres(DB_URL) else "1"
+    return (os.getenv("SCHEMA_AUTO_MIGRATE") or default).strip().lower() in {"1", "true", "yes"}
+
+
+def ensure_schema() -> int:
+    """Startup check: one version lookup when the schema is current.
+
+    Pending migrations are applied here only when SCHEMA_AUTO_MIGRATE is on
+    (the default for local SQLite); otherwise run `python scripts/migrate.py`.
+    """
+    with get_conn() as conn:
+        version = current_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+    if not _auto_migrate_enabled():
+        raise RuntimeError(
+            f"Database schema is at version {version}, code expects {SCHEMA_VERSION}; run scripts/migrate.py"
+        )
+    migrate()
+    return SCHEMA_VERSION
+
+
+def _index_exists(conn, name: str) -> bool:
+    if _is_postgres(DB_URL):
+        row = conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname=current_schema() AND indexname=?",
+            (name,),
+        ).fetchone()
+        return bool(row)
+    row = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND name=?",
+        (name,),
+    ).fetchone()
+    return bool(row)
+
+
+def _ensure_fact_rows_natural_key(conn) -> None:
+    if _index_exists(conn, "uq_fact_rows_natural_key"):
+        return
+    # Older imports appended duplicates; keep the latest copy of each row before enforcing uniqueness.
+    conn.execute(
+        f"""
+        DELETE FROM fact_rows
+        WHERE id NOT IN (
+          SELECT MAX(id) FROM fact_rows GROUP BY {FACT_ROWS_NATURAL_KEY}
+        )
+        """
+    )
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_fact_rows_natural_key ON fact_rows({FACT_ROWS_NATURAL_KEY})")
+    # Weekly aggregates were built from the duplicated rows: drop them so they are rebuilt lazily, and
+    # bump (never reset) the versions so ETags and cached reports issued before this cannot match again.
+    conn.execute("DELETE FROM fact_weekly_agg")
+    conn.execute("UPDATE campaigns SET fact_version=COALESCE(fact_version, 0) + 1")
+
+
 def _ensure_table(conn: sqlite3.Connection, name: str, ddl: str) -> None:
     row = conn.execute(
         "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
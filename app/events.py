@@ -0,0 +1,217 @@
+"""In-process event bus behind the server-sent notification streams.
+
+Write paths publish small JSON events to a topic ("user:<id>" or "admins")
+after they commit; every open stream subscribed to that topic receives them
+on its own bounded asyncio queue. A subscriber that falls behind is flagged
+instead of blocking publishers and is told to resync from the REST endpoint.
+
+With a single API process the bus is purely in memory. With several
+processes set EVENTS_BACKEND=postgres: events are sent with pg_notify and a
+listener thread in every process fans them out to its local subscribers.
+"""
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.db import DB_URL, is_postgres
+
+EVENTS_BACKEND = (os.getenv("EVENTS_BACKEND") or "memory").strip().lower()
+EVENTS_PG_CHANNEL = os.getenv("EVENTS_PG_CHANNEL", "app_events") or "app_events"
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100") or 100)
+# Streams send a comment this often so proxies keep them open, and close after
+# EVENTS_STREAM_MAX_SEC so clients re-authenticate; EventSource reconnects on its own.
+EVENTS_KEEPALIVE_SEC = float(os.getenv("EVENTS_KEEPALIVE_SEC", "15") or 15)
+EVENTS_STREAM_MAX_SEC = float(os.getenv("EVENTS_STREAM_MAX_SEC", "3600") or 3600)
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000") or 3000)
+
+# NOTIFY payloads are limited to 8000 bytes; events carry ids and a few fields.
+_PG_PAYLOAD_LIMIT = 7900
+
+
+class Subscription:
+    def __init__(self, topics: Iterable[str], loop: asyncio.AbstractEventLoop):
+        self.topics: Set[str] = set(topics)
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict[str, object]]" = asyncio.Queue(maxsize=max(EVENTS_QUEUE_SIZE, 1))
+        self.overflowed = False
+
+    def _put(self, event: Dict[str, object]) -> None:
+        # Runs on the subscriber's loop.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Optional[Dict[str, object]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+_SUBSCRIBERS: Dict[str, List[Subscription]] = {}
+_SUBSCRIBERS_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, int] = {"published": 0, "delivered": 0, "dropped": 0, "listener_errors": 0}
+
+_PG_LOCK = threading.Lock()
+_PG_PUBLISH_CONN = None
+_PG_LISTENER: Optional[threading.Thread] = None
+_PG_STOP = threading.Event()
+
+
+def _record(key: str, amount: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[key] += amount
+
+
+def _use_postgres() -> bool:
+    return EVENTS_BACKEND == "postgres" and is_postgres()
+
+
+def subscribe(topics: Iterable[str]) -> Subscription:
+    """Register a stream for `topics`; must be called from the stream's event loop."""
+    sub = Subscription(topics, asyncio.get_running_loop())
+    with _SUBSCRIBERS_LOCK:
+        for topic in sub.topics:
+            _SUBSCRIBERS.setdefault(topic, []).append(sub)
+    if _use_postgres():
+        _ensure_listener()
+    return sub
+
+
+def unsubscribe(sub: Subscription) -> None:
+    with _SUBSCRIBERS_LOCK:
+        for topic in sub.topics:
+            subs = _SUBSCRIBERS.get(topic)
+            if not subs:
+                continue
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                _SUBSCRIBERS.pop(topic, None)
+
+
+def _dispatch(topic: str, event: Dict[str, object]) -> None:
+    with _SUBSCRIBERS_LOCK:
+        subs = list(_SUBSCRIBERS.get(topic, ()))
+    for sub in subs:
+        try:
+            sub.loop.call_soon_threadsafe(sub._put, event)
+            _record("delivered")
+        except RuntimeError:
+            # The stream's loop is already closed; it will unsubscribe on its way out.
+            _record("dropped")
+
+
+def publish(topic: str, event: str, data: Dict[str, object]) -> None:
+    """Send `event` to every stream subscribed to `topic`.
+
+    Call this after the write it describes has committed. Publishing never
+    raises: a lost event only means clients resync on their next page load.
+    """
+    message = {"topic": topic, "event": event, "data": data}
+    _record("published")
+    if not _use_postgres():
+        _dispatch(topic, message)
+        return
+    payload = json.dumps(message, ensure_ascii=False, default=str)
+    if len(payload.encode("utf-8")) > _PG_PAYLOAD_LIMIT:
+        logging.warning("Event %s on %s is too large for NOTIFY; sending a resync instead", event, topic)
+        payload = json.dumps({"topic": topic, "event": "resync", "data": {}})
+    try:
+        _pg_notify(payload)
+    except Exception:
+        logging.exception("Failed to publish event %s on %s", event, topic)
+
+
+def _pg_notify(payload: str) -> None:
+    global _PG_PUBLISH_CONN
+    import psycopg
+
+    with _PG_LOCK:
+        for attempt in range(2):
+            if _PG_PUBLISH_CONN is None or _PG_PUBLISH_CONN.closed:
+                _PG_PUBLISH_CONN = psycopg.connect(DB_URL, autocommit=True)
+            try:
+                _PG_PUBLISH_CONN.execute("SELECT pg_notify(%s, %s)", (EVENTS_PG_CHANNEL, payload))
+                return
+            except psycopg.OperationalError:
+                _PG_PUBLISH_CONN = None
+                if attempt:
+                    raise
+
+
+def _ensure_listener() -> None:
+    global _PG_LISTENER
+    with _PG_LOCK:
+        if _PG_LISTENER is not None and _PG_LISTENER.is_alive():
+            return
+        _PG_STOP.clear()
+        _PG_LISTENER = threading.Thread(target=_listen_forever, name="events-pg-listener", daemon=True)
+        _PG_LISTENER.start()
+
+
+def _listen_forever() -> None:
+    import psycopg
+
+    backoff = 1.0
+    while not _PG_STOP.is_set():
+        try:
+            with psycopg.connect(DB_URL, autocommit=True) as conn:
+                conn.execute(f'LISTEN "{EVENTS_PG_CHANNEL}"')
+                backoff = 1.0
+                while not _PG_STOP.is_set():
+                    for notify in conn.notifies(timeout=5.0):
+                        _handle_notify(notify.payload)
+        except Exception:
+            _record("listener_errors")
+            logging.exception("Event listener lost its Postgres connection; reconnecting")
+            _PG_STOP.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+def _handle_notify(payload: str) -> None:
+    try:
+        message = json.loads(payload)
+        topic = str(message["topic"])
+    except Exception:
+        logging.warning("Ignoring malformed event payload: %.200s", payload)
+        return
+    _dispatch(topic, message)
+
+
+def shutdown() -> None:
+    global _PG_PUBLISH_CONN
+    _PG_STOP.set()
+    with _PG_LOCK:
+        conn, _PG_PUBLISH_CONN = _PG_PUBLISH_CONN, None
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+atexit.register(shutdown)
+
+
+def bus_stats() -> Dict[str, object]:
+    with _STATS_LOCK:
+        stats: Dict[str, object] = dict(_STATS)
+    with _SUBSCRIBERS_LOCK:
+        streams = {id(sub) for subs in _SUBSCRIBERS.values() for sub in subs}
+        stats["topics"] = len(_SUBSCRIBERS)
+    stats["streams"] = len(streams)
+    stats["backend"] = "postgres" if _use_postgres() else "memory"
+    stats["listener_alive"] = bool(_PG_LISTENER is not None and _PG_LISTENER.is_alive())
+    return stats
+
+
+def format_sse(event: str, data: Dict[str, object]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
@@ -1,36 +1,58 @@
-﻿from datetime import date, datetime, timedelta
+﻿from datetime import date, datetime, timedelta, timezone
+from collections import OrderedDict
 from io import BytesIO
-from typing import Dict, List, Literal, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 from enum import Enum
+import asyncio
 import calendar
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI, Header, HTTPException, Form, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Form, Query, Request
 import logging
 import traceback
 import time
 import base64
 from fastapi import File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse, RedirectResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse, RedirectResponse, Response
+from starlette.concurrency import run_in_threadpool
 from openpyxl import Workbook
-from openpyxl.styles import Border, Side
-from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, NamedStyle, Side
+from openpyxl.utils import column_index_from_string, get_column_letter
 from pydantic import BaseModel, Field
 import hashlib
 import hmac
+import inspect
 import secrets
 import json
 import html
 import os
+import re
 import shutil
+import tempfile
+import threading
 import httpx
 import boto3
 from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError as BotoClientError
 from google.ads.googleads.client import GoogleAdsClient
 from google.api_core import exceptions as google_api_exceptions
 from dotenv import load_dotenv
 
-from app.db import get_conn
+from app.db import (
+    CLIENT_SUMMARY_UPSERT,
+    FACT_ROWS_NATURAL_KEY,
+    SEARCH_DOCUMENTS,
+    SEARCH_KIND_CODES,
+    bulk_upsert,
+    get_conn,
+    is_postgres,
+    iter_rows,
+)
+from app import events, pdf_render
 
 load_dotenv()
 
@@ -43,6 +65,25 @@ _LIVE_BILLING_CACHE: Dict[str, Dict[str, object]] = {}
 _LIVE_BILLING_TTL_SEC = 300
 _ASSISTANT_GLOBAL_OVERVIEW_CACHE: Dict[str, object] = {"key": None, "ts": 0.0, "data": None}
 _ASSISTANT_GLOBAL_OVERVIEW_TTL_SEC = int(os.getenv("ASSISTANT_GLOBAL_CACHE_TTL_SEC", "3600") or 3600)
+_WEEKLY_REPORT_CACHE: "OrderedDict[Tuple[int, int], Dict[str, object]]" = OrderedDict()
+_WEEKLY_REPORT_CACHE_MAX = int(os.getenv("WEEKLY_REPORT_CACHE_MAX", "256") or 256)
+_WEEKLY_REPORT_CACHE_LOCK = threading.Lock()
+_INVOICE_PDF_CACHE: set = set()
+_XLSX_CELL_STYLE = "envidicy_cell"
+_XLSX_SPOOL_MAX_BYTES = int(os.getenv("XLSX_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)) or 8 * 1024 * 1024)
+_DASHBOARD_EXPORT_DEADLINE_SEC = float(os.getenv("DASHBOARD_EXPORT_DEADLINE_SEC", "45") or 45)
+_DASHBOARD_EXPORT_SECTION_TIMEOUT_SEC = float(os.getenv("DASHBOARD_EXPORT_SECTION_TIMEOUT_SEC", "20") or 20)
+_DASHBOARD_EXPORT_RENDER_RESERVE_SEC = float(os.getenv("DASHBOARD_EXPORT_RENDER_RESERVE_SEC", "10") or 10)
+_EXPORT_JOB_TTL_SEC = int(os.getenv("EXPORT_JOB_TTL_SEC", "86400") or 86400)
+_EXPORT_JOB_TIMEOUT_SEC = int(os.getenv("EXPORT_JOB_TIMEOUT_SEC", "900") or 900)
+_EXPORT_JOB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EXPORT_JOB_WORKERS", "2") or 2), thread_name_prefix="export-job"
+)
+
+
+def _utc_timestamp(value: Optional[datetime] = None) -> str:
+    """Naive UTC timestamp text, comparable with the stored TEXT/TIMESTAMP columns on both backends."""
+    return (value or datetime.utcnow()).isoformat(sep=" ", timespec="seconds")
 
 
 def _env_flag(name: str, default: bool = False) -> bool:
@@ -52,6 +93,31 @@ def _env_flag(name: str, default: bool = False) -> bool:
     return str(raw).strip().lower() in {"1", "true", "yes", "on"}
 
 
+# Signed access tokens: verified in-process; AUTH_TOKEN_SECRET must be shared by all API instances.
+_AUTH_TOKEN_SECRET = (os.getenv("AUTH_TOKEN_SECRET") or "").strip().encode("utf-8")
+_AUTH_SIGNED_TOKENS = _env_flag("AUTH_SIGNED_TOKENS") and bool(_AUTH_TOKEN_SECRET)
+# How long a process trusts its cached revocation epoch; bounds revocation delay on other instances.
+_AUTH_EPOCH_CACHE_TTL_SEC = float(os.getenv("AUTH_EPOCH_CACHE_TTL_SEC", "30") or 0)
+_AUTH_EPOCH_CACHE: Dict[int, Tuple[float, int]] = {}
+_SIGNED_TOKEN_PREFIX = "s1."
+# Token lifetime (0 = tokens never expire) and how many stored tokens each login keeps.
+_AUTH_TOKEN_TTL_SEC = int(os.getenv("AUTH_TOKEN_TTL_SEC", str(30 * 86400)) or 0)
+_AUTH_TOKENS_PER_LOGIN = int(os.getenv("AUTH_TOKENS_PER_LOGIN", "10") or 10)
+_AUTH_TOKEN_COMPACT_INTERVAL_SEC = float(os.getenv("AUTH_TOKEN_COMPACT_INTERVAL_SEC", "3600") or 3600)
+_AUTH_TOKEN_COMPACT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-compact")
+_AUTH_STATS_LOCK = threading.Lock()
+_AUTH_STATS: Dict[str, object] = {
+    "lookups": 0,
+    "lookup_misses": 0,
+    "lookup_ms_total": 0.0,
+    "lookup_ms_max": 0.0,
+    "signed_verifications": 0,
+    "last_compaction_at": None,
+    "last_compaction": None,
+}
+_AUTH_LAST_COMPACT_TS = 0.0
+
+
 def _default_fee_config() -> Dict[str, Optional[float]]:
     return {
         "meta": 5,
@@ -140,6 +206,19 @@ def _r2_upload_bytes(key: str, data: bytes, content_type: str = "application/pdf
     return f"r2://{bucket_name}/{key}"
 
 
+def _r2_object_exists(key: str, bucket: Optional[str] = None) -> bool:
+    client = _r2_client()
+    if not client:
+        return False
+    try:
+        client.head_object(Bucket=bucket or _r2_bucket(), Key=key)
+    except BotoClientError as exc:
+        if str(exc.response.get("Error", {}).get("Code")) in {"404", "NoSuchKey", "NotFound"}:
+            return False
+        raise
+    return True
+
+
 def _r2_delete_object(key: str, bucket: Optional[str] = None) -> None:
     client = _r2_client()
     if not client:
@@ -974,11 +1053,7 @@ def parse_fact_csv(csv_text: str) -> List[FactRow]:
     return rows
 
 
-def aggregate_weekly(plan: PlanResponse, facts: List[FactRow], strategy: str = "account") -> Tuple[List[Dict[str, object]], List[FactRow]]:
-    """Aggregate fact weekly and compute plan per week by platform using daily averages."""
-    if plan.period_days <= 0:
-        return [], []
-    # daily plan by platform
+def _daily_plan_by_platform(plan: PlanResponse) -> Dict[str, Dict[str, float]]:
     daily_plan: Dict[str, Dict[str, float]] = {}
     for line in plan.lines:
         daily_plan[line.key] = {
@@ -989,6 +1064,44 @@ def aggregate_weekly(plan: PlanResponse, facts: List[FactRow], strategy: str = "
             "leads": line.leads / plan.period_days,
             "conversions": line.conversions / plan.period_days,
         }
+    return daily_plan
+
+
+def _compose_weekly_plan_vs_fact(
+    daily_plan: Dict[str, Dict[str, float]],
+    weekly: Dict[Tuple[int, int, str], Dict[str, float]],
+    days_in_week: Dict[Tuple[int, int, str], int],
+) -> List[Dict[str, object]]:
+    result: List[Dict[str, object]] = []
+    for key, fact in weekly.items():
+        iso_year, iso_week, platform_key = key
+        d_plan = daily_plan.get(platform_key if platform_key in daily_plan else str(platform_key), {})
+        days_count = days_in_week.get(key, 0)
+        plan_week = {
+            "budget": d_plan.get("budget", 0) * days_count,
+            "impressions": d_plan.get("impressions", 0) * days_count,
+            "reach": d_plan.get("reach", 0) * days_count,
+            "clicks": d_plan.get("clicks", 0) * days_count,
+            "leads": d_plan.get("leads", 0) * days_count,
+            "conversions": d_plan.get("conversions", 0) * days_count,
+        }
+        result.append(
+            {
+                "year": iso_year,
+                "week": iso_week,
+                "platform": platform_key,
+                "plan": plan_week,
+                "fact": fact,
+            }
+        )
+    return sorted(result, key=lambda x: (x["year"], x["week"], str(x["platform"])))
+
+
+def aggregate_weekly(plan: PlanResponse, facts: List[FactRow], strategy: str = "account") -> Tuple[List[Dict[str, object]], List[FactRow]]:
+    """Aggregate fact weekly and compute plan per week by platform using daily averages."""
+    if plan.period_days <= 0:
+        return [], []
+    daily_plan = _daily_plan_by_platform(plan)
 
     weekly: Dict[Tuple[int, int, str], Dict[str, float]] = {}
     days_in_week: Dict[Tuple[int, int, str], set] = {}
@@ -1021,29 +1134,181 @@ def aggregate_weekly(plan: PlanResponse, facts: List[FactRow], strategy: str = "
         days = days_in_week.setdefault(key, set())
         days.add(row.date)
 
-    result: List[Dict[str, object]] = []
-    for key, fact in weekly.items():
-        iso_year, iso_week, platform_key = key
-        d_plan = daily_plan.get(platform_key if platform_key in daily_plan else str(platform_key), {})
-        days_count = len(days_in_week.get(key, set()))
-        plan_week = {
-            "budget": d_plan.get("budget", 0) * days_count,
-            "impressions": d_plan.get("impressions", 0) * days_count,
-            "reach": d_plan.get("reach", 0) * days_count,
-            "clicks": d_plan.get("clicks", 0) * days_count,
-            "leads": d_plan.get("leads", 0) * days_count,
-            "conversions": d_plan.get("conversions", 0) * days_count,
+    days_count = {key: len(days) for key, days in days_in_week.items()}
+    return _compose_weekly_plan_vs_fact(daily_plan, weekly, days_count), unmatched
+
+
+def _fact_match_key_sql(strategy: str) -> str:
+    if strategy == "account":
+        return "CASE WHEN ad_account_id IS NOT NULL AND ad_account_id <> '' THEN ad_account_id ELSE platform END"
+    if strategy == "campaign":
+        return "CASE WHEN campaign_name IS NOT NULL AND campaign_name <> '' THEN LOWER(TRIM(campaign_name)) ELSE platform END"
+    return "platform"
+
+
+FACT_MATCH_STRATEGIES = ("account", "campaign", "platform")
+
+
+def _fact_week_sql() -> Dict[str, str]:
+    if is_postgres():
+        return {
+            "iso_year": "CAST(EXTRACT(ISOYEAR FROM date) AS INTEGER)",
+            "iso_week": "CAST(EXTRACT(WEEK FROM date) AS INTEGER)",
+            "week_start": "CAST(date_trunc('week', date) AS DATE)",
+            "day_bit": "(1 << CAST(EXTRACT(DOW FROM date) AS INTEGER))",
         }
-        result.append(
-            {
-                "year": iso_year,
-                "week": iso_week,
-                "platform": platform_key,
-                "plan": plan_week,
-                "fact": fact,
-            }
+    # SQLite has no ISO week format before 3.46: the ISO year/week of a day are those of the Thursday of its week.
+    thursday = "date(date, '-3 days', 'weekday 4')"
+    return {
+        "iso_year": f"CAST(strftime('%Y', {thursday}) AS INTEGER)",
+        "iso_week": f"(CAST(strftime('%j', {thursday}) AS INTEGER) - 1) / 7 + 1",
+        "week_start": "date(date, 'weekday 0', '-6 days')",
+        "day_bit": "(1 << CAST(strftime('%w', date) AS INTEGER))",
+    }
+
+
+def _refresh_fact_weekly_agg(conn, campaign_id: int, date_from: Optional[date] = None, date_to: Optional[date] = None) -> None:
+    """Rebuild fact_weekly_agg for the ISO weeks touching [date_from, date_to] (whole campaign when omitted)."""
+    week_sql = _fact_week_sql()
+    where = "campaign_id=?"
+    params: List[object] = [campaign_id]
+    delete_where = "campaign_id=?"
+    delete_params: List[object] = [campaign_id]
+    if date_from and date_to:
+        week_from = date_from - timedelta(days=date_from.weekday())
+        week_to = date_to + timedelta(days=6 - date_to.weekday())
+        where += " AND date BETWEEN ? AND ?"
+        params += [week_from.isoformat(), week_to.isoformat()]
+        delete_where += " AND week_start BETWEEN ? AND ?"
+        delete_params += [week_from.isoformat(), week_to.isoformat()]
+    conn.execute(f"DELETE FROM fact_weekly_agg WHERE {delete_where}", tuple(delete_params))
+    for strategy in FACT_MATCH_STRATEGIES:
+        conn.execute(
+            f"""
+            INSERT INTO fact_weekly_agg
+              (campaign_id, match_strategy, iso_year, iso_week, week_start, match_key, platform,
+               cost, impressions, clicks, leads, conversions, views, days_mask, updated_at)
+            SELECT
+              campaign_id,
+              '{strategy}',
+              {week_sql["iso_year"]},
+              {week_sql["iso_week"]},
+              {week_sql["week_start"]},
+              {_fact_match_key_sql(strategy)},
+              platform,
+              COALESCE(SUM(cost), 0),
+              COALESCE(SUM(impressions), 0),
+              COALESCE(SUM(clicks), 0),
+              COALESCE(SUM(leads), 0),
+              COALESCE(SUM(conversions), 0),
+              COALESCE(SUM(views), 0),
+              SUM(DISTINCT {week_sql["day_bit"]}),
+              CURRENT_TIMESTAMP
+            FROM fact_rows
+            WHERE {where}
+            GROUP BY 1, 3, 4, 5, 6, 7
+            """,
+            tuple(params),
         )
-    return sorted(result, key=lambda x: (x["year"], x["week"], str(x["platform"]))), unmatched
+
+
+def _bump_campaign_fact_version(conn, campaign_id: int) -> int:
+    conn.execute(
+        "UPDATE campaigns SET fact_version=COALESCE(fact_version, 0) + 1 WHERE id=?",
+        (campaign_id,),
+    )
+    return _campaign_fact_version(conn, campaign_id)
+
+
+def _campaign_fact_version(conn, campaign_id: int) -> int:
+    row = conn.execute("SELECT fact_version FROM campaigns WHERE id=?", (campaign_id,)).fetchone()
+    if not row:
+        return 0
+    return int(dict(row).get("fact_version") or 0)
+
+
+def _fact_weekly_agg_missing(conn, campaign_id: int) -> bool:
+    if conn.execute("SELECT 1 FROM fact_weekly_agg WHERE campaign_id=? LIMIT 1", (campaign_id,)).fetchone():
+        return False
+    return bool(conn.execute("SELECT 1 FROM fact_rows WHERE campaign_id=? LIMIT 1", (campaign_id,)).fetchone())
+
+
+def _ensure_fact_weekly_agg(conn, campaign_id: int) -> int:
+    """Return the campaign fact version, building aggregates for campaigns that have facts but no buckets.
+
+    That covers campaigns imported before fact_weekly_agg and those whose buckets the natural-key
+    migration dropped; the rebuild bumps the version, so it always moves forward.
+    """
+    version = _campaign_fact_version(conn, campaign_id)
+    if version > 0 and not _fact_weekly_agg_missing(conn, campaign_id):
+        return version
+    _refresh_fact_weekly_agg(conn, campaign_id)
+    version = _bump_campaign_fact_version(conn, campaign_id)
+    conn.commit()
+    return version
+
+
+def _fact_row_from_db(row) -> FactRow:
+    return FactRow(
+        date=row["date"],
+        platform=row["platform"],
+        ad_account_id=row["ad_account_id"],
+        campaign_name=row["campaign_name"],
+        impressions=row["impressions"],
+        clicks=row["clicks"],
+        cost=row["cost"],
+        leads=row["leads"],
+        conversions=row["conversions"],
+        views=row["views"],
+    )
+
+
+def aggregate_weekly_db(conn, plan: PlanResponse, campaign_id: int, strategy: str = "account") -> Tuple[List[Dict[str, object]], List[FactRow]]:
+    """Same result as aggregate_weekly over a campaign's fact_rows, read from the fact_weekly_agg buckets."""
+    if plan.period_days <= 0:
+        return [], []
+    if strategy not in FACT_MATCH_STRATEGIES:
+        strategy = "platform"
+    _ensure_fact_weekly_agg(conn, campaign_id)
+    daily_plan = _daily_plan_by_platform(plan)
+    platforms = list(daily_plan.keys())
+    weekly: Dict[Tuple[int, int, str], Dict[str, float]] = {}
+    days_mask: Dict[Tuple[int, int, str], int] = {}
+    if platforms:
+        placeholders = ", ".join("?" for _ in platforms)
+        rows = conn.execute(
+            f"""
+            SELECT iso_year, iso_week, match_key, cost, impressions, clicks, leads, conversions, views, days_mask
+            FROM fact_weekly_agg
+            WHERE campaign_id=? AND match_strategy=? AND platform IN ({placeholders})
+            """,
+            (campaign_id, strategy, *platforms),
+        ).fetchall()
+        # One row per platform: merge them per match key, OR-ing weekday masks so shared days count once.
+        for row in rows:
+            key = (int(row["iso_year"]), int(row["iso_week"]), row["match_key"])
+            bucket = weekly.setdefault(
+                key,
+                {"cost": 0.0, "impressions": 0.0, "clicks": 0.0, "leads": 0.0, "conversions": 0.0, "views": 0.0},
+            )
+            for metric in bucket:
+                bucket[metric] += float(row[metric] or 0)
+            days_mask[key] = days_mask.get(key, 0) | int(row["days_mask"] or 0)
+        placeholders_filter = f" AND platform NOT IN ({placeholders})"
+    else:
+        placeholders_filter = ""
+    unmatched_rows = conn.execute(
+        f"""
+        SELECT date, platform, ad_account_id, campaign_name, impressions, clicks, cost, leads, conversions, views
+        FROM fact_rows
+        WHERE campaign_id=?{placeholders_filter}
+        ORDER BY id
+        """,
+        (campaign_id, *platforms),
+    ).fetchall()
+    unmatched = [_fact_row_from_db(row) for row in unmatched_rows]
+    days_in_week = {key: bin(mask).count("1") for key, mask in days_mask.items()}
+    return _compose_weekly_plan_vs_fact(daily_plan, weekly, days_in_week), unmatched
 
 
 def estimate_audience_size(req: PlanRequest, platform: PlatformKey) -> Optional[float]:
@@ -2081,12 +2346,7 @@ def plan_to_workbook(
     req: Optional[PlanRequest] = None,
     fact_rows: Optional[List[FactRow]] = None,
     weekly_fact: Optional[List[Dict[str, object]]] = None,
-) -> BytesIO:
-    wb = Workbook()
-    outputs = wb.active
-    outputs.title = "Outputs"
-    inputs = wb.create_sheet("Inputs", 0)
-    calculations = wb.create_sheet("Calculations")
+) -> BinaryIO:
     # Inputs (core)
     audience_desc = ""
     audience_volume = ""
@@ -2164,12 +2424,6 @@ def plan_to_workbook(
         ["Channel overrides", json.dumps(req.channel_inputs, ensure_ascii=False) if req and req.channel_inputs else ""],
         ["Prepared by", author],
     ]
-    for idx, row in enumerate(input_rows, start=1):
-        inputs.cell(row=idx, column=1, value=row[0])
-        inputs.cell(row=idx, column=2, value=row[1])
-
-    wb.remove(calculations)
-
     totals = plan.totals
     fee = (req.agency_fee_percent or 0) / 100 if req else 0
     vat = (req.vat_percent or 0) / 100 if req else 0
@@ -2241,12 +2495,11 @@ def plan_to_workbook(
         ["Frequency", round(freq, 2) if freq else None, "Прогноз"],
         ["Flight", flight, "Прогноз"],
     ]
-    outputs.append(["Outputs (standard)", "Value", "Type"])
-    for row in summary_rows:
-        outputs.append(row)
+    outputs: List[List[object]] = [["Outputs (standard)", "Value", "Type"]]
+    outputs.extend(summary_rows)
     outputs.append([])
     outputs.append(headers)
-    start_row = outputs.max_row + 1
+    start_row = len(outputs) + 1
     fee = (req.agency_fee_percent or 0) / 100 if req else 0
     vat = (req.vat_percent or 0) / 100 if req else 0
     for idx, line in enumerate(plan.lines):
@@ -2255,46 +2508,44 @@ def plan_to_workbook(
         cvr_val = (line.leads / line.clicks) if line.clicks > 0 else line.cvr
         post_click_val = (line.conversions / line.leads) if line.leads > 0 else 0.35
         is_video = 1 if (line.name.lower().find("youtube") >= 0 or line.name.lower().find("tiktok") >= 0) else 0
-        outputs.append(
-            [
-                line.name,
-                round(line.share * 100, 1),
-                round(line.budget),
-                None,  # Budget fact
-                None,  # Reach (formula)
-                None,  # Reach fact
-                None,  # Impressions plan (formula)
-                None,  # Impressions fact
-                None,  # Clicks plan (formula)
-                None,  # Clicks fact
-                None,  # Leads plan (formula)
-                None,  # Leads fact
-                None,  # Conversions plan (formula)
-                None,  # Conversions fact
-                None,  # Views plan (formula)
-                None,  # Views fact
-                None,  # Viewable plan (formula)
-                None,  # Viewable fact
-                round(line.cpm, 3),  # CPM plan
-                None,  # CPM fact
-                round(line.cpc, 3),  # CPC plan
-                None,  # CPC fact
-                round(line.cpv, 4),  # CPV plan
-                None,  # CPV fact
-                round(ctr_val, 4),  # CTR plan
-                None,  # CTR fact
-                round(cvr_val, 4),  # CVR plan
-                None,  # CVR fact
-                round(post_click_val, 4),  # Post-click plan
-                None,  # Post-click fact
-                None,  # VTR plan
-                None,  # VTR fact
-                None,  # LTV plan
-                None,  # LTV fact
-                None,  # Days
-                round(line.budget * (1 + fee + vat), 2),  # Top-up with fee/VAT
-            ]
-        )
+        line_values: List[object] = [
+            line.name,
+            round(line.share * 100, 1),
+            round(line.budget),
+            None,  # Budget fact
+            None,  # Reach (formula)
+            None,  # Reach fact
+            None,  # Impressions plan (formula)
+            None,  # Impressions fact
+            None,  # Clicks plan (formula)
+            None,  # Clicks fact
+            None,  # Leads plan (formula)
+            None,  # Leads fact
+            None,  # Conversions plan (formula)
+            None,  # Conversions fact
+            None,  # Views plan (formula)
+            None,  # Views fact
+            None,  # Viewable plan (formula)
+            None,  # Viewable fact
+            round(line.cpm, 3),  # CPM plan
+            None,  # CPM fact
+            round(line.cpc, 3),  # CPC plan
+            None,  # CPC fact
+            round(line.cpv, 4),  # CPV plan
+            None,  # CPV fact
+            round(ctr_val, 4),  # CTR plan
+            None,  # CTR fact
+            round(cvr_val, 4),  # CVR plan
+            None,  # CVR fact
+            round(post_click_val, 4),  # Post-click plan
+            None,  # Post-click fact
+            None,  # VTR plan
+            None,  # VTR fact
+            None,  # LTV plan
+            None,  # LTV fact
+            None,  # Days
+            round(line.budget * (1 + fee + vat), 2),  # Top-up with fee/VAT
+        ]
         # Excel formulas so values обновляются цепочкой внутри файла
         # Column mapping for readability:
         # C budget plan, D budget fact, E reach plan, F reach fact, G impr plan, H impr fact,
@@ -2303,18 +2554,23 @@ def plan_to_workbook(
         # S CPM plan, T CPM fact, U CPC plan, V CPC fact, W CPV plan, X CPV fact,
         # Y CTR plan, Z CTR fact, AA CVR plan, AB CVR fact, AC Post-click plan, AD Post-click fact,
         # AE VTR plan, AF VTR fact, AG LTV plan, AH LTV fact, AI Days
-        outputs[f"G{row}"] = (
-            f"=IF(S{row}>0,C{row}/S{row}*1000,"
-            f"IF(AND(U{row}>0,Y{row}>0),C{row}/U{row}/MAX(Y{row},0.0001),0))"
-        )  # Impressions plan
-        outputs[f"E{row}"] = f"=IF(G{row}>0,G{row}/1.6,0)"  # Reach plan (avg freq 1.6)
-        outputs[f"I{row}"] = f"=IF(U{row}>0,C{row}/U{row},G{row}*Y{row})"  # Clicks plan
-        outputs[f"K{row}"] = f"=I{row}*AA{row}"  # Leads plan
-        outputs[f"M{row}"] = f"=K{row}*AC{row}"  # Conversions plan
-        outputs[f"O{row}"] = f"=IF(W{row}>0,C{row}/W{row},0)"  # Views plan
-        outputs[f"Q{row}"] = f"=O{row}*{0.7 if is_video else 0}"  # Viewable plan
-        outputs[f"AE{row}"] = f"=IF(G{row}>0,O{row}/G{row},0)"  # VTR plan
-        outputs[f"AG{row}"] = f"=M{row}*100"  # LTV plan with $100 per conversion
+        formulas = {
+            "G": (
+                f"=IF(S{row}>0,C{row}/S{row}*1000,"
+                f"IF(AND(U{row}>0,Y{row}>0),C{row}/U{row}/MAX(Y{row},0.0001),0))"
+            ),  # Impressions plan
+            "E": f"=IF(G{row}>0,G{row}/1.6,0)",  # Reach plan (avg freq 1.6)
+            "I": f"=IF(U{row}>0,C{row}/U{row},G{row}*Y{row})",  # Clicks plan
+            "K": f"=I{row}*AA{row}",  # Leads plan
+            "M": f"=K{row}*AC{row}",  # Conversions plan
+            "O": f"=IF(W{row}>0,C{row}/W{row},0)",  # Views plan
+            "Q": f"=O{row}*{0.7 if is_video else 0}",  # Viewable plan
+            "AE": f"=IF(G{row}>0,O{row}/G{row},0)",  # VTR plan
+            "AG": f"=M{row}*100",  # LTV plan with $100 per conversion
+        }
+        for col_letter, formula in formulas.items():
+            line_values[column_index_from_string(col_letter) - 1] = formula
+        outputs.append(line_values)
 
     if plan.lines:
         outputs.append([])
@@ -2358,21 +2614,16 @@ def plan_to_workbook(
     # KPI block
     current_row = start_row + len(plan.lines) + 3
     if req and req.kpi_type and req.kpi_target:
-        outputs.cell(row=current_row, column=1, value="KPI контроль")
+        while len(outputs) < current_row - 1:
+            outputs.append([])
         kpi_label = req.kpi_type.upper()
-        outputs.cell(row=current_row, column=2, value="Тип")
-        outputs.cell(row=current_row, column=3, value=kpi_label)
-        outputs.cell(row=current_row + 1, column=2, value="План")
-        outputs.cell(row=current_row + 1, column=3, value=plan.planned_kpi)
-        outputs.cell(row=current_row + 2, column=2, value="Цель")
-        outputs.cell(row=current_row + 2, column=3, value=req.kpi_target)
-        outputs.cell(row=current_row + 3, column=2, value="Отклонение")
-        if plan.planned_kpi:
-            outputs.cell(row=current_row + 3, column=3, value=plan.planned_kpi - req.kpi_target)
-        current_row += 5
+        outputs.append(["KPI контроль", "Тип", kpi_label])
+        outputs.append([None, "План", plan.planned_kpi])
+        outputs.append([None, "Цель", req.kpi_target])
+        outputs.append([None, "Отклонение", plan.planned_kpi - req.kpi_target if plan.planned_kpi else None])
 
     # Flight plan sheet (monthly + weekly per platform)
-    flight = wb.create_sheet("Flight Plan")
+    flight: List[List[object]] = []
     total_days = plan.period_days or (req.period_days if req else 0)
     weeks = max(1, (total_days + 6) // 7)
     months = max(1, (total_days + 29) // 30)
@@ -2428,7 +2679,7 @@ def plan_to_workbook(
     flight.append(["Итого к оплате (с НДС/ком.)", round(total_gross, 2), f"{total_days} дней"])
 
     # Creatives sheet
-    creatives = wb.create_sheet("Creatives")
+    creatives: List[List[object]] = []
     creatives.append(["Платформа", "Форматы / размеры", "Текст", "Файлы / примечания"])
     creatives.append(["Meta (FB/IG) Feed", "1080x1080 (1:1), 1080x1350 (4:5), 1200x628 (1.91:1)", "Заголовок 25–40 знаков, текст до 125", "PNG/JPG; текст на изображении <=20%"])
     creatives.append(["Meta (FB/IG) Reels/Stories", "1080x1920 (9:16)", "Короткий текст", "Видео 9:16 или 4:5, MP4/MOV, до 4 ГБ"])
@@ -2441,9 +2692,17 @@ def plan_to_workbook(
     # Brand Metrics sheet removed
     # Scenarios sheet removed
 
+    sheets: List[Tuple[str, List[List[object]]]] = [
+        ("Inputs", input_rows),
+        ("Outputs", outputs),
+        ("Flight Plan", flight),
+        ("Creatives", creatives),
+    ]
+
     # Fact raw sheet
     if fact_rows:
-        fact_sheet = wb.create_sheet("Fact Raw")
+        fact_sheet: List[List[object]] = []
+        sheets.append(("Fact Raw", fact_sheet))
         fact_sheet.append(
             ["date", "platform", "ad_account_id", "campaign_name", "impressions", "clicks", "cost", "leads", "conversions", "views"]
         )
@@ -2465,7 +2724,8 @@ def plan_to_workbook(
 
     # Plan vs Fact weekly sheet
     if weekly_fact:
-        pvf = wb.create_sheet("Plan vs Fact Weekly")
+        pvf: List[List[object]] = []
+        sheets.append(("Plan vs Fact Weekly", pvf))
         pvf.append(
             [
                 "Year",
@@ -2525,31 +2785,73 @@ def plan_to_workbook(
                     round(fact_week.get("cost", 0) / fact_week.get("clicks", 1), 3) if fact_week.get("clicks") else "",
                 ]
             )
-    _format_workbook(wb)
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return buf
+    return _write_workbook(sheets)
+
+
+def _xlsx_column_widths(rows: List[List[object]]) -> Dict[int, int]:
+    max_widths: Dict[int, int] = {}
+    for row in rows:
+        for col_idx, value in enumerate(row, start=1):
+            if value is None:
+                continue
+            max_widths[col_idx] = max(max_widths.get(col_idx, 0), len(str(value)))
+    return max_widths
 
 
-def _format_workbook(wb: Workbook) -> None:
+def _write_workbook(sheets: List[Tuple[str, List[List[object]]]]) -> BinaryIO:
+    """Emit sheets through a write-only workbook into a spooled file, ready to stream with _iter_file_chunks."""
+    wb = Workbook(write_only=True)
     thin = Side(style="thin", color="999999")
-    border = Border(top=thin, left=thin, right=thin, bottom=thin)
-    for ws in wb.worksheets:
-        max_widths: Dict[int, int] = {}
-        for row in ws.iter_rows():
-            for cell in row:
-                if cell.value is None:
-                    continue
-                val = str(cell.value)
-                max_widths[cell.column] = max(max_widths.get(cell.column, 0), len(val))
-                cell.border = border
-        for col_idx, width in max_widths.items():
-            col_letter = get_column_letter(col_idx)
-            ws.column_dimensions[col_letter].width = min(max(width + 2, 10), 60)
+    wb.add_named_style(NamedStyle(name=_XLSX_CELL_STYLE, border=Border(top=thin, left=thin, right=thin, bottom=thin)))
+    for title, rows in sheets:
+        ws = wb.create_sheet(title)
+        # Write-only sheets emit <cols> before any row, so widths are computed from the rows first.
+        for col_idx, width in _xlsx_column_widths(rows).items():
+            ws.column_dimensions[get_column_letter(col_idx)].width = min(max(width + 2, 10), 60)
+        for row in rows:
+            ws.append([_xlsx_cell(ws, value) for value in row])
+    out = tempfile.SpooledTemporaryFile(max_size=_XLSX_SPOOL_MAX_BYTES)
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
+def _xlsx_cell(ws, value: object):
+    if value is None:
+        return None
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = _XLSX_CELL_STYLE
+    return cell
+
+
+def _iter_file_chunks(fileobj: BinaryIO, chunk_size: int = 64 * 1024):
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # Only the API server runs these; scripts and tests import app.main without starting it.
+    try:
+        _recover_export_jobs()
+    except Exception:
+        logging.exception("Export job recovery failed")
+    # Profit summaries read only topup_profit_facts, so topups completed before the table existed
+    # are recorded once the schema is current; afterwards this is one query that finds nothing.
+    try:
+        _backfill_profit_facts_on_startup()
+    except Exception:
+        logging.exception("Profit fact backfill failed")
+    yield
 
 
-app = FastAPI(title="Envidicy Media Plan API", version="0.2.0")
+app = FastAPI(title="Envidicy Media Plan API", version="0.2.0", lifespan=_lifespan)
 
 
 def _normalize_origin(origin: str) -> str:
@@ -2583,8 +2885,10 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+
 # Log unhandled errors to Render runtime logs for debugging.
 @app.middleware("http")
 async def log_exceptions(request: Request, call_next):
@@ -2595,11 +2899,11 @@ async def log_exceptions(request: Request, call_next):
         logging.error(traceback.format_exc())
         raise
 try:
-    from app.db import apply_schema
+    from app.db import ensure_schema
 
-    apply_schema()
+    ensure_schema()
 except Exception:
-    pass
+    logging.exception("Database schema check failed")
 
 ADMIN_EMAILS = {"romant997@gmail.com", "kolyadov.denis@gmail.com"}
 BENEFICIARY = {
@@ -3388,7 +3692,7 @@ def estimate_plan_excel(payload: PlanRequest):
         "Content-Disposition": 'attachment; filename="mediaplan.xlsx"'
     }
     return StreamingResponse(
-        workbook,
+        _iter_file_chunks(workbook),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers=headers,
     )
@@ -3415,13 +3719,41 @@ async def fact_weekly(
 @app.post("/fact/weekly/excel")
 async def fact_weekly_excel(
     plan_payload: PlanRequest,
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    campaign_id: Optional[int] = None,
+    run_async: bool = Query(False, alias="async"),
+    authorization: Optional[str] = Header(None),
 ):
-    content = await file.read()
-    csv_text = content.decode("utf-8")
-    fact_rows = parse_fact_csv(csv_text)
+    if run_async:
+        if file is not None or not campaign_id:
+            raise HTTPException(status_code=400, detail="async export needs campaign_id instead of an uploaded file")
+        current_user = _get_user_by_token(_get_bearer_token(authorization))
+        return _enqueue_export_job(current_user, "plan_vs_fact_xlsx", _export_job_params(locals()))
     plan = estimate_plan(plan_payload)
-    weekly, unmatched = aggregate_weekly(plan, fact_rows, plan_payload.match_strategy or "account")
+    strategy = plan_payload.match_strategy or "account"
+    if file is not None:
+        content = await file.read()
+        csv_text = content.decode("utf-8")
+        fact_rows = parse_fact_csv(csv_text)
+        weekly, unmatched = aggregate_weekly(plan, fact_rows, strategy)
+    elif campaign_id:
+        # Stored facts: weekly buckets come from fact_weekly_agg, raw rows are only read for the fact sheet.
+        with get_conn() as conn:
+            weekly, unmatched = aggregate_weekly_db(conn, plan, campaign_id, strategy)
+            fact_rows = [
+                _fact_row_from_db(row)
+                for row in conn.execute(
+                    """
+                    SELECT date, platform, ad_account_id, campaign_name, impressions, clicks, cost, leads, conversions, views
+                    FROM fact_rows
+                    WHERE campaign_id=?
+                    ORDER BY date, id
+                    """,
+                    (campaign_id,),
+                ).fetchall()
+            ]
+    else:
+        raise HTTPException(status_code=400, detail="Upload a fact CSV or pass campaign_id")
     plan.fact_weekly = weekly
     plan.fact_raw = fact_rows
     plan.unmatched_fact = unmatched
@@ -3430,7 +3762,7 @@ async def fact_weekly_excel(
         "Content-Disposition": 'attachment; filename="mediaplan_plan_vs_fact.xlsx"'
     }
     return StreamingResponse(
-        workbook,
+        _iter_file_chunks(workbook),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers=headers,
     )
@@ -3460,75 +3792,136 @@ def save_plan(campaign_id: int, payload: PlanRequest):
     return {"status": "ok", "plan": plan}
 
 
+def _merge_fact_rows_by_natural_key(rows: List[FactRow]) -> List[FactRow]:
+    """Sum rows of one upload that share (date, platform, ad_account_id, campaign_name)."""
+    merged: Dict[Tuple[date, str, str, str], FactRow] = {}
+    for row in rows:
+        key = (row.date, row.platform, row.ad_account_id or "", row.campaign_name or "")
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = row.model_copy()
+            continue
+        existing.impressions += row.impressions
+        existing.clicks += row.clicks
+        existing.cost += row.cost
+        existing.leads += row.leads
+        existing.conversions += row.conversions
+        existing.views += row.views
+    return list(merged.values())
+
+
+_FACT_ROW_COLUMNS = (
+    "campaign_id",
+    "date",
+    "platform",
+    "ad_account_id",
+    "campaign_name",
+    "impressions",
+    "clicks",
+    "cost",
+    "leads",
+    "conversions",
+    "views",
+    "raw",
+)
+
+
 @app.post("/fact/import")
 async def import_fact(campaign_id: int, file: UploadFile = File(...)):
+    """Upsert fact rows by natural key: re-importing an overlapping window replaces those days instead of duplicating them."""
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
     content = await file.read()
     csv_text = content.decode("utf-8")
-    fact_rows = parse_fact_csv(csv_text)
+    parsed_rows = parse_fact_csv(csv_text)
+    fact_rows = _merge_fact_rows_by_natural_key(parsed_rows)
     with get_conn() as conn:
-        for r in fact_rows:
-            conn.execute(
-                """
-                INSERT INTO fact_rows (campaign_id, date, platform, ad_account_id, campaign_name, impressions, clicks, cost, leads, conversions, views, raw)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, json(?))
-                """,
-                (
-                    campaign_id,
-                    r.date.isoformat(),
-                    r.platform,
-                    r.ad_account_id,
-                    r.campaign_name,
-                    r.impressions,
-                    r.clicks,
-                    r.cost,
-                    r.leads,
-                    r.conversions,
-                    r.views,
-                    r.model_dump_json(),
-                ),
+        if fact_rows:
+            bulk_upsert(
+                conn,
+                "fact_rows",
+                _FACT_ROW_COLUMNS,
+                [
+                    (
+                        campaign_id,
+                        r.date.isoformat(),
+                        r.platform,
+                        r.ad_account_id,
+                        r.campaign_name,
+                        r.impressions,
+                        r.clicks,
+                        r.cost,
+                        r.leads,
+                        r.conversions,
+                        r.views,
+                        r.model_dump_json(),
+                    )
+                    for r in fact_rows
+                ],
+                conflict=FACT_ROWS_NATURAL_KEY,
+                update=("impressions", "clicks", "cost", "leads", "conversions", "views", "raw"),
             )
+        if fact_rows:
+            if _campaign_fact_version(conn, campaign_id) > 0:
+                _refresh_fact_weekly_agg(
+                    conn,
+                    campaign_id,
+                    min(r.date for r in fact_rows),
+                    max(r.date for r in fact_rows),
+                )
+            else:
+                _refresh_fact_weekly_agg(conn, campaign_id)
+            _bump_campaign_fact_version(conn, campaign_id)
         conn.commit()
-    return {"status": "ok", "rows": len(fact_rows)}
+    return {"status": "ok", "rows": len(parsed_rows), "unique_rows": len(fact_rows)}
+
+
+
+def _weekly_report_cache_get(key: Tuple[int, int]) -> Optional[Dict[str, object]]:
+    with _WEEKLY_REPORT_CACHE_LOCK:
+        entry = _WEEKLY_REPORT_CACHE.get(key)
+        if entry is not None:
+            _WEEKLY_REPORT_CACHE.move_to_end(key)
+        return entry
+
+
+def _weekly_report_cache_put(key: Tuple[int, int], entry: Dict[str, object]) -> None:
+    # LRU: every (campaign, plan) pair gets a slot, so evict the least recently used beyond the cap.
+    with _WEEKLY_REPORT_CACHE_LOCK:
+        _WEEKLY_REPORT_CACHE[key] = entry
+        _WEEKLY_REPORT_CACHE.move_to_end(key)
+        while len(_WEEKLY_REPORT_CACHE) > _WEEKLY_REPORT_CACHE_MAX:
+            _WEEKLY_REPORT_CACHE.popitem(last=False)
 
 
 @app.get("/reports/weekly")
-def report_weekly(campaign_id: int, plan_id: Optional[int] = None):
+def report_weekly(campaign_id: int, plan_id: Optional[int] = None, if_none_match: Optional[str] = Header(None)):
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
     with get_conn() as conn:
         if plan_id:
-            row = conn.execute("SELECT result FROM plans WHERE id=? AND campaign_id=?", (plan_id, campaign_id)).fetchone()
+            row = conn.execute("SELECT id, result FROM plans WHERE id=? AND campaign_id=?", (plan_id, campaign_id)).fetchone()
         else:
             row = conn.execute(
-                "SELECT result FROM plans WHERE campaign_id=? ORDER BY id DESC LIMIT 1",
+                "SELECT id, result FROM plans WHERE campaign_id=? ORDER BY id DESC LIMIT 1",
                 (campaign_id,),
             ).fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Plan not found")
+        resolved_plan_id = int(row["id"])
+        fact_version = _ensure_fact_weekly_agg(conn, campaign_id)
+        headers = {"ETag": f'"weekly-{campaign_id}-{resolved_plan_id}-{fact_version}"'}
+        if if_none_match and if_none_match == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        cache_key = (campaign_id, resolved_plan_id)
+        cached = _weekly_report_cache_get(cache_key)
+        if cached and cached.get("version") == fact_version:
+            return JSONResponse(cached["data"], headers=headers)
         plan = PlanResponse.model_validate_json(row["result"])
-        fact_rows_db = conn.execute(
-            "SELECT * FROM fact_rows WHERE campaign_id=?",
-            (campaign_id,),
-        ).fetchall()
-    fact_rows = [
-        FactRow(
-            date=x["date"],
-            platform=x["platform"],
-            ad_account_id=x["ad_account_id"],
-            campaign_name=x["campaign_name"],
-            impressions=x["impressions"],
-            clicks=x["clicks"],
-            cost=x["cost"],
-            leads=x["leads"],
-            conversions=x["conversions"],
-            views=x["views"],
-        )
-        for x in fact_rows_db
-    ]
-    weekly = aggregate_weekly(plan, fact_rows)
-    return {"weekly": weekly}
+        weekly = aggregate_weekly_db(conn, plan, campaign_id)
+    data = jsonable_encoder({"weekly": weekly})
+    _weekly_report_cache_put(cache_key, {"version": fact_version, "data": data})
+    return JSONResponse(data, headers=headers)
 
 
 class TopUpStatus(str, Enum):
@@ -3649,77 +4042,353 @@ def _get_access_by_email(conn, email: str):
 
 
 def _issue_user_token(conn, user_id: int, login_email: Optional[str] = None) -> str:
+    if _AUTH_SIGNED_TOKENS:
+        return _issue_signed_token(conn, user_id, login_email)
     token = secrets.token_hex(24)
-    conn.execute("INSERT INTO user_tokens (user_id, token, login_email) VALUES (?, ?, ?)", (user_id, token, _normalize_email(login_email) or None))
+    conn.execute(
+        "INSERT INTO user_tokens (user_id, token, login_email, expires_at) VALUES (?, ?, ?, ?)",
+        (user_id, token, _normalize_email(login_email) or None, _token_expires_at()),
+    )
+    _maybe_compact_user_tokens()
     return token
 
 
-def _can_manage_accesses(conn, user_id: int, login_email: str) -> bool:
-    access = _get_access_by_email(conn, login_email)
-    if access and access.get("user_id") == user_id:
-        return (access.get("role") or "member") == "owner"
-    user = conn.execute("SELECT email FROM users WHERE id=?", (user_id,)).fetchone()
-    return bool(user and _normalize_email(user["email"]) == _normalize_email(login_email))
-
+def _token_expires_at() -> Optional[str]:
+    if _AUTH_TOKEN_TTL_SEC <= 0:
+        return None
+    return _utc_timestamp(datetime.utcnow() + timedelta(seconds=_AUTH_TOKEN_TTL_SEC))
 
-def _hydrate_token_user(conn, row):
-    user = dict(row)
-    login_email = _normalize_email(user.get("login_email") or user.get("email"))
-    user["primary_email"] = user.get("email")
-    user["email"] = login_email or user.get("email")
-    user["can_manage_accesses"] = _can_manage_accesses(conn, user["id"], user["email"])
-    return user
 
+def _delete_token_batches(conn, select_ids_sql: str, params: Tuple, batch_size: int) -> int:
+    deleted = 0
+    while True:
+        ids = [int(row["id"]) for row in conn.execute(select_ids_sql, (*params, batch_size)).fetchall()]
+        if not ids:
+            return deleted
+        placeholders = ",".join(["?"] * len(ids))
+        conn.execute(f"DELETE FROM user_tokens WHERE id IN ({placeholders})", ids)
+        conn.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
 
-def _agency_slugify(value: Optional[str], fallback: str) -> str:
-    text = re.sub(r"[^a-z0-9]+", "-", str(value or "").lower()).strip("-")
-    return text or fallback
 
+def compact_user_tokens(conn, batch_size: int = 500) -> Dict[str, int]:
+    """Purge expired tokens and all but the newest AUTH_TOKENS_PER_LOGIN per login, in committed batches.
 
-def _ensure_agency_member(conn, agency_id: int, user_id: int, role: str = "client_viewer", status: str = "active") -> None:
-    conn.execute(
+    Tokens issued before expiry existed get a fresh TTL instead of being dropped at once.
+    """
+    now = _utc_timestamp()
+    stamped = 0
+    if _AUTH_TOKEN_TTL_SEC > 0:
+        while True:
+            cur = conn.execute(
+                "UPDATE user_tokens SET expires_at=? WHERE id IN (SELECT id FROM user_tokens WHERE expires_at IS NULL LIMIT ?)",
+                (_token_expires_at(), batch_size),
+            )
+            conn.commit()
+            stamped += max(int(cur.rowcount or 0), 0)
+            if (cur.rowcount or 0) < batch_size:
+                break
+    expired = _delete_token_batches(
+        conn,
+        "SELECT id FROM user_tokens WHERE expires_at < ? ORDER BY expires_at LIMIT ?",
+        (now,),
+        batch_size,
+    )
+    superseded = _delete_token_batches(
+        conn,
         """
-        INSERT OR IGNORE INTO agency_members (agency_id, user_id, role, status)
-        VALUES (?, ?, ?, ?)
+        SELECT id FROM (
+          SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY user_id, COALESCE(login_email, '') ORDER BY created_at DESC, id DESC
+          ) AS rn
+          FROM user_tokens
+        ) ranked
+        WHERE rn > ?
+        LIMIT ?
         """,
-        (agency_id, user_id, role, status),
+        (_AUTH_TOKENS_PER_LOGIN,),
+        batch_size,
     )
+    result = {"stamped": stamped, "expired": expired, "superseded": superseded}
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["last_compaction_at"] = now
+        _AUTH_STATS["last_compaction"] = result
+    return result
 
 
-def _ensure_agency_account_mapping(conn, agency_id: int, ad_account_id: int, label: Optional[str] = None, status: str = "active") -> Optional[int]:
-    conn.execute(
-        """
-        INSERT OR IGNORE INTO agency_ad_accounts (agency_id, ad_account_id, label, status)
-        VALUES (?, ?, ?, ?)
-        """,
-        (agency_id, ad_account_id, label, status),
-    )
-    row = conn.execute(
-        "SELECT id FROM agency_ad_accounts WHERE agency_id=? AND ad_account_id=?",
-        (agency_id, ad_account_id),
-    ).fetchone()
-    return int(row["id"]) if row else None
+def _run_token_compaction() -> None:
+    try:
+        with get_conn() as conn:
+            compact_user_tokens(conn)
+    except Exception:
+        logging.exception("User token compaction failed")
 
 
-def _get_or_create_default_agency(conn, user_id: int) -> Optional[Dict[str, object]]:
+def _maybe_compact_user_tokens() -> None:
+    """Kick off compaction in the background at most once per interval per process."""
+    global _AUTH_LAST_COMPACT_TS
+    now = time.monotonic()
+    with _AUTH_STATS_LOCK:
+        if _AUTH_LAST_COMPACT_TS and now - _AUTH_LAST_COMPACT_TS < _AUTH_TOKEN_COMPACT_INTERVAL_SEC:
+            return
+        _AUTH_LAST_COMPACT_TS = now
+    _AUTH_TOKEN_COMPACT_EXECUTOR.submit(_run_token_compaction)
+
+
+def _user_tokens_stats(conn) -> Dict[str, object]:
     row = conn.execute(
-        """
-        SELECT a.*
-        FROM agencies a
-        JOIN agency_members m ON m.agency_id = a.id
-        WHERE m.user_id=? AND m.role='owner'
-        ORDER BY a.id
-        LIMIT 1
-        """,
-        (user_id,),
+        "SELECT COUNT(*) AS total, COUNT(expires_at) AS with_expiry, SUM(CASE WHEN expires_at < ? THEN 1 ELSE 0 END) AS expired FROM user_tokens",
+        (_utc_timestamp(),),
     ).fetchone()
-    if row:
-        agency = dict(row)
-    else:
-        user = conn.execute(
-            """
-            SELECT u.id, u.email, up.company
-            FROM users u
+    with _AUTH_STATS_LOCK:
+        stats = dict(_AUTH_STATS)
+    lookups = int(stats["lookups"] or 0)
+    stats["lookup_ms_avg"] = round(float(stats["lookup_ms_total"]) / lookups, 3) if lookups else 0.0
+    stats["lookup_ms_total"] = round(float(stats["lookup_ms_total"]), 3)
+    stats["lookup_ms_max"] = round(float(stats["lookup_ms_max"]), 3)
+    stats["table"] = {key: int(value or 0) for key, value in dict(row).items()}
+    stats["ttl_sec"] = _AUTH_TOKEN_TTL_SEC
+    stats["tokens_per_login"] = _AUTH_TOKENS_PER_LOGIN
+    return stats
+
+
+def _b64url(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign_token_body(body: str) -> str:
+    return _b64url(hmac.new(_AUTH_TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).digest())
+
+
+def _load_token_epoch(conn, user_id: int) -> int:
+    row = conn.execute("SELECT epoch FROM user_token_epochs WHERE user_id=?", (user_id,)).fetchone()
+    return int(row["epoch"]) if row else 0
+
+
+def _token_epoch(user_id: int, refresh: bool = False) -> int:
+    cached = _AUTH_EPOCH_CACHE.get(user_id)
+    now = time.monotonic()
+    if cached and not refresh and now - cached[0] < _AUTH_EPOCH_CACHE_TTL_SEC:
+        return cached[1]
+    with get_conn() as conn:
+        epoch = _load_token_epoch(conn, user_id)
+    _AUTH_EPOCH_CACHE[user_id] = (now, epoch)
+    return epoch
+
+
+def _issue_signed_token(conn, user_id: int, login_email: Optional[str] = None) -> str:
+    """HMAC-signed token with everything get_current_user needs, so verifying it needs no query."""
+    user = conn.execute("SELECT email FROM users WHERE id=?", (user_id,)).fetchone()
+    primary_email = user["email"] if user else None
+    email = _normalize_email(login_email) or primary_email
+    claims = {
+        "uid": int(user_id),
+        "lem": _normalize_email(login_email) or None,
+        "pem": primary_email,
+        "cma": _can_manage_accesses(conn, user_id, email or ""),
+        "iat": int(time.time()),
+        "ep": _load_token_epoch(conn, user_id),
+    }
+    body = _b64url(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{_SIGNED_TOKEN_PREFIX}{body}.{_sign_token_body(body)}"
+
+
+def _user_from_signed_token(token: str) -> Optional[Dict[str, object]]:
+    if not _AUTH_TOKEN_SECRET:
+        return None
+    try:
+        body, signature = token[len(_SIGNED_TOKEN_PREFIX):].split(".", 1)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(_sign_token_body(body), signature):
+        return None
+    try:
+        claims = json.loads(_b64url_decode(body))
+        user_id = int(claims["uid"])
+    except Exception:
+        return None
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["signed_verifications"] += 1
+    if _AUTH_TOKEN_TTL_SEC > 0 and int(claims.get("iat") or 0) + _AUTH_TOKEN_TTL_SEC < time.time():
+        return None
+    token_epoch = int(claims.get("ep") or 0)
+    epoch = _token_epoch(user_id)
+    if token_epoch > epoch:
+        # Issued after a revocation this process has not seen yet (e.g. on another instance).
+        epoch = _token_epoch(user_id, refresh=True)
+    if token_epoch != epoch:
+        return None
+    return {
+        "id": user_id,
+        "email": claims.get("lem") or claims.get("pem"),
+        "primary_email": claims.get("pem"),
+        "login_email": claims.get("lem"),
+        "can_manage_accesses": bool(claims.get("cma")),
+    }
+
+
+def _forget_token_epoch(user_id: int) -> None:
+    """Evict a cached epoch; call after the transaction that bumped it has committed."""
+    _AUTH_EPOCH_CACHE.pop(int(user_id), None)
+
+
+def _revoke_user_tokens(conn, user_id: int, login_email: Optional[str] = None) -> None:
+    """Invalidate stored tokens and bump the signed-token epoch (signed tokens are revoked per user).
+
+    The caller commits and then calls _forget_token_epoch; evicting earlier lets a concurrent
+    request re-cache the old epoch before the bump is visible.
+    """
+    if login_email:
+        conn.execute("DELETE FROM user_tokens WHERE user_id=? AND login_email=?", (user_id, login_email))
+    else:
+        conn.execute("DELETE FROM user_tokens WHERE user_id=?", (user_id,))
+    conn.execute(
+        """
+        INSERT INTO user_token_epochs (user_id, epoch, updated_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET epoch=user_token_epochs.epoch + 1, updated_at=CURRENT_TIMESTAMP
+        """,
+        (user_id,),
+    )
+
+
+def _can_manage_accesses(conn, user_id: int, login_email: str) -> bool:
+    access = _get_access_by_email(conn, login_email)
+    if access and access.get("user_id") == user_id:
+        return (access.get("role") or "member") == "owner"
+    user = conn.execute("SELECT email FROM users WHERE id=?", (user_id,)).fetchone()
+    return bool(user and _normalize_email(user["email"]) == _normalize_email(login_email))
+
+
+def _hydrate_token_user(conn, row):
+    user = dict(row)
+    login_email = _normalize_email(user.get("login_email") or user.get("email"))
+    user["primary_email"] = user.get("email")
+    user["email"] = login_email or user.get("email")
+    user["can_manage_accesses"] = _can_manage_accesses(conn, user["id"], user["email"])
+    return user
+
+
+def _agency_slugify(value: Optional[str], fallback: str) -> str:
+    text = re.sub(r"[^a-z0-9]+", "-", str(value or "").lower()).strip("-")
+    return text or fallback
+
+
+def _invalidate_visible_accounts(conn, user_ids) -> None:
+    """Bump the users' list versions; _list_accessible_accounts rebuilds them on next read."""
+    ids = sorted({int(user_id) for user_id in user_ids if user_id})
+    if not ids:
+        return
+    # The bump comes first: it locks the state rows, so a concurrent rebuild either commits before
+    # it (and is dropped below) or fails its version check.
+    conn.executemany(
+        """
+        INSERT INTO user_visible_accounts_state (user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version=user_visible_accounts_state.version + 1
+        """,
+        [(user_id,) for user_id in ids],
+    )
+    placeholders = ",".join(["?"] * len(ids))
+    conn.execute(f"DELETE FROM user_visible_accounts WHERE user_id IN ({placeholders})", ids)
+
+
+def _agency_member_ids(conn, agency_id: int) -> List[int]:
+    rows = conn.execute("SELECT user_id FROM agency_members WHERE agency_id=?", (agency_id,)).fetchall()
+    return [int(row["user_id"]) for row in rows]
+
+
+def _account_audience_ids(conn, account_id: int) -> List[int]:
+    """Everyone whose account list can change with this account: owner, members of mapped agencies, current viewers."""
+    rows = conn.execute(
+        """
+        SELECT user_id FROM ad_accounts WHERE id=?
+        UNION
+        SELECT m.user_id
+        FROM agency_ad_accounts aa
+        JOIN agency_members m ON m.agency_id = aa.agency_id
+        WHERE aa.ad_account_id=?
+        UNION
+        SELECT user_id FROM user_visible_accounts WHERE account_id=?
+        """,
+        (account_id, account_id, account_id),
+    ).fetchall()
+    return [int(row["user_id"]) for row in rows if row["user_id"] is not None]
+
+
+def _ensure_agency_member(conn, agency_id: int, user_id: int, role: str = "client_viewer", status: str = "active") -> None:
+    cur = conn.execute(
+        """
+        INSERT OR IGNORE INTO agency_members (agency_id, user_id, role, status)
+        VALUES (?, ?, ?, ?)
+        """,
+        (agency_id, user_id, role, status),
+    )
+    if cur.rowcount:
+        _invalidate_visible_accounts(conn, [user_id])
+
+
+def _ensure_agency_account_mapping(conn, agency_id: int, ad_account_id: int, label: Optional[str] = None, status: str = "active") -> Optional[int]:
+    cur = conn.execute(
+        """
+        INSERT OR IGNORE INTO agency_ad_accounts (agency_id, ad_account_id, label, status)
+        VALUES (?, ?, ?, ?)
+        """,
+        (agency_id, ad_account_id, label, status),
+    )
+    if cur.rowcount:
+        _invalidate_visible_accounts(conn, _agency_member_ids(conn, agency_id))
+    row = conn.execute(
+        "SELECT id FROM agency_ad_accounts WHERE agency_id=? AND ad_account_id=?",
+        (agency_id, ad_account_id),
+    ).fetchone()
+    return int(row["id"]) if row else None
+
+
+def _map_owned_accounts_to_agency(conn, agency_id: int, user_id: int) -> None:
+    """Map all of the user's own ad accounts into their agency with one INSERT ... SELECT."""
+    cur = conn.execute(
+        """
+        INSERT OR IGNORE INTO agency_ad_accounts (agency_id, ad_account_id, label, status)
+        SELECT ?, a.id, a.name, COALESCE(a.status, 'active')
+        FROM ad_accounts a
+        WHERE a.user_id=?
+        """,
+        (agency_id, user_id),
+    )
+    if cur.rowcount:
+        _invalidate_visible_accounts(conn, _agency_member_ids(conn, agency_id))
+
+
+def _get_or_create_default_agency(conn, user_id: int) -> Optional[Dict[str, object]]:
+    """Write-path bootstrap: called on registration and account creation, never from reads.
+
+    Users created before this ran at registration are covered by
+    scripts/backfill_agencies.py (backfill_default_agencies).
+    """
+    row = conn.execute(
+        """
+        SELECT a.*
+        FROM agencies a
+        JOIN agency_members m ON m.agency_id = a.id
+        WHERE m.user_id=? AND m.role='owner'
+        ORDER BY a.id
+        LIMIT 1
+        """,
+        (user_id,),
+    ).fetchone()
+    if row:
+        # Existing agencies are not re-mapped here: account write paths map their new account.
+        agency = dict(row)
+    else:
+        user = conn.execute(
+            """
+            SELECT u.id, u.email, up.company
+            FROM users u
             LEFT JOIN user_profiles up ON up.user_id = u.id
             WHERE u.id=?
             """,
@@ -3727,7 +4396,7 @@ def _get_or_create_default_agency(conn, user_id: int) -> Optional[Dict[str, obje
         ).fetchone()
         if not user:
             return None
-        base_name = user.get("company") or f"Agency {user_id}"
+        base_name = dict(user).get("company") or f"Agency {user_id}"
         slug_base = _agency_slugify(base_name, f"agency-{user_id}")
         slug = slug_base
         suffix = 2
@@ -3751,23 +4420,53 @@ def _get_or_create_default_agency(conn, user_id: int) -> Optional[Dict[str, obje
         agency = dict(
             conn.execute("SELECT * FROM agencies WHERE id=?", (agency_id,)).fetchone()
         )
-
-    _ensure_agency_member(conn, int(agency["id"]), user_id, role="owner", status="active")
-    account_rows = conn.execute(
-        "SELECT id, name, status FROM ad_accounts WHERE user_id=? ORDER BY id",
-        (user_id,),
-    ).fetchall()
-    for account in account_rows:
-        _ensure_agency_account_mapping(
-            conn,
-            int(agency["id"]),
-            int(account["id"]),
-            label=account.get("name"),
-            status=account.get("status") or "active",
-        )
+        _map_owned_accounts_to_agency(conn, int(agency["id"]), user_id)
     return agency
 
 
+def backfill_default_agencies(conn, batch_size: int = 200) -> Dict[str, int]:
+    """One-off bootstrap for existing users: default agencies, then all owner mappings in one statement."""
+    created = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT u.id
+            FROM users u
+            WHERE NOT EXISTS (SELECT 1 FROM agency_members m WHERE m.user_id = u.id AND m.role='owner')
+            ORDER BY u.id
+            LIMIT ?
+            """,
+            (batch_size,),
+        ).fetchall()
+        if not rows:
+            break
+        batch_created = sum(1 for row in rows if _get_or_create_default_agency(conn, int(row["id"])))
+        conn.commit()
+        created += batch_created
+        if not batch_created:
+            break
+    cur = conn.execute(
+        """
+        INSERT OR IGNORE INTO agency_ad_accounts (agency_id, ad_account_id, label, status)
+        SELECT o.agency_id, a.id, a.name, COALESCE(a.status, 'active')
+        FROM ad_accounts a
+        JOIN (
+          SELECT user_id, MIN(agency_id) AS agency_id
+          FROM agency_members
+          WHERE role='owner'
+          GROUP BY user_id
+        ) o ON o.user_id = a.user_id
+        """
+    )
+    mapped = max(int(cur.rowcount or 0), 0)
+    if mapped:
+        # Cheaper than working out every affected member; lists are rebuilt lazily.
+        conn.execute("UPDATE user_visible_accounts_state SET version = version + 1")
+        conn.execute("DELETE FROM user_visible_accounts")
+    conn.commit()
+    return {"agencies_created": created, "accounts_mapped": mapped}
+
+
 def _list_user_agency_memberships(conn, user_id: int) -> List[Dict[str, object]]:
     try:
         rows = conn.execute(
@@ -3791,7 +4490,53 @@ def _list_user_agency_memberships(conn, user_id: int) -> List[Dict[str, object]]
         return []
 
 
+_VISIBLE_ACCOUNTS_SQL = """
+    SELECT a.*
+    FROM user_visible_accounts v
+    JOIN ad_accounts a ON a.id = v.account_id
+    WHERE v.user_id=?
+    ORDER BY a.created_at DESC
+"""
+
+
 def _list_accessible_accounts(conn, current_user) -> List[Dict[str, object]]:
+    """Accounts the user may see.
+
+    Admins see every account. For everyone else the result of the agency ACL
+    walk (_compute_accessible_accounts) is materialized in user_visible_accounts
+    and read back with one indexed join until _invalidate_visible_accounts bumps
+    the user's version. A rebuild is written in the caller's transaction and only
+    if the version is unchanged since it was read; the caller commits.
+    """
+    if current_user["email"] in ADMIN_EMAILS or current_user.get("primary_email") in ADMIN_EMAILS:
+        rows = conn.execute("SELECT * FROM ad_accounts ORDER BY created_at DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    user_id = int(current_user["id"])
+    state = conn.execute(
+        "SELECT version, cached_version FROM user_visible_accounts_state WHERE user_id=?", (user_id,)
+    ).fetchone()
+    version = int(state["version"]) if state else 0
+    if state and state["cached_version"] is not None and int(state["cached_version"]) == version:
+        rows = conn.execute(_VISIBLE_ACCOUNTS_SQL, (user_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    accounts = _compute_accessible_accounts(conn, current_user)
+    conn.execute("INSERT OR IGNORE INTO user_visible_accounts_state (user_id) VALUES (?)", (user_id,))
+    stored = conn.execute(
+        "UPDATE user_visible_accounts_state SET cached_version=?, refreshed_at=CURRENT_TIMESTAMP WHERE user_id=? AND version=?",
+        (version, user_id, version),
+    ).rowcount
+    if stored:
+        conn.execute("DELETE FROM user_visible_accounts WHERE user_id=?", (user_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO user_visible_accounts (user_id, account_id) VALUES (?, ?)",
+            [(user_id, int(row["id"])) for row in accounts],
+        )
+    return accounts
+
+
+def _compute_accessible_accounts(conn, current_user) -> List[Dict[str, object]]:
     def _is_client_visible(row: Dict[str, object]) -> bool:
         flag = row.get("visible_to_client", 1)
         if flag is None:
@@ -3806,19 +4551,7 @@ def _list_accessible_accounts(conn, current_user) -> List[Dict[str, object]]:
     fallback_accounts = [dict(row) for row in fallback_rows]
     fallback_visible = [row for row in fallback_accounts if _is_client_visible(row)]
 
-    if current_user["email"] in ADMIN_EMAILS or current_user.get("primary_email") in ADMIN_EMAILS:
-        rows = conn.execute("SELECT * FROM ad_accounts ORDER BY created_at DESC").fetchall()
-        return [dict(row) for row in rows]
-
     memberships = _list_user_agency_memberships(conn, user_id)
-    if not memberships:
-        try:
-            _get_or_create_default_agency(conn, user_id)
-            memberships = _list_user_agency_memberships(conn, user_id)
-        except Exception:
-            logging.exception("Agency bootstrap failed for user_id=%s; fallback to direct accounts", user_id)
-            memberships = []
-
     if not memberships:
         return fallback_visible
 
@@ -3826,15 +4559,17 @@ def _list_accessible_accounts(conn, current_user) -> List[Dict[str, object]]:
     if admin_agency_ids:
         try:
             placeholders = ",".join(["?"] * len(admin_agency_ids))
+            # Every user owns a default agency since registration, so grants from other agencies add to it.
             rows = conn.execute(
                 f"""
                 SELECT DISTINCT a.*
                 FROM ad_accounts a
                 JOIN agency_ad_accounts aa ON aa.ad_account_id = a.id
                 WHERE aa.agency_id IN ({placeholders})
+                   OR aa.id IN (SELECT agency_ad_account_id FROM agency_user_account_access WHERE user_id=?)
                 ORDER BY a.created_at DESC
                 """,
-                admin_agency_ids,
+                [*admin_agency_ids, user_id],
             ).fetchall()
             out = [dict(row) for row in rows]
             return [row for row in out if _is_client_visible(row)]
@@ -3870,21 +4605,36 @@ def _get_bearer_token(authorization: Optional[str]) -> Optional[str]:
     return parts[1].strip()
 
 
+_TOKEN_USER_SQL = """
+    SELECT u.*, ut.login_email
+    FROM user_tokens ut
+    JOIN users u ON u.id = ut.user_id
+    WHERE ut.token=? AND (ut.expires_at IS NULL OR ut.expires_at > ?)
+"""
+
+
+def _lookup_token_user(conn, token: str):
+    started = time.perf_counter()
+    row = conn.execute(_TOKEN_USER_SQL, (token, _utc_timestamp())).fetchone()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["lookups"] += 1
+        _AUTH_STATS["lookup_ms_total"] += elapsed_ms
+        _AUTH_STATS["lookup_ms_max"] = max(_AUTH_STATS["lookup_ms_max"], elapsed_ms)
+        if not row:
+            _AUTH_STATS["lookup_misses"] += 1
+    return row
+
+
 def _get_user_by_token(token: Optional[str]):
     if not token:
         return None
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
+    if token.startswith(_SIGNED_TOKEN_PREFIX):
+        return _user_from_signed_token(token)
     with get_conn() as conn:
-        row = conn.execute(
-            """
-            SELECT u.*, ut.login_email
-            FROM user_tokens ut
-            JOIN users u ON u.id = ut.user_id
-            WHERE ut.token=?
-            """,
-            (token,),
-        ).fetchone()
+        row = _lookup_token_user(conn, token)
         return _hydrate_token_user(conn, row) if row else None
 
 
@@ -3894,16 +4644,13 @@ def get_current_user(authorization: Optional[str] = Header(None)):
     token = _get_bearer_token(authorization)
     if not token:
         raise HTTPException(status_code=401, detail="Missing token")
+    if token.startswith(_SIGNED_TOKEN_PREFIX):
+        user = _user_from_signed_token(token)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return user
     with get_conn() as conn:
-        row = conn.execute(
-            """
-            SELECT u.*, ut.login_email
-            FROM user_tokens ut
-            JOIN users u ON u.id = ut.user_id
-            WHERE ut.token=?
-            """,
-            (token,),
-        ).fetchone()
+        row = _lookup_token_user(conn, token)
         if not row:
             raise HTTPException(status_code=401, detail="Invalid token")
         return _hydrate_token_user(conn, row)
@@ -4141,6 +4888,7 @@ def register(payload: AuthPayload):
         )
         user_id = cur.lastrowid
         _ensure_owner_access(conn, user_id)
+        _get_or_create_default_agency(conn, user_id)
         token = _issue_user_token(conn, user_id, email)
         conn.commit()
         _send_telegram_alert(
@@ -4225,8 +4973,9 @@ def set_password(payload: SetPasswordPayload):
                 "UPDATE users SET password_hash=?, salt=? WHERE id=?",
                 (password_hash, salt, access["user_id"]),
             )
-        conn.execute("DELETE FROM user_tokens WHERE user_id=?", (access["user_id"],))
+        _revoke_user_tokens(conn, access["user_id"])
         conn.commit()
+        _forget_token_epoch(access["user_id"])
         return {"status": "ok"}
 
 
@@ -4253,8 +5002,9 @@ def admin_reset_password(payload: PasswordReset, admin_user=Depends(get_admin_us
                 "UPDATE users SET password_hash=?, salt=? WHERE id=?",
                 (password_hash, salt, access["user_id"]),
             )
-        conn.execute("DELETE FROM user_tokens WHERE user_id=?", (access["user_id"],))
+        _revoke_user_tokens(conn, access["user_id"])
         conn.commit()
+        _forget_token_epoch(access["user_id"])
         return {"status": "ok"}
 
 
@@ -4933,34 +5683,35 @@ def _finance_collect_daily_rows_for_account(account: Dict[str, object], date_fro
     return prepared
 
 
-def _finance_upsert_daily_rows(conn, *, account: Dict[str, object], rows: List[Dict[str, object]]) -> None:
+_FINANCE_STATS_COLUMNS = (
+    "platform",
+    "account_id",
+    "client_id",
+    "account_external_id",
+    "stat_date",
+    "currency",
+    "spend",
+    "impressions",
+    "clicks",
+    "raw_payload_json",
+)
+
+
+def _finance_upsert_daily_rows(conn, *, account: Dict[str, object], rows: List[Dict[str, object]]) -> float:
+    """Upsert daily stats and return how much the account's total spend changed."""
     account_id = int(account.get("id") or 0)
     client_id = _finance_resolve_client_id(conn, account)
     if account_id <= 0 or client_id <= 0:
-        return
+        return 0.0
     platform = str(account.get("platform") or "").lower().strip()
     account_external_id = str(account.get("external_id") or account.get("account_code") or "")
     currency = str(account.get("currency") or "USD").upper()
+    values = []
     for row in rows:
         stat_date = str(row.get("date") or "").strip()
         if not stat_date:
             continue
-        conn.execute(
-            """
-            INSERT INTO ad_account_stats
-              (platform, account_id, client_id, account_external_id, stat_date, currency, spend, impressions, clicks, raw_payload_json, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ON CONFLICT(account_id, stat_date) DO UPDATE SET
-              platform=excluded.platform,
-              client_id=excluded.client_id,
-              account_external_id=excluded.account_external_id,
-              currency=excluded.currency,
-              spend=excluded.spend,
-              impressions=excluded.impressions,
-              clicks=excluded.clicks,
-              raw_payload_json=excluded.raw_payload_json,
-              updated_at=CURRENT_TIMESTAMP
-            """,
+        values.append(
             (
                 platform,
                 account_id,
@@ -4972,8 +5723,27 @@ def _finance_upsert_daily_rows(conn, *, account: Dict[str, object], rows: List[D
                 _finance_to_float(row.get("impressions")),
                 _finance_to_float(row.get("clicks")),
                 row.get("raw_payload_json"),
-            ),
+            )
         )
+    if not values:
+        return 0.0
+    if is_postgres():
+        # Concurrent syncs of one account would both diff against the same old rows; take turns.
+        conn.execute("SELECT account_id FROM ad_account_finance_snapshots WHERE account_id=? FOR UPDATE", (account_id,))
+    window = (account_id, min(v[4] for v in values), max(v[4] for v in values))
+    window_sql = "SELECT COALESCE(SUM(spend), 0) AS spend FROM ad_account_stats WHERE account_id=? AND stat_date BETWEEN ? AND ?"
+    spend_before = _finance_to_float(dict(conn.execute(window_sql, window).fetchone()).get("spend"))
+    bulk_upsert(
+        conn,
+        "ad_account_stats",
+        _FINANCE_STATS_COLUMNS,
+        values,
+        conflict="account_id, stat_date",
+        update=[c for c in _FINANCE_STATS_COLUMNS if c not in {"account_id", "stat_date"}],
+        set_sql="updated_at=CURRENT_TIMESTAMP",
+    )
+    spend_after = _finance_to_float(dict(conn.execute(window_sql, window).fetchone()).get("spend"))
+    return spend_after - spend_before
 
 
 def _finance_refresh_snapshot_for_account(
@@ -4981,7 +5751,15 @@ def _finance_refresh_snapshot_for_account(
     *,
     account: Dict[str, object],
     refresh_live_billing: bool = False,
+    spend_delta: Optional[float] = None,
 ) -> Dict[str, object]:
+    """Write the account's finance snapshot.
+
+    spend_total is carried forward from the previous snapshot plus spend_delta
+    (as returned by _finance_upsert_daily_rows); it is summed over the whole
+    history only for the first snapshot or when no delta is given.
+    reconcile_finance_snapshots checks the carried totals against the full sum.
+    """
     account_id = int(account.get("id") or 0)
     client_id = _finance_resolve_client_id(conn, account)
     if account_id <= 0 or client_id <= 0:
@@ -4991,18 +5769,24 @@ def _finance_refresh_snapshot_for_account(
     currency = str(account.get("currency") or "USD").upper()
 
     today_key = datetime.utcnow().date().isoformat()
-    total_row = conn.execute(
-        "SELECT COALESCE(SUM(spend), 0) AS total_spend FROM ad_account_stats WHERE account_id=?",
+    previous = conn.execute(
+        "SELECT spend_total FROM ad_account_finance_snapshots WHERE account_id=?",
         (account_id,),
     ).fetchone()
+    if previous is not None and spend_delta is not None:
+        spend_total = _finance_to_float(dict(previous).get("spend_total")) + spend_delta
+    else:
+        total_row = conn.execute(
+            "SELECT COALESCE(SUM(spend), 0) AS total_spend FROM ad_account_stats WHERE account_id=?",
+            (account_id,),
+        ).fetchone()
+        spend_total = _finance_to_float((dict(total_row) if total_row else {}).get("total_spend"))
+    # A single (account_id, stat_date) key lookup, independent of the account's age.
     today_row = conn.execute(
-        "SELECT COALESCE(SUM(spend), 0) AS today_spend FROM ad_account_stats WHERE account_id=? AND stat_date=?",
+        "SELECT spend FROM ad_account_stats WHERE account_id=? AND stat_date=?",
         (account_id, today_key),
     ).fetchone()
-    total_payload = dict(total_row) if total_row else {}
-    today_payload = dict(today_row) if today_row else {}
-    spend_total = _finance_to_float(total_payload.get("total_spend"))
-    spend_today = _finance_to_float(today_payload.get("today_spend"))
+    spend_today = _finance_to_float((dict(today_row) if today_row else {}).get("spend"))
 
     wallet = _get_or_create_wallet(conn, client_id)
     internal_client_balance = _finance_to_float(wallet.get("balance"))
@@ -5062,6 +5846,44 @@ def _finance_refresh_snapshot_for_account(
     }
 
 
+def reconcile_finance_snapshots(conn, *, fix: bool = True, tolerance: float = 0.005) -> Dict[str, object]:
+    """Compare carried spend_total in finance snapshots with the full ad_account_stats sum.
+
+    Drifted snapshots are logged and, with fix=True, reset to the full sum
+    (remaining_balance is recomputed from the stored internal balance).
+    """
+    rows = conn.execute(
+        """
+        SELECT s.account_id, s.spend_total, s.internal_client_balance, COALESCE(SUM(st.spend), 0) AS actual_total
+        FROM ad_account_finance_snapshots s
+        LEFT JOIN ad_account_stats st ON st.account_id = s.account_id
+        GROUP BY s.account_id, s.spend_total, s.internal_client_balance
+        """
+    ).fetchall()
+    drifted: List[Dict[str, object]] = []
+    for row in rows:
+        payload = dict(row)
+        recorded = _finance_to_float(payload.get("spend_total"))
+        actual = _finance_to_float(payload.get("actual_total"))
+        if abs(recorded - actual) <= tolerance:
+            continue
+        drifted.append({"account_id": payload["account_id"], "spend_total": round(recorded, 6), "actual_total": round(actual, 6)})
+        if fix:
+            conn.execute(
+                """
+                UPDATE ad_account_finance_snapshots
+                SET spend_total=?, remaining_balance=?, updated_at=CURRENT_TIMESTAMP
+                WHERE account_id=?
+                """,
+                (actual, _finance_to_float(payload.get("internal_client_balance")) - actual, payload["account_id"]),
+            )
+    if drifted:
+        logging.warning("Finance snapshot drift on %s account(s): %s", len(drifted), drifted[:20])
+    if fix:
+        conn.commit()
+    return {"checked": len(rows), "drifted": drifted, "fixed": bool(fix and drifted)}
+
+
 def _resolve_topup_account_amount(row: Dict[str, object], rates_data: Optional[Dict[str, object]] = None) -> Optional[float]:
     amount_input = row.get("amount_input")
     amount_net = row.get("amount_net")
@@ -5174,6 +5996,108 @@ def _attach_topup_account_amount(rows: List[Dict[str, object]]) -> List[Dict[str
     return prepared
 
 
+_TOPUP_PROFIT_FACT_COLUMNS = (
+    "topup_id",
+    "user_id",
+    "account_id",
+    "platform",
+    "currency",
+    "account_currency",
+    "day",
+    "month",
+    "amount_input",
+    "amount_account",
+    "amount_account_kzt",
+    "fee_percent",
+    "fx_rate",
+    "our_rate",
+    "fee_base_kzt",
+    "fee_amount_kzt",
+    "fx_profit_kzt",
+    "profit_total_kzt",
+)
+# Same inputs the admin topup listings feed to _attach_topup_account_amount.
+_TOPUP_PROFIT_SOURCE_SQL = """
+    SELECT t.*, a.platform as account_platform, a.currency as account_currency, f.day as fact_day
+    FROM topups t
+    JOIN ad_accounts a ON a.id = t.account_id
+    LEFT JOIN topup_profit_facts f ON f.topup_id = t.id
+    WHERE t.status='completed'
+"""
+
+
+def _record_topup_profit_facts(conn, topup_ids: Iterable[int], completed_at: Optional[str] = None) -> int:
+    """Store the profit components of completed topups; others in `topup_ids` are skipped.
+
+    A fact keeps the day it was first recorded on unless `completed_at` is given; topups completed
+    before facts existed are dated by created_at.
+    """
+    ids = sorted({int(topup_id) for topup_id in topup_ids})
+    if not ids:
+        return 0
+    placeholders = ", ".join(["?"] * len(ids))
+    rows = conn.execute(f"{_TOPUP_PROFIT_SOURCE_SQL} AND t.id IN ({placeholders})", ids).fetchall()
+    facts = []
+    for row in _attach_topup_account_amount([dict(row) for row in rows]):
+        day = str(completed_at or row.get("fact_day") or row.get("created_at") or "")[:10]
+        if not day:
+            continue
+        facts.append(
+            (
+                row["id"],
+                row["user_id"],
+                row.get("account_id"),
+                str(row.get("account_platform") or row.get("platform") or "").lower() or None,
+                str(row.get("currency") or "KZT").upper(),
+                row.get("account_currency"),
+                day,
+                day[:7],
+                float(row.get("amount_input") or 0),
+                row.get("amount_account"),
+                row.get("amount_account_kzt"),
+                float(row.get("fee_percent") or 0),
+                row.get("fx_rate"),
+                row.get("our_rate"),
+                row["fee_base_kzt"],
+                row["fee_amount_kzt"],
+                row["fx_profit_kzt"],
+                row["profit_total_kzt"],
+            )
+        )
+    return bulk_upsert(
+        conn,
+        "topup_profit_facts",
+        _TOPUP_PROFIT_FACT_COLUMNS,
+        facts,
+        conflict="topup_id",
+        update=_TOPUP_PROFIT_FACT_COLUMNS[1:],
+        set_sql="updated_at=CURRENT_TIMESTAMP",
+    )
+
+
+def backfill_topup_profit_facts(conn, batch_size: int = 500) -> int:
+    """Record facts for completed topups that have none, committing per batch; returns the count."""
+    recorded = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f"{_TOPUP_PROFIT_SOURCE_SQL} AND f.topup_id IS NULL AND t.id > ? ORDER BY t.id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return recorded
+        last_id = int(rows[-1]["id"])
+        recorded += _record_topup_profit_facts(conn, [row["id"] for row in rows])
+        conn.commit()
+
+
+def _backfill_profit_facts_on_startup() -> None:
+    with get_conn() as conn:
+        recorded = backfill_topup_profit_facts(conn)
+    if recorded:
+        logging.info("Backfilled profit facts for %s completed topups", recorded)
+
+
 def _funding_source_key(source_type: str, source_id: Optional[object]) -> Optional[str]:
     if source_id is None:
         return None
@@ -5319,6 +6243,27 @@ def _sync_completed_topup_funding_events(conn, user_id: Optional[int] = None, ac
             occurred_at=row.get("created_at"),
             update_existing=True,
         )
+    if user_id is not None or account_id is not None:
+        # Unscoped syncs only back read-only listings that never commit.
+        _refresh_client_summaries(conn, [row.get("user_id") for row in prepared])
+
+
+def _refresh_client_summaries(conn, user_ids: Iterable[object]) -> None:
+    """Recompute the client_summary rows of `user_ids` inside the caller's transaction."""
+    ids = sorted({int(user_id) for user_id in user_ids if user_id})
+    for start in range(0, len(ids), 500):
+        chunk = ids[start : start + 500]
+        placeholders = ", ".join(["?"] * len(chunk))
+        conn.execute(CLIENT_SUMMARY_UPSERT.format(where=f"WHERE u.id IN ({placeholders})"), chunk)
+
+
+def rebuild_client_summaries(conn) -> int:
+    """Re-sync topup funding events and recompute every client_summary row; returns the row count."""
+    _sync_completed_topup_funding_events(conn)
+    conn.execute(CLIENT_SUMMARY_UPSERT.format(where=""))
+    conn.commit()
+    row = conn.execute("SELECT COUNT(1) AS cnt FROM client_summary").fetchone()
+    return int(row["cnt"] or 0)
 
 
 def _account_funding_totals_map(conn, user_id: int) -> Dict[str, Dict[str, float]]:
@@ -5667,13 +6612,62 @@ def _invoice_storage_dir() -> str:
     return base_dir
 
 
-def _wallet_invoice_pdf_path(request_id: int) -> str:
-    filename = f"wallet_invoice_{request_id}.pdf"
-    return os.path.join(_invoice_storage_dir(), filename)
+def _invoice_pdf_cache_path(digest: str) -> str:
+    base_dir = os.path.join(_invoice_storage_dir(), "cache")
+    os.makedirs(base_dir, exist_ok=True)
+    return os.path.join(base_dir, f"{digest}.pdf")
 
 
-def _save_invoice_pdf(pdf: UploadFile) -> str:
-    suffix = ".pdf"
+def _invoice_pdf_cache_key(digest: str) -> str:
+    return f"wallet_invoices/cache/{digest}.pdf"
+
+
+def _invoice_pdf_cached(digest: str) -> bool:
+    if digest in _INVOICE_PDF_CACHE:
+        return True
+    if _r2_enabled():
+        exists = _r2_object_exists(_invoice_pdf_cache_key(digest))
+    else:
+        exists = os.path.exists(_invoice_pdf_cache_path(digest))
+    if exists:
+        _INVOICE_PDF_CACHE.add(digest)
+    return exists
+
+
+def _store_invoice_pdf(digest: str, pdf: bytes) -> None:
+    if _r2_enabled():
+        _r2_upload_bytes(_invoice_pdf_cache_key(digest), pdf, "application/pdf")
+    else:
+        path = _invoice_pdf_cache_path(digest)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp_path, path)
+    _INVOICE_PDF_CACHE.add(digest)
+
+
+def _cached_invoice_pdf_response(html_doc: str, if_none_match: Optional[str] = None):
+    """Serve an invoice PDF from the artifact cache, rendering it only on a miss.
+
+    Artifacts are addressed by the SHA-256 of the invoice HTML, so any change
+    to the invoice data or template yields a new artifact and a new ETag.
+    """
+    digest = hashlib.sha256(html_doc.encode("utf-8")).hexdigest()
+    headers = {"ETag": f'"invoice-{digest}"', "Cache-Control": "private, max-age=0, must-revalidate"}
+    if if_none_match and if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if not _invoice_pdf_cached(digest):
+        _store_invoice_pdf(digest, _render_pdf_bytes(html_doc))
+    if _r2_enabled():
+        url = _r2_presigned_url(_invoice_pdf_cache_key(digest))
+        if not url:
+            raise HTTPException(status_code=500, detail="R2 not configured")
+        return RedirectResponse(url, headers=headers)
+    return FileResponse(_invoice_pdf_cache_path(digest), media_type="application/pdf", headers=headers)
+
+
+def _save_invoice_pdf(pdf: UploadFile) -> str:
+    suffix = ".pdf"
     if pdf.filename and pdf.filename.lower().endswith(".pdf"):
         suffix = ".pdf"
     filename = f"invoice_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(6)}{suffix}"
@@ -5921,23 +6915,123 @@ def get_wallet(current_user=Depends(get_current_user)):
         return payload
 
 
+def _encode_list_cursor(values: List[object]) -> str:
+    return _b64url(json.dumps(values, default=str, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode_list_cursor(cursor: str, size: int) -> List[object]:
+    try:
+        values = json.loads(_b64url_decode(cursor))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+# Admin list endpoints return pages of at most this many rows; `limit` may ask for up to the max.
+_ADMIN_LIST_PAGE_SIZE = int(os.getenv("ADMIN_LIST_PAGE_SIZE", "200") or 200)
+_ADMIN_LIST_MAX_PAGE_SIZE = int(os.getenv("ADMIN_LIST_MAX_PAGE_SIZE", "1000") or 1000)
+
+
+def _admin_list_filters(*conditions: Tuple[str, object]) -> Tuple[List[str], List[object]]:
+    """Keep the (clause, param) pairs whose param was given."""
+    clauses: List[str] = []
+    params: List[object] = []
+    for clause, value in conditions:
+        if value is None or value == "":
+            continue
+        clauses.append(clause)
+        params.append(value)
+    return clauses, params
+
+
+def _admin_list_common_filters(
+    created_col: str,
+    email_col: str,
+    q: Optional[str],
+    date_from: Optional[date],
+    date_to: Optional[date],
+) -> List[Tuple[str, object]]:
+    return [
+        (f"LOWER({email_col}) LIKE ?", f"%{q.strip().lower()}%" if q and q.strip() else None),
+        (f"{created_col} >= ?", date_from.isoformat() if date_from else None),
+        (f"{created_col} < ?", (date_to + timedelta(days=1)).isoformat() if date_to else None),
+    ]
+
+
+def _admin_list_page(
+    conn,
+    query: str,
+    clauses: List[str],
+    params: List[object],
+    keys: List[Tuple[str, str]],
+    cursor: Optional[str],
+    limit: int,
+    response: Response,
+    descending: bool = True,
+) -> List[Dict[str, object]]:
+    """One keyset page of `query` (which has a {where} placeholder), ordered by `keys`.
+
+    `keys` are (sql expression, result column) pairs; the last one must be unique. When more
+    rows follow, the cursor to pass back for them is sent in the X-Next-Cursor header.
+    """
+    clauses = list(clauses)
+    params = list(params)
+    key_sql = ", ".join(expr for expr, _ in keys)
+    if cursor:
+        values = _decode_list_cursor(cursor, len(keys))
+        placeholders = ", ".join(["?"] * len(keys))
+        clauses.append(f"({key_sql}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(values)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    direction = "DESC" if descending else "ASC"
+    order_by = ", ".join(f"{expr} {direction}" for expr, _ in keys)
+    rows = conn.execute(
+        f"{query.format(where=where)} ORDER BY {order_by} LIMIT ?",
+        [*params, limit + 1],
+    ).fetchall()
+    page = [dict(row) for row in rows[:limit]]
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = _encode_list_cursor([page[-1][column] for _, column in keys])
+    return page
+
+
 @app.get("/admin/wallets")
-def admin_list_wallets(admin_user=Depends(get_admin_user), low_only: bool = False):
+def admin_list_wallets(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    low_only: bool = False,
+    user_id: Optional[int] = None,
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    clauses, params = _admin_list_filters(
+        ("w.user_id = ?", user_id),
+        ("LOWER(u.email) LIKE ?", f"%{q.strip().lower()}%" if q and q.strip() else None),
+    )
+    if low_only:
+        clauses.append("w.balance <= w.low_threshold")
     with get_conn() as conn:
-        rows = conn.execute(
+        return _admin_list_page(
+            conn,
             """
             SELECT w.*, u.email as user_email
             FROM wallets w
             JOIN users u ON u.id = w.user_id
-            ORDER BY w.balance ASC
-            """
-        ).fetchall()
-        data = [dict(row) for row in rows]
-        if low_only:
-            data = [row for row in data if row["balance"] <= row["low_threshold"]]
-        return data
+            {where}
+            """,
+            clauses,
+            params,
+            [("w.balance", "balance"), ("w.id", "id")],
+            cursor,
+            limit,
+            response,
+            descending=False,
+        )
 
 
 @app.post("/admin/wallets/adjust")
@@ -5964,25 +7058,49 @@ def admin_adjust_wallet(payload: WalletAdjust, admin_user=Depends(get_admin_user
             """,
             (user["id"], None, payload.amount, wallet["currency"], "adjustment", payload.note),
         )
+        _refresh_client_summaries(conn, [user["id"]])
         conn.commit()
         return {"user_id": user["id"], "balance": new_balance}
 
 
 @app.get("/admin/wallet-transactions")
-def admin_list_wallet_transactions(admin_user=Depends(get_admin_user)):
+def admin_list_wallet_transactions(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    tx_type: Optional[str] = Query(None, alias="type"),
+    platform: Optional[str] = None,
+    user_id: Optional[int] = None,
+    q: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    clauses, params = _admin_list_filters(
+        ("wt.type = ?", tx_type),
+        ("a.platform = ?", platform),
+        ("wt.user_id = ?", user_id),
+        *_admin_list_common_filters("wt.created_at", "u.email", q, date_from, date_to),
+    )
     with get_conn() as conn:
-        rows = conn.execute(
+        return _admin_list_page(
+            conn,
             """
             SELECT wt.*, u.email as user_email, a.name as account_name, a.platform as account_platform
             FROM wallet_transactions wt
             JOIN users u ON u.id = wt.user_id
             LEFT JOIN ad_accounts a ON a.id = wt.account_id
-            ORDER BY wt.created_at DESC
-            """
-        ).fetchall()
-        return [dict(row) for row in rows]
+            {where}
+            """,
+            clauses,
+            params,
+            [("wt.created_at", "created_at"), ("wt.id", "id")],
+            cursor,
+            limit,
+            response,
+        )
 
 
 @app.get("/wallet/transactions")
@@ -6117,9 +7235,10 @@ def delete_profile_access(access_id: int, current_user=Depends(get_current_user)
             raise HTTPException(status_code=404, detail="Access not found")
         if (row["role"] or "member") == "owner":
             raise HTTPException(status_code=400, detail="Main email cannot be deleted")
-        conn.execute("DELETE FROM user_tokens WHERE user_id=? AND login_email=?", (current_user["id"], row["email"]))
+        _revoke_user_tokens(conn, current_user["id"], login_email=row["email"])
         conn.execute("DELETE FROM user_accesses WHERE id=?", (access_id,))
         conn.commit()
+        _forget_token_epoch(current_user["id"])
         return {"status": "ok"}
 
 
@@ -6172,16 +7291,168 @@ def get_avatar(token: Optional[str] = None, current_user=Depends(get_optional_us
         return FileResponse(row["avatar_path"])
 
 
+def _client_notification_item(kind: str, row) -> Dict[str, object]:
+    if kind == "topup":
+        return {
+            "type": "topup",
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "title": "Пополнение",
+            "status": row["status"],
+            "amount": row["amount_net"] or row["amount_input"],
+            "currency": row["currency"],
+        }
+    return {
+        "type": "account_request",
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "title": "Аккаунт открыт",
+        "status": row["status"],
+        "platform": row["platform"],
+        "name": row["name"],
+    }
+
+
+def _admin_notification_item(kind: str, row) -> Dict[str, object]:
+    if kind == "topup":
+        return {
+            "type": "topup",
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "title": "Новая заявка на пополнение",
+            "status": row["status"],
+            "amount": row["amount_net"] or row["amount_input"],
+            "currency": row["currency"],
+            "platform": row["platform"],
+            "name": row["name"],
+            "user_email": row["user_email"],
+        }
+    return {
+        "type": "account_request",
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "title": "Новая заявка",
+        "status": row["status"],
+        "platform": row["platform"],
+        "name": row["name"],
+        "user_email": row["user_email"],
+    }
+
+
+_ADMIN_NOTIFICATIONS_TOPIC = "admins"
+
+# One row per pushed item, shaped like the rows of the polling endpoints.
+_CLIENT_NOTIFICATION_SQL = {
+    "topup": """
+        SELECT t.id, t.user_id, t.created_at, t.status, t.amount_input, t.amount_net, t.currency, COALESCE(c.unread, 0) AS unread
+        FROM topups t
+        LEFT JOIN user_notification_counters c ON c.user_id = t.user_id
+        WHERE t.id=?
+    """,
+    "account_request": """
+        SELECT r.id, r.user_id, r.created_at, r.status, r.platform, r.name, COALESCE(c.unread, 0) AS unread
+        FROM account_requests r
+        LEFT JOIN user_notification_counters c ON c.user_id = r.user_id
+        WHERE r.id=?
+    """,
+}
+_ADMIN_NOTIFICATION_SQL = {
+    "topup": """
+        SELECT t.id, t.created_at, t.status, t.amount_input, t.amount_net, t.currency, u.email as user_email, a.platform, a.name
+        FROM topups t
+        JOIN users u ON u.id = t.user_id
+        JOIN ad_accounts a ON a.id = t.account_id
+        WHERE t.id=?
+    """,
+    "account_request": """
+        SELECT r.id, r.created_at, r.status, r.platform, r.name, u.email as user_email
+        FROM account_requests r
+        JOIN users u ON u.id = r.user_id
+        WHERE r.id=?
+    """,
+}
+
+
+def _user_notifications_topic(user_id: int) -> str:
+    return f"user:{int(user_id)}"
+
+
+def _publish_client_notification(conn, kind: str, item_id: int) -> None:
+    """Push a completed topup or approved request to the owner's open streams (after commit)."""
+    try:
+        row = conn.execute(_CLIENT_NOTIFICATION_SQL[kind], (item_id,)).fetchone()
+    except Exception:
+        logging.exception("Failed to load %s #%s for a notification event", kind, item_id)
+        return
+    if not row:
+        return
+    events.publish(
+        _user_notifications_topic(row["user_id"]),
+        "notification",
+        {"item": _client_notification_item(kind, row), "unread": int(row["unread"] or 0)},
+    )
+
+
+def _publish_admin_work_item(conn, kind: str, item_id: int) -> None:
+    """Push a new account request or pending topup to the admins' open streams (after commit)."""
+    try:
+        row = conn.execute(_ADMIN_NOTIFICATION_SQL[kind], (item_id,)).fetchone()
+    except Exception:
+        logging.exception("Failed to load %s #%s for an admin notification event", kind, item_id)
+        return
+    if row:
+        events.publish(_ADMIN_NOTIFICATIONS_TOPIC, "notification", {"item": _admin_notification_item(kind, row)})
+
+
+def _publish_admin_work_item_resolved(kind: str, item_id: int) -> None:
+    events.publish(_ADMIN_NOTIFICATIONS_TOPIC, "notification_resolved", {"type": kind, "id": item_id})
+
+
+_NOTIFICATION_ITEM_TABLES = {"topup": "topups", "account_request": "account_requests"}
+
+
+def _bump_unread_notifications(conn, user_id: int, kind: str, item_id: int) -> None:
+    # Runs inside the transaction that completes the topup or approves the request.
+    conn.execute(
+        """
+        INSERT INTO user_notification_counters (user_id, unread, updated_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET unread=user_notification_counters.unread + 1, updated_at=CURRENT_TIMESTAMP
+        """,
+        (user_id,),
+    )
+    conn.execute(f"UPDATE {_NOTIFICATION_ITEM_TABLES[kind]} SET notified_at=CURRENT_TIMESTAMP WHERE id=?", (item_id,))
+
+
+def _drop_unread_notification(conn, user_id: int, kind: str, item_id: int) -> None:
+    """A completed topup or approved request moved back; uncount it if its notification is unread."""
+    table = _NOTIFICATION_ITEM_TABLES[kind]
+    conn.execute(
+        f"""
+        UPDATE user_notification_counters
+        SET unread=CASE WHEN unread > 0 THEN unread - 1 ELSE 0 END, updated_at=CURRENT_TIMESTAMP
+        WHERE user_id=? AND EXISTS (
+          SELECT 1
+          FROM {table} i
+          LEFT JOIN user_profiles p ON p.user_id = i.user_id
+          WHERE i.id=? AND i.notified_at IS NOT NULL
+            AND (p.notifications_seen_at IS NULL OR i.notified_at > p.notifications_seen_at)
+        )
+        """,
+        (user_id, item_id),
+    )
+    conn.execute(f"UPDATE {table} SET notified_at=NULL WHERE id=?", (item_id,))
+
+
+def _unread_notifications(conn, user_id: int) -> int:
+    row = conn.execute("SELECT unread FROM user_notification_counters WHERE user_id=?", (user_id,)).fetchone()
+    return int(row["unread"] or 0) if row else 0
+
+
 @app.get("/notifications")
 def list_notifications(current_user=Depends(get_current_user)):
     if not get_conn:
         return {"items": [], "unread": 0}
     with get_conn() as conn:
-        try:
-            profile = _get_or_create_profile(conn, current_user["id"])
-            seen_at = profile.get("notifications_seen_at")
-        except Exception:
-            seen_at = None
         topups = conn.execute(
             """
             SELECT id, created_at, status, amount_input, amount_net, currency
@@ -6202,58 +7473,11 @@ def list_notifications(current_user=Depends(get_current_user)):
             """,
             (current_user["id"],),
         ).fetchall()
-        try:
-            unread_topups = conn.execute(
-                """
-                SELECT COUNT(1) as cnt
-                FROM topups
-                WHERE user_id=? AND status='completed' AND (? IS NULL OR created_at > ?)
-                """,
-                (current_user["id"], seen_at, seen_at),
-            ).fetchone()
-            unread_requests = conn.execute(
-                """
-                SELECT COUNT(1) as cnt
-                FROM account_requests
-                WHERE user_id=? AND status='approved' AND (? IS NULL OR created_at > ?)
-                """,
-                (current_user["id"], seen_at, seen_at),
-            ).fetchone()
-        except Exception:
-            unread_topups = None
-            unread_requests = None
-    items: List[Dict[str, object]] = []
-    for row in topups:
-        items.append(
-            {
-                "type": "topup",
-                "id": row["id"],
-                "created_at": row["created_at"],
-                "title": "Пополнение",
-                "status": row["status"],
-                "amount": row["amount_net"] or row["amount_input"],
-                "currency": row["currency"],
-            }
-        )
-    for row in requests:
-        items.append(
-            {
-                "type": "account_request",
-                "id": row["id"],
-                "created_at": row["created_at"],
-                "title": "Аккаунт открыт",
-                "status": row["status"],
-                "platform": row["platform"],
-                "name": row["name"],
-            }
-        )
+        unread = _unread_notifications(conn, current_user["id"])
+    items: List[Dict[str, object]] = [_client_notification_item("topup", row) for row in topups]
+    items.extend(_client_notification_item("account_request", row) for row in requests)
     items.sort(key=lambda x: str(x.get("created_at") or ""), reverse=True)
-    unread = 0
-    if unread_topups:
-        unread += unread_topups["cnt"] if isinstance(unread_topups, dict) else unread_topups[0]
-    if unread_requests:
-        unread += unread_requests["cnt"] if isinstance(unread_requests, dict) else unread_requests[0]
-    return {"items": items[:10], "unread": int(unread)}
+    return {"items": items[:10], "unread": unread}
 
 
 
@@ -6267,8 +7491,13 @@ def mark_notifications_read(current_user=Depends(get_current_user)):
             "UPDATE user_profiles SET notifications_seen_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE user_id=?",
             (current_user["id"],),
         )
+        conn.execute(
+            "UPDATE user_notification_counters SET unread=0, updated_at=CURRENT_TIMESTAMP WHERE user_id=?",
+            (current_user["id"],),
+        )
         conn.commit()
-        return {"status": "ok"}
+    events.publish(_user_notifications_topic(current_user["id"]), "notifications_read", {})
+    return {"status": "ok"}
 
 
 @app.get("/admin/notifications")
@@ -6297,39 +7526,76 @@ def admin_notifications(admin_user=Depends(get_admin_user)):
             LIMIT 10
             """
         ).fetchall()
-    items: List[Dict[str, object]] = []
-    for row in requests:
-        items.append(
-            {
-                "type": "account_request",
-                "id": row["id"],
-                "created_at": row["created_at"],
-                "title": "Новая заявка",
-                "status": row["status"],
-                "platform": row["platform"],
-                "name": row["name"],
-                "user_email": row["user_email"],
-            }
-        )
-    for row in topups:
-        items.append(
-            {
-                "type": "topup",
-                "id": row["id"],
-                "created_at": row["created_at"],
-                "title": "Новая заявка на пополнение",
-                "status": row["status"],
-                "amount": row["amount_net"] or row["amount_input"],
-                "currency": row["currency"],
-                "platform": row["platform"],
-                "name": row["name"],
-                "user_email": row["user_email"],
-            }
-        )
+    items: List[Dict[str, object]] = [_admin_notification_item("account_request", row) for row in requests]
+    items.extend(_admin_notification_item("topup", row) for row in topups)
     items.sort(key=lambda x: str(x.get("created_at") or ""), reverse=True)
     return items[:12]
 
 
+def _get_stream_user(token: Optional[str] = None, current_user=Depends(get_optional_user)):
+    # EventSource cannot set headers, so streams also take the token as a query parameter.
+    if token:
+        current_user = _get_user_by_token(token)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Missing token")
+    return current_user
+
+
+def _notification_stream(request: Request, topics: List[str], snapshot: Callable[[], object]) -> StreamingResponse:
+    async def body():
+        sub = events.subscribe(topics)
+        try:
+            # Subscribe before the snapshot so nothing committed in between is lost.
+            yield f"retry: {events.EVENTS_RETRY_MS}\n"
+            yield events.format_sse("snapshot", jsonable_encoder(await run_in_threadpool(snapshot)))
+            deadline = time.monotonic() + events.EVENTS_STREAM_MAX_SEC
+            while not sub.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = await sub.get(min(events.EVENTS_KEEPALIVE_SEC, remaining))
+                if message is None:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield events.format_sse(str(message["event"]), jsonable_encoder(message["data"]))
+            # Closing makes EventSource reconnect, re-authenticate and take a fresh snapshot;
+            # that is also how a subscriber that fell behind catches up.
+        finally:
+            events.unsubscribe(sub)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/notifications/stream")
+async def notifications_stream(request: Request, current_user=Depends(_get_stream_user)):
+    return _notification_stream(
+        request,
+        [_user_notifications_topic(current_user["id"])],
+        lambda: list_notifications(current_user=current_user),
+    )
+
+
+@app.get("/admin/notifications/stream")
+async def admin_notifications_stream(request: Request, current_user=Depends(_get_stream_user)):
+    admin_user = get_admin_user(current_user)
+    return _notification_stream(
+        request,
+        [_ADMIN_NOTIFICATIONS_TOPIC],
+        lambda: admin_notifications(admin_user=admin_user),
+    )
+
+
+@app.get("/admin/events/stats")
+def admin_events_stats(admin_user=Depends(get_admin_user)):
+    return events.bus_stats()
+
+
 @app.post("/auth/change-password")
 def change_password(payload: ChangePasswordPayload, current_user=Depends(get_current_user)):
     if not get_conn:
@@ -6353,9 +7619,10 @@ def change_password(payload: ChangePasswordPayload, current_user=Depends(get_cur
                 "UPDATE users SET password_hash=?, salt=? WHERE id=?",
                 (password_hash, salt, current_user["id"]),
             )
-        conn.execute("DELETE FROM user_tokens WHERE user_id=?", (current_user["id"],))
+        _revoke_user_tokens(conn, current_user["id"])
         new_token = _issue_user_token(conn, current_user["id"], current_user["email"])
         conn.commit()
+        _forget_token_epoch(current_user["id"])
         return {"status": "ok", "token": new_token}
 
 
@@ -6627,6 +7894,30 @@ def admin_delete_client_finance_document(
     return {"status": "ok", "id": doc_id}
 
 
+_ACCOUNT_BY_ID_SQL = "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform=?"
+_ACCOUNTS_BY_PLATFORM_SQL = "SELECT * FROM ad_accounts WHERE user_id=? AND platform=?"
+
+
+def _user_platform_accounts(
+    conn, user_id: int, platform: str, account_id: Optional[int] = None
+) -> List[Dict[str, object]]:
+    if account_id:
+        row = conn.execute(_ACCOUNT_BY_ID_SQL, (account_id, user_id, platform)).fetchone()
+        return [dict(row)] if row else []
+    rows = conn.execute(_ACCOUNTS_BY_PLATFORM_SQL, (user_id, platform)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _select_platform_accounts(
+    accounts: List[Dict[str, object]], platform: str, account_id: Optional[int] = None
+) -> List[Dict[str, object]]:
+    """Same selection as _user_platform_accounts, over an already loaded account list."""
+    selected = [acc for acc in accounts if acc.get("platform") == platform]
+    if account_id:
+        selected = [acc for acc in selected if str(acc.get("id")) == str(account_id)][:1]
+    return selected
+
+
 @app.get("/meta/insights", response_model=MetaInsightsResponse)
 def meta_insights(
     date_from: str,
@@ -6639,18 +7930,11 @@ def meta_insights(
     if not date_from or not date_to:
         raise HTTPException(status_code=400, detail="date_from and date_to are required")
     with get_conn() as conn:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform='meta'",
-                (account_id, current_user["id"]),
-            ).fetchone()
-            accounts = [dict(row)] if row else []
-        else:
-            rows = conn.execute(
-                "SELECT * FROM ad_accounts WHERE user_id=? AND platform='meta'",
-                (current_user["id"],),
-            ).fetchall()
-            accounts = [dict(r) for r in rows]
+        accounts = _user_platform_accounts(conn, current_user["id"], "meta", account_id)
+    return _meta_insights_payload(accounts, date_from, date_to)
+
+
+def _meta_insights_payload(accounts: List[Dict[str, object]], date_from: str, date_to: str) -> Dict[str, object]:
     if not accounts:
         return {"summary": {"spend": 0, "ctr": 0, "cpc": 0, "cpm": 0, "reach": 0}, "campaigns": []}
 
@@ -6733,18 +8017,11 @@ def google_insights(
     if not date_from or not date_to:
         raise HTTPException(status_code=400, detail="date_from and date_to are required")
     with get_conn() as conn:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform='google'",
-                (account_id, current_user["id"]),
-            ).fetchone()
-            accounts = [dict(row)] if row else []
-        else:
-            rows = conn.execute(
-                "SELECT * FROM ad_accounts WHERE user_id=? AND platform='google'",
-                (current_user["id"],),
-            ).fetchall()
-            accounts = [dict(r) for r in rows]
+        accounts = _user_platform_accounts(conn, current_user["id"], "google", account_id)
+    return _google_insights_payload(accounts, date_from, date_to)
+
+
+def _google_insights_payload(accounts: List[Dict[str, object]], date_from: str, date_to: str) -> Dict[str, object]:
     if not accounts:
         return {"summary": {"spend": 0, "ctr": 0, "cpc": 0, "cpm": 0, "impressions": 0, "clicks": 0}, "campaigns": []}
 
@@ -6808,18 +8085,13 @@ def tiktok_insights(
     if not date_from or not date_to:
         raise HTTPException(status_code=400, detail="date_from and date_to are required")
     with get_conn() as conn:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform='tiktok'",
-                (account_id, current_user["id"]),
-            ).fetchone()
-            accounts = [dict(row)] if row else []
-        else:
-            rows = conn.execute(
-                "SELECT * FROM ad_accounts WHERE user_id=? AND platform='tiktok'",
-                (current_user["id"],),
-            ).fetchall()
-            accounts = [dict(r) for r in rows]
+        accounts = _user_platform_accounts(conn, current_user["id"], "tiktok", account_id)
+    return _tiktok_insights_payload(accounts, date_from, date_to, strict=bool(account_id))
+
+
+def _tiktok_insights_payload(
+    accounts: List[Dict[str, object]], date_from: str, date_to: str, strict: bool = False
+) -> Dict[str, object]:
     if not accounts:
         return {"summary": {"spend": 0, "ctr": 0, "cpc": 0, "cpm": 0, "impressions": 0, "clicks": 0}, "campaigns": [], "adgroups": [], "ads": []}
 
@@ -6843,7 +8115,7 @@ def tiktok_insights(
     for acc in accounts:
         advertiser_id = acc.get("external_id") or acc.get("account_code")
         if not advertiser_id:
-            if account_id:
+            if strict:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Для аккаунта TikTok id={acc.get('id')} не указан advertiser id (external_id/account_code).",
@@ -6958,18 +8230,11 @@ def meta_audience(
     if group not in {"age_gender", "geo", "placement_device", "device"}:
         raise HTTPException(status_code=400, detail="Unsupported group")
     with get_conn() as conn:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform='meta'",
-                (account_id, current_user["id"]),
-            ).fetchone()
-            accounts = [dict(row)] if row else []
-        else:
-            rows = conn.execute(
-                "SELECT * FROM ad_accounts WHERE user_id=? AND platform='meta'",
-                (current_user["id"],),
-            ).fetchall()
-            accounts = [dict(r) for r in rows]
+        accounts = _user_platform_accounts(conn, current_user["id"], "meta", account_id)
+    return _meta_audience_payload(accounts, date_from, date_to, group)
+
+
+def _meta_audience_payload(accounts: List[Dict[str, object]], date_from: str, date_to: str, group: str) -> Dict[str, object]:
     results = []
     for acc in accounts:
         external_id = acc.get("external_id") or acc.get("account_code")
@@ -7013,19 +8278,11 @@ def google_audience(
     if group not in {"age_gender", "geo", "device"}:
         raise HTTPException(status_code=400, detail="Unsupported group")
     with get_conn() as conn:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform='google'",
-                (account_id, current_user["id"]),
-            ).fetchone()
-            accounts = [dict(row)] if row else []
-        else:
-            rows = conn.execute(
-                "SELECT * FROM ad_accounts WHERE user_id=? AND platform='google'",
-                (current_user["id"],),
-            ).fetchall()
-            accounts = [dict(r) for r in rows]
+        accounts = _user_platform_accounts(conn, current_user["id"], "google", account_id)
+    return _google_audience_payload(accounts, date_from, date_to, group)
+
 
+def _google_audience_payload(accounts: List[Dict[str, object]], date_from: str, date_to: str, group: str) -> Dict[str, object]:
     results = []
     for acc in accounts:
         customer_id = _google_valid_customer_id_or_none(acc.get("external_id") or acc.get("account_code"))
@@ -7056,6 +8313,7 @@ def _build_insights_overview_for_user(
     meta_account_id: Optional[int] = None,
     google_account_id: Optional[int] = None,
     tiktok_account_id: Optional[int] = None,
+    accounts: Optional[List[Dict[str, object]]] = None,
 ) -> Dict[str, object]:
     def _to_float(value: object) -> float:
         try:
@@ -7093,23 +8351,15 @@ def _build_insights_overview_for_user(
             }
         _merge_daily(platform_bucket[account_id]["_daily_map"], date_key, row)
 
-    def _fetch_accounts(conn, platform: str, account_id: Optional[int]) -> List[Dict[str, object]]:
-        if account_id:
-            row = conn.execute(
-                "SELECT * FROM ad_accounts WHERE id=? AND user_id=? AND platform=?",
-                (account_id, current_user["id"], platform),
-            ).fetchone()
-            return [dict(row)] if row else []
-        rows = conn.execute(
-            "SELECT * FROM ad_accounts WHERE user_id=? AND platform=?",
-            (current_user["id"], platform),
-        ).fetchall()
-        return [dict(r) for r in rows]
-
-    with get_conn() as conn:
-        meta_accounts = _fetch_accounts(conn, "meta", meta_account_id)
-        google_accounts = _fetch_accounts(conn, "google", google_account_id)
-        tiktok_accounts = _fetch_accounts(conn, "tiktok", tiktok_account_id)
+    if accounts is not None:
+        meta_accounts = _select_platform_accounts(accounts, "meta", meta_account_id)
+        google_accounts = _select_platform_accounts(accounts, "google", google_account_id)
+        tiktok_accounts = _select_platform_accounts(accounts, "tiktok", tiktok_account_id)
+    else:
+        with get_conn() as conn:
+            meta_accounts = _user_platform_accounts(conn, current_user["id"], "meta", meta_account_id)
+            google_accounts = _user_platform_accounts(conn, current_user["id"], "google", google_account_id)
+            tiktok_accounts = _user_platform_accounts(conn, current_user["id"], "tiktok", tiktok_account_id)
 
     totals = {
         "meta": {"spend": 0.0, "impressions": 0.0, "clicks": 0.0},
@@ -7389,6 +8639,17 @@ def _dashboard_export_fmt_pct(value: object) -> str:
     return f"{amount * 100:.2f}%"
 
 
+def _render_pdf_bytes(html_doc: str) -> bytes:
+    try:
+        return pdf_render.render_pdf(html_doc, base_url=os.path.dirname(__file__))
+    except pdf_render.PdfRendererUnavailable:
+        raise HTTPException(status_code=500, detail="PDF renderer is not available")
+    except pdf_render.PdfRendererBusy:
+        raise HTTPException(status_code=503, detail="PDF renderer is busy, try again later", headers={"Retry-After": "5"})
+    except pdf_render.PdfRenderTimeout:
+        raise HTTPException(status_code=504, detail="PDF rendering timed out")
+
+
 def _dashboard_export_safe_payload(loader, fallback: Dict[str, object]) -> Dict[str, object]:
     try:
         return loader()
@@ -7402,6 +8663,39 @@ def _dashboard_export_safe_payload(loader, fallback: Dict[str, object]) -> Dict[
         return payload
 
 
+def _dashboard_export_gather(
+    sections: Dict[str, Tuple[object, Dict[str, object]]], deadline: float
+) -> Dict[str, Dict[str, object]]:
+    """Run export section loaders concurrently.
+
+    Each section gets at most _DASHBOARD_EXPORT_SECTION_TIMEOUT_SEC and none
+    may run past `deadline` (a time.monotonic() value); a section that fails
+    or runs late is replaced by its fallback payload with an "error" note.
+    Late loaders are abandoned, not interrupted.
+    """
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(len(sections), 1), thread_name_prefix="dashboard-export")
+    futures = {
+        name: executor.submit(_dashboard_export_safe_payload, loader, fallback)
+        for name, (loader, fallback) in sections.items()
+    }
+    results: Dict[str, Dict[str, object]] = {}
+    try:
+        for name, future in futures.items():
+            budget = min(started + _DASHBOARD_EXPORT_SECTION_TIMEOUT_SEC, deadline) - time.monotonic()
+            try:
+                results[name] = future.result(timeout=max(budget, 0.0))
+            except FutureTimeoutError:
+                future.cancel()
+                payload = dict(sections[name][1])
+                payload["error"] = "Section timed out"
+                results[name] = payload
+                logging.warning("Dashboard export section %s timed out", name)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
 def _dashboard_export_collect_audience_rows(payload: Dict[str, object], group: str, platform: str) -> List[Dict[str, object]]:
     rows: List[Dict[str, object]] = []
     accounts = payload.get("accounts") or []
@@ -7877,57 +9171,76 @@ def dashboard_export_pdf(
     account_trend_platform: str = "meta",
     account_trend_account_id: Optional[int] = None,
     account_trend_metric: str = "impressions",
+    run_async: bool = Query(False, alias="async"),
     current_user=Depends(get_current_user),
 ):
     if not date_from or not date_to:
         raise HTTPException(status_code=400, detail="date_from and date_to are required")
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
+    if run_async:
+        return _enqueue_export_job(current_user, "dashboard_pdf", _export_job_params(locals()))
 
-    overview = _build_insights_overview_for_user(
-        current_user=current_user,
-        date_from=date_from,
-        date_to=date_to,
-        meta_account_id=meta_account_id,
-        google_account_id=google_account_id,
-        tiktok_account_id=tiktok_account_id,
-    )
-    meta_payload = _dashboard_export_safe_payload(
-        lambda: meta_insights(meta_date_from or date_from, meta_date_to or date_to, meta_platform_account_id, current_user),
-        {"summary": {}, "campaigns": []},
-    )
-    google_payload = _dashboard_export_safe_payload(
-        lambda: google_insights(google_date_from or date_from, google_date_to or date_to, google_platform_account_id, current_user),
-        {"summary": {}, "campaigns": []},
-    )
-    tiktok_payload = _dashboard_export_safe_payload(
-        lambda: tiktok_insights(tiktok_date_from or date_from, tiktok_date_to or date_to, tiktok_platform_account_id, current_user),
-        {"summary": {}, "campaigns": []},
-    )
-    meta_age = _dashboard_export_safe_payload(
-        lambda: meta_audience(date_from, date_to, "age_gender", meta_account_id, current_user),
-        {"accounts": []},
-    )
-    google_age = _dashboard_export_safe_payload(
-        lambda: google_audience(date_from, date_to, "age_gender", google_account_id, current_user),
-        {"accounts": []},
-    )
-    meta_geo = _dashboard_export_safe_payload(
-        lambda: meta_audience(date_from, date_to, "geo", meta_account_id, current_user),
-        {"accounts": []},
-    )
-    google_geo = _dashboard_export_safe_payload(
-        lambda: google_audience(date_from, date_to, "geo", google_account_id, current_user),
-        {"accounts": []},
-    )
-    meta_device = _dashboard_export_safe_payload(
-        lambda: meta_audience(date_from, date_to, "device", meta_account_id, current_user),
-        {"accounts": []},
-    )
-    google_device = _dashboard_export_safe_payload(
-        lambda: google_audience(date_from, date_to, "device", google_account_id, current_user),
-        {"accounts": []},
-    )
+    export_deadline = time.monotonic() + _DASHBOARD_EXPORT_DEADLINE_SEC
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT * FROM ad_accounts WHERE user_id=? AND platform IN ('meta','google','tiktok') ORDER BY id",
+            (current_user["id"],),
+        ).fetchall()
+    accounts = list({row["id"]: dict(row) for row in rows}.values())
+    meta_accounts = _select_platform_accounts(accounts, "meta", meta_account_id)
+    google_accounts = _select_platform_accounts(accounts, "google", google_account_id)
+    meta_platform_accounts = _select_platform_accounts(accounts, "meta", meta_platform_account_id)
+    google_platform_accounts = _select_platform_accounts(accounts, "google", google_platform_account_id)
+    tiktok_platform_accounts = _select_platform_accounts(accounts, "tiktok", tiktok_platform_account_id)
+
+    insights_fallback = {"summary": {}, "campaigns": []}
+    audience_fallback = {"accounts": []}
+    sections = {
+        "overview": (
+            lambda: _build_insights_overview_for_user(
+                current_user=current_user,
+                date_from=date_from,
+                date_to=date_to,
+                meta_account_id=meta_account_id,
+                google_account_id=google_account_id,
+                tiktok_account_id=tiktok_account_id,
+                accounts=accounts,
+            ),
+            {"totals": {}, "daily": {}, "daily_by_account": {}},
+        ),
+        "meta": (
+            lambda: _meta_insights_payload(meta_platform_accounts, meta_date_from or date_from, meta_date_to or date_to),
+            insights_fallback,
+        ),
+        "google": (
+            lambda: _google_insights_payload(google_platform_accounts, google_date_from or date_from, google_date_to or date_to),
+            insights_fallback,
+        ),
+        "tiktok": (
+            lambda: _tiktok_insights_payload(
+                tiktok_platform_accounts,
+                tiktok_date_from or date_from,
+                tiktok_date_to or date_to,
+                strict=bool(tiktok_platform_account_id),
+            ),
+            insights_fallback,
+        ),
+        "meta_age": (lambda: _meta_audience_payload(meta_accounts, date_from, date_to, "age_gender"), audience_fallback),
+        "google_age": (lambda: _google_audience_payload(google_accounts, date_from, date_to, "age_gender"), audience_fallback),
+        "meta_geo": (lambda: _meta_audience_payload(meta_accounts, date_from, date_to, "geo"), audience_fallback),
+        "google_geo": (lambda: _google_audience_payload(google_accounts, date_from, date_to, "geo"), audience_fallback),
+        "meta_device": (lambda: _meta_audience_payload(meta_accounts, date_from, date_to, "device"), audience_fallback),
+        "google_device": (lambda: _google_audience_payload(google_accounts, date_from, date_to, "device"), audience_fallback),
+    }
+    gathered = _dashboard_export_gather(sections, export_deadline - _DASHBOARD_EXPORT_RENDER_RESERVE_SEC)
+    overview = gathered["overview"]
+    meta_payload = gathered["meta"]
+    google_payload = gathered["google"]
+    tiktok_payload = gathered["tiktok"]
+    meta_age, google_age = gathered["meta_age"], gathered["google_age"]
+    meta_geo, google_geo = gathered["meta_geo"], gathered["google_geo"]
+    meta_device, google_device = gathered["meta_device"], gathered["google_device"]
 
     age_rows = _dashboard_export_collect_audience_rows(meta_age, "age_gender", "meta") + _dashboard_export_collect_audience_rows(google_age, "age_gender", "google")
     geo_rows = _dashboard_export_collect_audience_rows(meta_geo, "geo", "meta") + _dashboard_export_collect_audience_rows(google_geo, "geo", "google")
@@ -7960,11 +9273,7 @@ def dashboard_export_pdf(
         selected_trend = trend_accounts[0]
     trend_points = _dashboard_export_bar_rows(selected_trend.get("daily", []) if isinstance(selected_trend, dict) else [], account_trend_metric)
 
-    with get_conn() as conn:
-        account_count = conn.execute(
-            "SELECT COUNT(*) AS c FROM ad_accounts WHERE user_id=? AND platform IN ('meta','google','tiktok')",
-            (current_user["id"],),
-        ).fetchone()["c"]
+    account_count = len(accounts)
 
     html_doc = _dashboard_export_html(
         {
@@ -7993,16 +9302,33 @@ def dashboard_export_pdf(
         }
     )
 
-    try:
-        from weasyprint import HTML
-    except Exception:
-        raise HTTPException(status_code=500, detail="PDF renderer is not available")
-
-    buffer = BytesIO()
-    HTML(string=html_doc, base_url=os.path.dirname(__file__)).write_pdf(buffer)
+    pdf = _render_pdf_bytes(html_doc)
     filename = f"dashboard_report_{date_from}_{date_to}.pdf"
     headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
-    return StreamingResponse(BytesIO(buffer.getvalue()), media_type="application/pdf", headers=headers)
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers=headers)
+
+
+@app.get("/admin/auth/tokens/stats")
+def admin_auth_token_stats(admin_user=Depends(get_admin_user)):
+    with get_conn() as conn:
+        return _user_tokens_stats(conn)
+
+
+@app.post("/admin/auth/tokens/compact")
+def admin_auth_token_compact(admin_user=Depends(get_admin_user)):
+    with get_conn() as conn:
+        return compact_user_tokens(conn)
+
+
+@app.post("/admin/finance/reconcile")
+def admin_finance_reconcile(fix: bool = True, admin_user=Depends(get_admin_user)):
+    with get_conn() as conn:
+        return reconcile_finance_snapshots(conn, fix=fix)
+
+
+@app.get("/admin/pdf-renderer/stats")
+def admin_pdf_renderer_stats(admin_user=Depends(get_admin_user)):
+    return pdf_render.render_stats()
 
 
 @app.post("/admin/documents/upload")
@@ -8621,6 +9947,7 @@ def wallet_topup_invoice_generated_pdf(
     request_id: int,
     token: Optional[str] = None,
     current_user=Depends(get_optional_user),
+    if_none_match: Optional[str] = Header(None),
 ):
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
@@ -8705,22 +10032,7 @@ def wallet_topup_invoice_generated_pdf(
             "vat_note": tax["vat_note"],
         }
         html = _invoice_1c_html(payload)
-        try:
-            from weasyprint import HTML
-        except Exception:
-            raise HTTPException(status_code=500, detail="PDF renderer is not available")
-        if _r2_enabled():
-            buffer = BytesIO()
-            HTML(string=html, base_url=os.path.dirname(__file__)).write_pdf(buffer)
-            key = f"wallet_invoices/wallet_invoice_{request_id}.pdf"
-            _r2_upload_bytes(key, buffer.getvalue(), "application/pdf")
-            url = _r2_presigned_url(key)
-            if not url:
-                raise HTTPException(status_code=500, detail="R2 not configured")
-            return RedirectResponse(url)
-        pdf_path = _wallet_invoice_pdf_path(request_id)
-        HTML(string=html, base_url=os.path.dirname(__file__)).write_pdf(pdf_path)
-        return FileResponse(pdf_path, media_type="application/pdf")
+    return _cached_invoice_pdf_response(html, if_none_match)
 
 
 @app.get("/legal-entities")
@@ -9031,6 +10343,7 @@ def create_account_request(payload: AccountRequestCreate, current_user=Depends(g
         )
         conn.commit()
         request_id = cur.lastrowid
+        _publish_admin_work_item(conn, "account_request", request_id)
         _send_telegram_alert(
             "\n".join(
                 [
@@ -9052,12 +10365,31 @@ def create_account_request(payload: AccountRequestCreate, current_user=Depends(g
 
 
 @app.get("/admin/account-requests")
-def admin_list_account_requests(admin_user=Depends(get_admin_user)):
+def admin_list_account_requests(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    status: Optional[str] = None,
+    platform: Optional[str] = None,
+    user_id: Optional[int] = None,
+    q: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    clauses, params = _admin_list_filters(
+        ("r.status = ?", status),
+        ("r.platform = ?", platform),
+        ("r.user_id = ?", user_id),
+        *_admin_list_common_filters("r.created_at", "u.email", q, date_from, date_to),
+    )
     with get_conn() as conn:
-        _sync_completed_topup_funding_events(conn)
-        rows = conn.execute(
+        # Completed topups record their funding events when they complete, so the totals
+        # below are current without re-syncing every topup on each page load.
+        return _admin_list_page(
+            conn,
             """
             SELECT r.*,
                    u.email as user_email,
@@ -9071,26 +10403,55 @@ def admin_list_account_requests(admin_user=Depends(get_admin_user)):
             FROM account_requests r
             JOIN users u ON u.id = r.user_id
             LEFT JOIN ad_accounts a ON a.user_id = r.user_id AND a.platform = r.platform AND a.name = r.name
-            ORDER BY r.created_at DESC
-            """
-        ).fetchall()
-        return [dict(row) for row in rows]
+            {where}
+            """,
+            clauses,
+            params,
+            [("r.created_at", "created_at"), ("r.id", "id")],
+            cursor,
+            limit,
+            response,
+        )
 
 
 @app.get("/admin/accounts")
-def admin_list_accounts(admin_user=Depends(get_admin_user)):
+def admin_list_accounts(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    status: Optional[str] = None,
+    platform: Optional[str] = None,
+    user_id: Optional[int] = None,
+    q: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    clauses, params = _admin_list_filters(
+        ("a.status = ?", status),
+        ("a.platform = ?", platform),
+        ("a.user_id = ?", user_id),
+        *_admin_list_common_filters("a.created_at", "u.email", q, date_from, date_to),
+    )
     with get_conn() as conn:
-        rows = conn.execute(
+        rows = _admin_list_page(
+            conn,
             """
             SELECT a.*, u.email as user_email
             FROM ad_accounts a
             JOIN users u ON u.id = a.user_id
-            ORDER BY a.created_at DESC
-            """
-        ).fetchall()
-        return _attach_live_billing_many([dict(row) for row in rows])
+            {where}
+            """,
+            clauses,
+            params,
+            [("a.created_at", "created_at"), ("a.id", "id")],
+            cursor,
+            limit,
+            response,
+        )
+    return _attach_live_billing_many(rows)
 
 
 @app.get("/admin/agencies")
@@ -9226,6 +10587,7 @@ def admin_add_agency_member(agency_id: int, payload: AgencyMemberCreatePayload,
             "UPDATE agency_members SET role=?, status=? WHERE agency_id=? AND user_id=?",
             (payload.role, payload.status or "active", agency_id, payload.user_id),
         )
+        _invalidate_visible_accounts(conn, [payload.user_id])
         conn.commit()
         return {"status": "ok", "agency_id": agency_id, "user_id": payload.user_id, "role": payload.role}
 
@@ -9287,6 +10649,7 @@ def admin_grant_agency_account_access(
             """,
             (payload.access_level, agency_id, payload.user_id, agency_account["id"]),
         )
+        _invalidate_visible_accounts(conn, [payload.user_id])
         conn.commit()
         return {"status": "ok", "agency_id": agency_id, "user_id": payload.user_id, "ad_account_id": account_id, "access_level": payload.access_level}
 
@@ -9327,6 +10690,7 @@ def admin_create_account(payload: AdminAccountCreate, admin_user=Depends(get_adm
                     existing["id"],
                 ),
             )
+            _invalidate_visible_accounts(conn, _account_audience_ids(conn, int(existing["id"])))
             if agency:
                 _ensure_agency_account_mapping(
                     conn,
@@ -9433,7 +10797,10 @@ def admin_update_account(account_id: int, payload: AdminAccountUpdate, admin_use
         if not updates:
             raise HTTPException(status_code=400, detail="No fields to update")
         params.append(account_id)
+        audience = _account_audience_ids(conn, account_id)
         conn.execute(f"UPDATE ad_accounts SET {', '.join(updates)} WHERE id=?", params)
+        if payload.user_id is not None or payload.visible_to_client is not None:
+            _invalidate_visible_accounts(conn, audience + [payload.user_id])
         conn.commit()
         return {"id": account_id, "status": "updated"}
 
@@ -9450,167 +10817,255 @@ def admin_delete_account(account_id: int, admin_user=Depends(get_admin_user)):
         wallet_tx_count = conn.execute("SELECT COUNT(1) AS cnt FROM wallet_transactions WHERE account_id=?", (account_id,)).fetchone()["cnt"]
         if int(topups_count or 0) > 0 or int(wallet_tx_count or 0) > 0:
             raise HTTPException(status_code=409, detail="Account cannot be deleted because it already has linked operations")
+        _invalidate_visible_accounts(conn, _account_audience_ids(conn, account_id))
+        funded_users = conn.execute(
+            "SELECT DISTINCT user_id FROM account_funding_events WHERE account_id=?", (account_id,)
+        ).fetchall()
         conn.execute("DELETE FROM ad_accounts WHERE id=?", (account_id,))
+        # Manual funding events go with the account (ON DELETE CASCADE).
+        _refresh_client_summaries(conn, [row["user_id"] for row in funded_users])
         conn.commit()
         return {"id": account_id, "status": "deleted", "name": row["name"]}
 
 
 @app.get("/admin/topups")
-def admin_list_topups(admin_user=Depends(get_admin_user)):
+def admin_list_topups(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    status: Optional[str] = None,
+    platform: Optional[str] = None,
+    user_id: Optional[int] = None,
+    q: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    clauses, params = _admin_list_filters(
+        ("t.status = ?", status),
+        ("a.platform = ?", platform),
+        ("t.user_id = ?", user_id),
+        *_admin_list_common_filters("t.created_at", "u.email", q, date_from, date_to),
+    )
     with get_conn() as conn:
-        rows = conn.execute(
+        rows = _admin_list_page(
+            conn,
             """
             SELECT t.*, a.name as account_name, a.platform as account_platform, a.currency as account_currency, u.email as user_email
             FROM topups t
             JOIN ad_accounts a ON a.id = t.account_id
             JOIN users u ON u.id = t.user_id
-            ORDER BY t.created_at DESC
-            """
-        ).fetchall()
-        return _attach_topup_account_amount([dict(row) for row in rows])
+            {where}
+            """,
+            clauses,
+            params,
+            [("t.created_at", "created_at"), ("t.id", "id")],
+            cursor,
+            limit,
+            response,
+        )
+    return _attach_topup_account_amount(rows)
+
+
+_CLIENT_SUMMARY_SORTS = {
+    "unread": "cs.unread_topups",
+    "pending": "cs.pending_requests",
+    "completed_total": "cs.completed_total_kzt",
+    "completed_count": "cs.completed_count",
+    "last_activity": "cs.last_activity",
+    "email": "u.email",
+}
 
 
 @app.get("/admin/clients")
-def admin_list_clients(admin_user=Depends(get_admin_user)):
+def admin_list_clients(
+    q: Optional[str] = None,
+    sort: Literal["unread", "pending", "completed_total", "completed_count", "last_activity", "email"] = "unread",
+    order: Literal["asc", "desc"] = "desc",
+    unread_only: bool = False,
+    admin_user=Depends(get_admin_user),
+):
     if not get_conn:
         return []
+    where = ["(cs.completed_count > 0 OR COALESCE(u.is_client, 0) = 1)"]
+    params: List[object] = []
+    if q and q.strip():
+        where.append("LOWER(u.email) LIKE ?")
+        params.append(f"%{q.strip().lower()}%")
+    if unread_only:
+        where.append("cs.unread_topups > 0")
+    direction = "ASC" if order == "asc" else "DESC"
+    order_by = f"{_CLIENT_SUMMARY_SORTS[sort]} {direction}"
+    if sort != "email":
+        order_by += ", u.email ASC"
     with get_conn() as conn:
-        _sync_completed_topup_funding_events(conn)
-        clients: List[Dict[str, object]] = []
-        try:
-            try:
-                rows = conn.execute(
-                    """
-                    SELECT
-                      u.id,
-                      u.email,
-                      COALESCE(ts.unread_topups, 0) as unread_topups,
-                      COALESCE(ts.pending_requests, 0) as pending_requests,
-                      COALESCE(ts.completed_total_kzt, 0) as completed_total,
-                      COALESCE(ts.completed_count, 0) as completed_count,
-                      COALESCE(ts.last_topup_at, ws.last_funding_at) as last_activity
-                    FROM users u
-                    LEFT JOIN (
-                      SELECT
-                        user_id,
-                        COALESCE(SUM(CASE WHEN seen_by_admin=0 THEN 1 ELSE 0 END), 0) as unread_topups,
-                        COALESCE(SUM(CASE WHEN status!='completed' THEN 1 ELSE 0 END), 0) as pending_requests,
-                        COALESCE(SUM(CASE WHEN status='completed' THEN 1 ELSE 0 END), 0) as completed_count,
-                        COALESCE((
-                          SELECT SUM(COALESCE(afe.amount_kzt, 0))
-                          FROM account_funding_events afe
-                          WHERE afe.user_id = t.user_id
-                        ), 0) as completed_total_kzt,
-                        MAX(created_at) as last_topup_at
-                      FROM topups t
-                      GROUP BY user_id
-                    ) ts ON ts.user_id = u.id
-                    LEFT JOIN (
-                      SELECT
-                        user_id,
-                        COALESCE(SUM(CASE WHEN type='adjustment' AND amount > 0 THEN amount ELSE 0 END), 0) as completed_total,
-                        MAX(created_at) as last_funding_at
-                      FROM wallet_transactions
-                      GROUP BY user_id
-                    ) ws ON ws.user_id = u.id
-                    WHERE COALESCE(ts.completed_count, 0) > 0 OR COALESCE(u.is_client, 0) = 1
-                    ORDER BY unread_topups DESC, u.email ASC
-                    """
-                ).fetchall()
-            except Exception:
-                rows = conn.execute(
-                    """
-                    SELECT
-                      u.id,
-                      u.email,
-                      0 as unread_topups,
-                      COALESCE(ts.pending_requests, 0) as pending_requests,
-                      COALESCE(ts.completed_total_kzt, 0) as completed_total,
-                      COALESCE(ts.completed_count, 0) as completed_count,
-                      COALESCE(ts.last_topup_at, ws.last_funding_at) as last_activity
-                    FROM users u
-                    LEFT JOIN (
-                      SELECT
-                        user_id,
-                        COALESCE(SUM(CASE WHEN status!='completed' THEN 1 ELSE 0 END), 0) as pending_requests,
-                        COALESCE(SUM(CASE WHEN status='completed' THEN 1 ELSE 0 END), 0) as completed_count,
-                        COALESCE((
-                          SELECT SUM(COALESCE(afe.amount_kzt, 0))
-                          FROM account_funding_events afe
-                          WHERE afe.user_id = t.user_id
-                        ), 0) as completed_total_kzt,
-                        MAX(created_at) as last_topup_at
-                      FROM topups t
-                      GROUP BY user_id
-                    ) ts ON ts.user_id = u.id
-                    LEFT JOIN (
-                      SELECT
-                        user_id,
-                        COALESCE(SUM(CASE WHEN type='adjustment' AND amount > 0 THEN amount ELSE 0 END), 0) as completed_total,
-                        MAX(created_at) as last_funding_at
-                      FROM wallet_transactions
-                      GROUP BY user_id
-                    ) ws ON ws.user_id = u.id
-                    WHERE COALESCE(ts.completed_count, 0) > 0 OR COALESCE(u.is_client, 0) = 1
-                    ORDER BY u.email ASC
-                    """
-                ).fetchall()
-            clients = [dict(row) for row in rows]
-            for row in clients:
-                row["completed_total"] = float(row.get("completed_total") or 0.0)
-                row["completed_total_kzt"] = float(row.get("completed_total_kzt") or row.get("completed_total") or 0.0)
-        except Exception:
-            fallback_rows = conn.execute(
-                """
-                SELECT u.id, u.email, 0 as unread_topups,
-                  COALESCE(SUM(CASE WHEN t.status!='completed' THEN 1 ELSE 0 END), 0) as pending_requests,
-                  COALESCE(SUM(CASE WHEN t.status='completed' THEN 1 ELSE 0 END), 0) as completed_count,
-                  MAX(t.created_at) as last_activity
-                FROM users u
-                LEFT JOIN topups t ON t.user_id = u.id
-                GROUP BY u.id, u.email
-                HAVING COALESCE(SUM(CASE WHEN t.status='completed' THEN 1 ELSE 0 END), 0) > 0
-                ORDER BY u.email ASC
-                """
-            ).fetchall()
-            clients = []
-            for row in fallback_rows:
-                payload = dict(row)
-                payload["completed_total"] = 0.0
-                payload["completed_total_kzt"] = 0.0
-                clients.append(payload)
-        return clients
+        rows = conn.execute(
+            f"""
+            SELECT
+              u.id,
+              u.email,
+              cs.unread_topups,
+              cs.pending_requests,
+              cs.completed_total_kzt as completed_total,
+              cs.completed_total_kzt,
+              cs.completed_count,
+              cs.last_activity
+            FROM client_summary cs
+            JOIN users u ON u.id = cs.user_id
+            WHERE {" AND ".join(where)}
+            ORDER BY {order_by}
+            """,
+            params,
+        ).fetchall()
+    clients = [dict(row) for row in rows]
+    for row in clients:
+        row["completed_total"] = float(row.get("completed_total") or 0.0)
+        row["completed_total_kzt"] = float(row.get("completed_total_kzt") or 0.0)
+    return clients
+
+
+@app.post("/admin/clients/rebuild-summary")
+def admin_rebuild_client_summary(admin_user=Depends(get_admin_user)):
+    with get_conn() as conn:
+        return {"rows": rebuild_client_summaries(conn)}
 
 
 @app.get("/admin/users")
-def admin_list_users(admin_user=Depends(get_admin_user)):
+def admin_list_users(
+    response: Response,
+    admin_user=Depends(get_admin_user),
+    q: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(_ADMIN_LIST_PAGE_SIZE, ge=1, le=_ADMIN_LIST_MAX_PAGE_SIZE),
+):
     if not get_conn:
         return []
+    # Registered users that are not clients yet: no completed topup and not promoted by hand.
+    clauses, params = _admin_list_filters(*_admin_list_common_filters("u.created_at", "u.email", q, date_from, date_to))
+    clauses.append("COALESCE(u.is_client, 0) = 0")
+    clauses.append("NOT EXISTS (SELECT 1 FROM topups t WHERE t.user_id = u.id AND t.status = 'completed')")
+    admin_emails = sorted(ADMIN_EMAILS)
+    if admin_emails:
+        clauses.append(f"u.email NOT IN ({', '.join(['?'] * len(admin_emails))})")
+        params.extend(admin_emails)
     with get_conn() as conn:
-        admin_emails = sorted(ADMIN_EMAILS)
-        email_filter = ""
-        params: List[object] = []
-        if admin_emails:
-            placeholders = ", ".join(["?"] * len(admin_emails))
-            email_filter = f"WHERE u.email NOT IN ({placeholders})"
-            params.extend(admin_emails)
-        rows = conn.execute(
+        return _admin_list_page(
+            conn,
             """
-            SELECT u.id, u.email, u.created_at,
-              COALESCE(SUM(CASE WHEN t.status='completed' THEN 1 ELSE 0 END), 0) as completed_count
+            SELECT u.id, u.email, u.created_at, 0 as completed_count
             FROM users u
-            LEFT JOIN topups t ON t.user_id = u.id
-            {email_filter}
-            GROUP BY u.id, u.email, u.created_at
-            HAVING COALESCE(SUM(CASE WHEN t.status='completed' THEN 1 ELSE 0 END), 0) = 0
-               AND COALESCE(u.is_client, 0) = 0
-            ORDER BY u.created_at DESC
-            """.format(email_filter=email_filter),
+            {where}
+            """,
+            clauses,
             params,
-        ).fetchall()
-        return [dict(row) for row in rows]
+            [("u.created_at", "created_at"), ("u.id", "id")],
+            cursor,
+            limit,
+            response,
+        )
+
+
+# Fields each /admin/search result carries besides its type, id and score, keyed by kind.
+_ADMIN_SEARCH_DETAILS_SQL = {
+    "user": """
+        SELECT u.id, u.email AS title, u.id AS user_id, u.email AS user_email, COALESCE(u.is_client, 0) AS is_client
+        FROM users u
+        WHERE u.id IN ({ids})
+    """,
+    "account": """
+        SELECT a.id, a.name AS title, a.platform, a.external_id, a.account_code, a.user_id, u.email AS user_email
+        FROM ad_accounts a
+        LEFT JOIN users u ON u.id = a.user_id
+        WHERE a.id IN ({ids})
+    """,
+    "legal_entity": """
+        SELECT le.id, le.name AS title, le.short_name, le.bin, ule.user_id, u.email AS user_email
+        FROM legal_entities le
+        LEFT JOIN user_legal_entities ule ON ule.legal_entity_id = le.id
+        LEFT JOIN users u ON u.id = ule.user_id
+        WHERE le.id IN ({ids})
+        ORDER BY COALESCE(ule.is_default, 0) DESC, ule.user_id ASC
+    """,
+}
+
+
+def _admin_search_hits(conn, q: str, kinds: List[str], limit: int) -> List[Tuple[str, int, float]]:
+    """(kind, id, score) of the best `limit` matches for `q`, best first."""
+    if is_postgres():
+        # Substring matches come from ILIKE, near misses from the word-similarity operator;
+        # both are served by the trigram indexes of migration 10.
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        hits: List[Tuple[str, int, float]] = []
+        for kind, table, _columns, text in SEARCH_DOCUMENTS:
+            if kind not in kinds:
+                continue
+            expr = text.format(row="")
+            rows = conn.execute(
+                f"""
+                SELECT id, word_similarity(?, {expr}) AS score
+                FROM {table}
+                WHERE {expr} ILIKE ? OR ? <%% {expr}
+                ORDER BY score DESC, id DESC
+                LIMIT ?
+                """,
+                (q, pattern, q, limit),
+            ).fetchall()
+            hits.extend((kind, int(row["id"]), float(row["score"] or 0)) for row in rows)
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return hits[:limit]
+    stride = len(SEARCH_DOCUMENTS)
+    kinds_by_code = {SEARCH_KIND_CODES[kind]: kind for kind in kinds}
+    placeholders = ", ".join(["?"] * len(kinds_by_code))
+    rows = conn.execute(
+        f"""
+        SELECT rowid, -bm25(admin_search) AS score
+        FROM admin_search
+        WHERE admin_search MATCH ? AND rowid % {stride} IN ({placeholders})
+        ORDER BY rank
+        LIMIT ?
+        """,
+        ['"' + q.replace('"', '""') + '"', *kinds_by_code, limit],
+    ).fetchall()
+    return [(kinds_by_code[row["rowid"] % stride], row["rowid"] // stride, float(row["score"])) for row in rows]
+
+
+@app.get("/admin/search")
+def admin_search(
+    q: str = Query(..., max_length=200),
+    types: List[Literal["user", "account", "legal_entity"]] = Query(["user", "account", "legal_entity"]),
+    limit: int = Query(20, ge=1, le=100),
+    admin_user=Depends(get_admin_user),
+):
+    needle = q.strip()
+    # Both indexes are built from trigrams, so shorter input cannot be matched through them.
+    if len(needle) < 3:
+        raise HTTPException(status_code=400, detail="Search needs at least 3 characters")
+    if not get_conn:
+        return {"q": needle, "items": []}
+    kinds = list(dict.fromkeys(types))
+    with get_conn() as conn:
+        hits = _admin_search_hits(conn, needle, kinds, limit)
+        details: Dict[str, Dict[int, Dict[str, object]]] = {}
+        for kind in kinds:
+            ids = [ref_id for hit_kind, ref_id, _ in hits if hit_kind == kind]
+            if not ids:
+                continue
+            rows = conn.execute(
+                _ADMIN_SEARCH_DETAILS_SQL[kind].format(ids=", ".join(["?"] * len(ids))),
+                ids,
+            ).fetchall()
+            for row in rows:
+                details.setdefault(kind, {}).setdefault(int(row["id"]), dict(row))
+    items = []
+    for kind, ref_id, score in hits:
+        detail = details.get(kind, {}).get(ref_id)
+        if detail:
+            items.append({"type": kind, **detail, "score": round(score, 4)})
+    return {"q": needle, "items": items}
 
 
 @app.get("/admin/users/{user_id}/fees")
@@ -9661,6 +11116,7 @@ def admin_make_user_client(user_id: int, admin_user=Depends(get_admin_user)):
         if not row:
             raise HTTPException(status_code=404, detail="User not found")
         conn.execute("UPDATE users SET is_client=1 WHERE id=?", (user_id,))
+        _refresh_client_summaries(conn, [user_id])
         conn.commit()
         return {"id": user_id, "status": "client"}
 
@@ -9840,96 +11296,230 @@ def admin_mark_client_seen(user_id: int, admin_user=Depends(get_admin_user)):
         raise HTTPException(status_code=500, detail="DB not initialized")
     with get_conn() as conn:
         conn.execute("UPDATE topups SET seen_by_admin=1 WHERE user_id=?", (user_id,))
+        _refresh_client_summaries(conn, [user_id])
         conn.commit()
         return {"status": "ok"}
 
 
+_XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_EXPORT_BATCH_SIZE = 500
+
+
+def _admin_export_filters(
+    table_alias: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+    platform: Optional[str] = None,
+) -> Tuple[str, List[object]]:
+    clauses: List[str] = []
+    params: List[object] = []
+    if date_from:
+        clauses.append(f"{table_alias}.created_at >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        clauses.append(f"{table_alias}.created_at < ?")
+        params.append((date_to + timedelta(days=1)).isoformat())
+    if user_id:
+        clauses.append(f"{table_alias}.user_id = ?")
+        params.append(user_id)
+    if status:
+        clauses.append(f"{table_alias}.status = ?")
+        params.append(status)
+    if platform:
+        clauses.append(f"{table_alias}.platform = ?")
+        params.append(platform)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _iter_export_rows(query: str, params: List[object], to_row) -> Iterator[List[object]]:
+    with get_conn() as conn:
+        for row in iter_rows(conn, query, tuple(params), _EXPORT_BATCH_SIZE):
+            yield to_row(row)
+
+
+def _iter_csv_chunks(header: List[str], rows: Iterator[List[object]]) -> Iterator[bytes]:
+    import csv
+    from io import StringIO
+
+    buf = StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(header)
+    for idx, row in enumerate(rows, start=1):
+        writer.writerow(["" if value is None else value for value in row])
+        if idx % _EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue().encode("utf-8")
+
+
+def _admin_export_response(
+    filename: str,
+    sheet_title: str,
+    header: List[str],
+    rows: Iterator[List[object]],
+    export_format: str,
+) -> StreamingResponse:
+    """Stream an admin export: CSV is emitted batch by batch, XLSX goes through a write-only workbook."""
+    if export_format == "csv":
+        headers = {"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+        return StreamingResponse(_iter_csv_chunks(header, rows), media_type="text/csv; charset=utf-8", headers=headers)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    out = tempfile.SpooledTemporaryFile(max_size=_XLSX_SPOOL_MAX_BYTES)
+    wb.save(out)
+    out.seek(0)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.xlsx"'}
+    return StreamingResponse(_iter_file_chunks(out), media_type=_XLSX_MEDIA_TYPE, headers=headers)
+
+
 @app.get("/admin/export/requests.xlsx")
-def admin_export_requests(admin_user=Depends(get_admin_user)):
+def admin_export_requests(
+    admin_user=Depends(get_admin_user),
+    export_format: Literal["xlsx", "csv"] = Query("xlsx", alias="format"),
+    run_async: bool = Query(False, alias="async"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+):
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Account Requests"
-    ws.append(["Дата", "Клиент", "Платформа", "Название", "Статус", "Менеджер"])
-    with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT r.*, u.email as user_email
-            FROM account_requests r
-            JOIN users u ON u.id = r.user_id
-            ORDER BY r.created_at DESC
-            """
-        ).fetchall()
-        for row in rows:
-            ws.append(
-                [
-                    row["created_at"],
-                    row["user_email"],
-                    row["platform"],
-                    row["name"],
-                    row["status"],
-                    row["manager_email"] or "",
-                ]
-            )
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    headers = {"Content-Disposition": 'attachment; filename="account_requests.xlsx"'}
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers,
+    if run_async:
+        return _enqueue_export_job(admin_user, "admin_requests", _export_job_params(locals()))
+    where, params = _admin_export_filters("r", date_from, date_to, user_id, status)
+    rows = _iter_export_rows(
+        f"""
+        SELECT r.created_at, u.email as user_email, r.platform, r.name, r.status, r.manager_email
+        FROM account_requests r
+        JOIN users u ON u.id = r.user_id
+        {where}
+        ORDER BY r.created_at DESC
+        """,
+        params,
+        lambda row: [
+            row["created_at"],
+            row["user_email"],
+            row["platform"],
+            row["name"],
+            row["status"],
+            row["manager_email"] or "",
+        ],
+    )
+    return _admin_export_response(
+        "account_requests",
+        "Account Requests",
+        ["Дата", "Клиент", "Платформа", "Название", "Статус", "Менеджер"],
+        rows,
+        export_format,
     )
 
 
 @app.get("/admin/export/accounts.xlsx")
-def admin_export_accounts(admin_user=Depends(get_admin_user)):
+def admin_export_accounts(
+    admin_user=Depends(get_admin_user),
+    export_format: Literal["xlsx", "csv"] = Query("xlsx", alias="format"),
+    run_async: bool = Query(False, alias="async"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    platform: Optional[str] = None,
+):
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Accounts"
-    ws.append(["Дата", "Клиент", "Платформа", "Название", "Договор/код", "External ID"])
-    with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT a.*, u.email as user_email
-            FROM ad_accounts a
-            JOIN users u ON u.id = a.user_id
-            ORDER BY a.created_at DESC
-            """
-        ).fetchall()
-        for row in rows:
-            ws.append(
-                [
-                    row["created_at"],
-                    row["user_email"],
-                    row["platform"],
-                    row["name"],
-                    row["account_code"] or "",
-                    row["external_id"] or "",
-                ]
-            )
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    headers = {"Content-Disposition": 'attachment; filename="accounts.xlsx"'}
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers,
+    if run_async:
+        return _enqueue_export_job(admin_user, "admin_accounts", _export_job_params(locals()))
+    where, params = _admin_export_filters("a", date_from, date_to, user_id, platform=platform)
+    rows = _iter_export_rows(
+        f"""
+        SELECT a.created_at, u.email as user_email, a.platform, a.name, a.account_code, a.external_id
+        FROM ad_accounts a
+        JOIN users u ON u.id = a.user_id
+        {where}
+        ORDER BY a.created_at DESC
+        """,
+        params,
+        lambda row: [
+            row["created_at"],
+            row["user_email"],
+            row["platform"],
+            row["name"],
+            row["account_code"] or "",
+            row["external_id"] or "",
+        ],
+    )
+    return _admin_export_response(
+        "accounts",
+        "Accounts",
+        ["Дата", "Клиент", "Платформа", "Название", "Договор/код", "External ID"],
+        rows,
+        export_format,
     )
 
 
+def _topup_export_row(row) -> List[object]:
+    payload = dict(row)
+    amount_input = float(payload.get("amount_input") or 0)
+    fee_percent = float(payload.get("fee_percent") or 0)
+    vat_percent = float(payload.get("vat_percent") or 0)
+    fee = amount_input * fee_percent / 100.0
+    vat = amount_input * vat_percent / 100.0
+    gross = amount_input + fee + vat
+    return [
+        payload.get("created_at"),
+        payload.get("user_email"),
+        payload.get("account_platform"),
+        payload.get("account_name"),
+        amount_input,
+        round(fee, 2),
+        round(vat, 2),
+        round(gross, 2),
+        payload.get("currency"),
+        payload.get("status"),
+    ]
+
+
 @app.get("/admin/export/topups.xlsx")
-def admin_export_topups(admin_user=Depends(get_admin_user)):
+def admin_export_topups(
+    admin_user=Depends(get_admin_user),
+    export_format: Literal["xlsx", "csv"] = Query("xlsx", alias="format"),
+    run_async: bool = Query(False, alias="async"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+    platform: Optional[str] = None,
+):
     if not get_conn:
         raise HTTPException(status_code=500, detail="DB not initialized")
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Topups"
-    ws.append(
+    if run_async:
+        return _enqueue_export_job(admin_user, "admin_topups", _export_job_params(locals()))
+    where, params = _admin_export_filters("t", date_from, date_to, user_id, status)
+    if platform:
+        where += (" AND " if where else " WHERE ") + "a.platform = ?"
+        params.append(platform)
+    rows = _iter_export_rows(
+        f"""
+        SELECT t.created_at, t.amount_input, t.fee_percent, t.vat_percent, t.currency, t.status,
+               a.name as account_name, a.platform as account_platform, u.email as user_email
+        FROM topups t
+        JOIN ad_accounts a ON a.id = t.account_id
+        JOIN users u ON u.id = t.user_id
+        {where}
+        ORDER BY t.created_at DESC
+        """,
+        params,
+        _topup_export_row,
+    )
+    return _admin_export_response(
+        "topups",
+        "Topups",
         [
             "Дата",
             "Клиент",
@@ -9941,51 +11531,265 @@ def admin_export_topups(admin_user=Depends(get_admin_user)):
             "К оплате",
             "Валюта",
             "Статус",
-        ]
+        ],
+        rows,
+        export_format,
     )
+
+
+def _export_storage_dir() -> str:
+    base_dir = os.path.join(os.path.dirname(__file__), "..", "storage", "exports")
+    os.makedirs(base_dir, exist_ok=True)
+    return base_dir
+
+
+def _export_job_params(values: Dict[str, object]) -> Dict[str, object]:
+    """Request parameters of an export endpoint, minus the caller and the async flag."""
+    skip = {"current_user", "admin_user", "run_async", "file", "authorization"}
+    return jsonable_encoder({key: value for key, value in values.items() if key not in skip})
+
+
+def _export_job_dates(params: Dict[str, object]) -> Dict[str, object]:
+    restored = dict(params)
+    for key in ("date_from", "date_to"):
+        if restored.get(key):
+            restored[key] = date.fromisoformat(str(restored[key]))
+    return restored
+
+
+def _export_job_utc(value: object) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _enqueue_export_job(current_user: Optional[Dict[str, object]], kind: str, params: Dict[str, object]):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Missing token")
     with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT t.*, a.name as account_name, a.platform as account_platform, u.email as user_email
-            FROM topups t
-            JOIN ad_accounts a ON a.id = t.account_id
-            JOIN users u ON u.id = t.user_id
-            ORDER BY t.created_at DESC
-            """
-        ).fetchall()
-        for row in rows:
-            payload = dict(row)
-            amount_input = float(payload.get("amount_input") or 0)
-            fee_percent = float(payload.get("fee_percent") or 0)
-            vat_percent = float(payload.get("vat_percent") or 0)
-            fee = amount_input * fee_percent / 100.0
-            vat = amount_input * vat_percent / 100.0
-            gross = amount_input + fee + vat
-            ws.append(
-                [
-                    payload.get("created_at"),
-                    payload.get("user_email"),
-                    payload.get("account_platform"),
-                    payload.get("account_name"),
-                    amount_input,
-                    round(fee, 2),
-                    round(vat, 2),
-                    round(gross, 2),
-                    payload.get("currency"),
-                    payload.get("status"),
-                ]
-            )
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    headers = {"Content-Disposition": 'attachment; filename="topups.xlsx"'}
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers,
+        _purge_expired_export_jobs(conn)
+        job_id = conn.execute(
+            "INSERT INTO export_jobs (user_id, kind, params, status, progress, download_token) VALUES (?, ?, ?, 'queued', 0, ?)",
+            (current_user["id"], kind, json.dumps(params, ensure_ascii=False), secrets.token_urlsafe(24)),
+        ).lastrowid
+        conn.commit()
+    _EXPORT_JOB_EXECUTOR.submit(_run_export_job, job_id)
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued", "status_url": f"/export-jobs/{job_id}"},
+        status_code=202,
     )
 
 
+def _set_export_job_progress(job_id: int, progress: int) -> None:
+    with get_conn() as conn:
+        conn.execute("UPDATE export_jobs SET progress=? WHERE id=? AND status='running'", (progress, job_id))
+        conn.commit()
+
+
+async def _write_export_response(response, out) -> None:
+    if isinstance(response, StreamingResponse):
+        async for chunk in response.body_iterator:
+            out.write(chunk if isinstance(chunk, bytes) else chunk.encode(response.charset))
+    else:
+        out.write(response.body)
+
+
+def _store_export_artifact(job_id: int, filename: str, media_type: str, fileobj) -> str:
+    stored_name = f"export_{job_id}_{secrets.token_hex(6)}{os.path.splitext(filename)[1]}"
+    if _r2_enabled():
+        return _r2_upload_fileobj(f"exports/{stored_name}", fileobj, media_type)
+    fileobj.seek(0)
+    path = os.path.join(_export_storage_dir(), stored_name)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(fileobj, f)
+    return path
+
+
+def _run_export_job(job_id: int) -> None:
+    with get_conn() as conn:
+        claimed = conn.execute(
+            "UPDATE export_jobs SET status='running', progress=10, started_at=? WHERE id=? AND status='queued'",
+            (_utc_timestamp(), job_id),
+        ).rowcount
+        conn.commit()
+        if not claimed:
+            return
+        job = dict(conn.execute("SELECT * FROM export_jobs WHERE id=?", (job_id,)).fetchone())
+        user_row = conn.execute("SELECT u.*, u.email AS login_email FROM users u WHERE u.id=?", (job["user_id"],)).fetchone()
+        user = _hydrate_token_user(conn, user_row) if user_row else None
+    try:
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        builder = _EXPORT_JOB_KINDS.get(job["kind"])
+        if not builder:
+            raise HTTPException(status_code=400, detail=f"Unsupported export kind: {job['kind']}")
+        response = builder(user, json.loads(job["params"] or "{}"))
+        if inspect.isawaitable(response):
+            response = asyncio.run(response)
+        _set_export_job_progress(job_id, 50)
+        disposition = response.headers.get("content-disposition") or ""
+        match = re.search(r'filename="([^"]+)"', disposition)
+        filename = match.group(1) if match else f"export_{job_id}"
+        media_type = response.media_type or "application/octet-stream"
+        with tempfile.SpooledTemporaryFile(max_size=_XLSX_SPOOL_MAX_BYTES) as out:
+            asyncio.run(_write_export_response(response, out))
+            _set_export_job_progress(job_id, 80)
+            file_path = _store_export_artifact(job_id, filename, media_type, out)
+    except Exception as exc:
+        error = exc.detail if isinstance(exc, HTTPException) else str(exc)
+        if not isinstance(exc, HTTPException):
+            logging.exception("Export job %s failed", job_id)
+        with get_conn() as conn:
+            conn.execute(
+                "UPDATE export_jobs SET status='failed', error=?, finished_at=? WHERE id=?",
+                (str(error), _utc_timestamp(), job_id),
+            )
+            conn.commit()
+        return
+    finished_at = datetime.utcnow()
+    with get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE export_jobs
+            SET status='done', progress=100, file_path=?, filename=?, media_type=?, finished_at=?, expires_at=?
+            WHERE id=?
+            """,
+            (
+                file_path,
+                filename,
+                media_type,
+                _utc_timestamp(finished_at),
+                _utc_timestamp(finished_at + timedelta(seconds=_EXPORT_JOB_TTL_SEC)),
+                job_id,
+            ),
+        )
+        conn.commit()
+
+
+def _expire_export_job(conn, job: Dict[str, object]) -> None:
+    try:
+        _delete_stored_file(job.get("file_path"))
+    finally:
+        conn.execute("UPDATE export_jobs SET status='expired', file_path=NULL WHERE id=?", (job["id"],))
+
+
+def _purge_expired_export_jobs(conn, limit: int = 20) -> None:
+    rows = conn.execute(
+        "SELECT id, file_path FROM export_jobs WHERE status='done' AND expires_at < ? ORDER BY expires_at LIMIT ?",
+        (_utc_timestamp(), limit),
+    ).fetchall()
+    for row in rows:
+        _expire_export_job(conn, dict(row))
+    if rows:
+        conn.commit()
+
+
+def _recover_export_jobs() -> None:
+    """Fail jobs orphaned mid-run by a restart and hand still-queued jobs to this process's executor."""
+    stale_before = datetime.utcnow() - timedelta(seconds=_EXPORT_JOB_TIMEOUT_SEC)
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE export_jobs SET status='failed', error=?, finished_at=? WHERE status='running' AND started_at < ?",
+            ("Export job timed out", _utc_timestamp(), _utc_timestamp(stale_before)),
+        )
+        queued = conn.execute("SELECT id FROM export_jobs WHERE status='queued' ORDER BY id").fetchall()
+        conn.commit()
+    # Several processes may sweep at once; the claim in _run_export_job keeps a job from running twice.
+    for row in queued:
+        _EXPORT_JOB_EXECUTOR.submit(_run_export_job, row["id"])
+
+
+def _export_job_payload(job: Dict[str, object]) -> Dict[str, object]:
+    payload = {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job.get("progress") or 0,
+        "error": job.get("error"),
+        "filename": job.get("filename"),
+        "created_at": job.get("created_at"),
+        "finished_at": job.get("finished_at"),
+        "expires_at": job.get("expires_at"),
+        "download_url": None,
+    }
+    if job["status"] == "done":
+        payload["download_url"] = f"/export-jobs/{job['id']}/download?token={job['download_token']}"
+    return payload
+
+
+@app.get("/export-jobs/{job_id}")
+def export_job_status(job_id: int, current_user=Depends(get_current_user)):
+    if not get_conn:
+        raise HTTPException(status_code=500, detail="DB not initialized")
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM export_jobs WHERE id=? AND user_id=?", (job_id, current_user["id"])).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        job = dict(row)
+        expires_at = _export_job_utc(job.get("expires_at"))
+        if job["status"] == "done" and expires_at and expires_at < datetime.utcnow():
+            _expire_export_job(conn, job)
+            conn.commit()
+            job["status"] = "expired"
+    return _export_job_payload(job)
+
+
+@app.get("/export-jobs/{job_id}/download")
+def export_job_download(job_id: int, token: str):
+    if not get_conn:
+        raise HTTPException(status_code=500, detail="DB not initialized")
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM export_jobs WHERE id=?", (job_id,)).fetchone()
+        if not row or not hmac.compare_digest(str(row["download_token"] or ""), token):
+            raise HTTPException(status_code=404, detail="Export job not found")
+        job = dict(row)
+        if job["status"] == "expired":
+            raise HTTPException(status_code=410, detail="Export link expired")
+        if job["status"] != "done" or not job.get("file_path"):
+            raise HTTPException(status_code=409, detail="Export is not ready")
+        expires_at = _export_job_utc(job.get("expires_at"))
+        remaining = (expires_at - datetime.utcnow()).total_seconds() if expires_at else 0
+        if remaining <= 0:
+            _expire_export_job(conn, job)
+            conn.commit()
+            raise HTTPException(status_code=410, detail="Export link expired")
+    r2_path = _r2_parse_path(job["file_path"])
+    if r2_path:
+        bucket, key = r2_path
+        url = _r2_presigned_url(key, bucket=bucket, expires=max(int(remaining), 1))
+        if not url:
+            raise HTTPException(status_code=500, detail="R2 not configured")
+        return RedirectResponse(url)
+    return FileResponse(job["file_path"], media_type=job.get("media_type"), filename=job.get("filename"))
+
+
+_EXPORT_JOB_KINDS: Dict[str, Callable[[Dict[str, object], Dict[str, object]], object]] = {
+    "dashboard_pdf": lambda user, params: dashboard_export_pdf(**params, current_user=user, run_async=False),
+    "plan_vs_fact_xlsx": lambda user, params: fact_weekly_excel(
+        PlanRequest(**params["plan_payload"]),
+        file=None,
+        campaign_id=params.get("campaign_id"),
+        run_async=False,
+        authorization=None,
+    ),
+    "admin_requests": lambda user, params: admin_export_requests(
+        admin_user=get_admin_user(user), run_async=False, **_export_job_dates(params)
+    ),
+    "admin_accounts": lambda user, params: admin_export_accounts(
+        admin_user=get_admin_user(user), run_async=False, **_export_job_dates(params)
+    ),
+    "admin_topups": lambda user, params: admin_export_topups(
+        admin_user=get_admin_user(user), run_async=False, **_export_job_dates(params)
+    ),
+}
+
+
 @app.post("/admin/topups/{topup_id}/status")
 def admin_update_topup_status(topup_id: int, status: TopUpStatus, admin_user=Depends(get_admin_user)):
     if not get_conn:
@@ -10058,6 +11862,7 @@ def admin_update_topup_status(topup_id: int, status: TopUpStatus, admin_user=Dep
                 note=f"Completed topup #{topup_id}",
             )
             conn.execute("UPDATE users SET is_client=1 WHERE id=?", (row["user_id"],))
+            _bump_unread_notifications(conn, int(row["user_id"]), "topup", topup_id)
             user_row = conn.execute("SELECT email FROM users WHERE id=?", (row["user_id"],)).fetchone()
             _send_telegram_alert(
                 "\n".join(
@@ -10091,49 +11896,117 @@ def admin_update_topup_status(topup_id: int, status: TopUpStatus, admin_user=Dep
                 conn.execute("UPDATE topups SET status=? WHERE id=?", (next_status, topup_id))
         else:
             conn.execute("UPDATE topups SET status=? WHERE id=?", (next_status, topup_id))
+        if previous_status != "completed" and next_status == "completed":
+            _record_topup_profit_facts(conn, [topup_id], completed_at=_utc_timestamp())
+        elif previous_status == "completed" and next_status != "completed":
+            conn.execute("DELETE FROM topup_profit_facts WHERE topup_id=?", (topup_id,))
+            _drop_unread_notification(conn, int(row["user_id"]), "topup", topup_id)
+        _refresh_client_summaries(conn, [row["user_id"]])
         conn.commit()
+        if previous_status == "pending" and next_status != "pending":
+            _publish_admin_work_item_resolved("topup", topup_id)
+        if previous_status != "completed" and next_status == "completed":
+            _publish_client_notification(conn, "topup", topup_id)
         return {"id": topup_id, "status": next_status}
 
 
+_PROFIT_TOTALS_SQL = """
+    COUNT(*) as completed_count,
+    COALESCE(SUM(f.amount_input), 0) as amount_input_total,
+    COALESCE(SUM((f.amount_input * f.fee_percent) / 100.0), 0) as fee_total,
+    COALESCE(SUM(f.fee_amount_kzt), 0) as fee_amount_kzt,
+    COALESCE(SUM(f.fx_profit_kzt), 0) as fx_profit_kzt,
+    COALESCE(SUM(f.profit_total_kzt), 0) as profit_total_kzt
+"""
+_PROFIT_ROLLUP_GROUPS = {
+    "platform": ("f.platform as platform", "f.platform"),
+    "currency": ("f.currency as currency", "f.currency"),
+    "client": ("f.user_id as user_id, u.email as user_email", "f.user_id, u.email"),
+}
+
+
+def _profit_fact_filters(date_from: Optional[date], date_to: Optional[date]) -> Tuple[str, List[object]]:
+    clauses: List[str] = []
+    params: List[object] = []
+    if date_from:
+        clauses.append("f.day >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        clauses.append("f.day <= ?")
+        params.append(date_to.isoformat())
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
 @app.get("/admin/topups/profit-summary")
-def admin_topups_profit_summary(admin_user=Depends(get_admin_user)):
+def admin_topups_profit_summary(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    admin_user=Depends(get_admin_user),
+):
     if not get_conn:
         return {"overall": {}, "by_platform": []}
+    where, params = _profit_fact_filters(date_from, date_to)
     with get_conn() as conn:
         rows = conn.execute(
-            """
-            SELECT
-              a.platform as platform,
-              t.currency as currency,
-              COUNT(*) as completed_count,
-              COALESCE(SUM(t.amount_input), 0) as amount_input_total,
-              COALESCE(SUM((t.amount_input * t.fee_percent) / 100.0), 0) as fee_total
-            FROM topups t
-            JOIN ad_accounts a ON a.id = t.account_id
-            WHERE t.status='completed'
-            GROUP BY a.platform, t.currency
+            f"""
+            SELECT f.platform as platform, f.currency as currency, {_PROFIT_TOTALS_SQL}
+            FROM topup_profit_facts f
+            {where}
+            GROUP BY f.platform, f.currency
             ORDER BY fee_total DESC
-            """
+            """,
+            params,
         ).fetchall()
         by_platform = [dict(row) for row in rows]
 
         overall_rows = conn.execute(
-            """
-            SELECT
-              t.currency as currency,
-              COUNT(*) as completed_count,
-              COALESCE(SUM(t.amount_input), 0) as amount_input_total,
-              COALESCE(SUM((t.amount_input * t.fee_percent) / 100.0), 0) as fee_total
-            FROM topups t
-            WHERE t.status='completed'
-            GROUP BY t.currency
+            f"""
+            SELECT f.currency as currency, {_PROFIT_TOTALS_SQL}
+            FROM topup_profit_facts f
+            {where}
+            GROUP BY f.currency
             ORDER BY fee_total DESC
-            """
+            """,
+            params,
         ).fetchall()
         overall = [dict(row) for row in overall_rows]
         return {"overall": overall, "by_platform": by_platform}
 
 
+@app.get("/admin/topups/profit-rollup")
+def admin_topups_profit_rollup(
+    granularity: Literal["day", "month"] = "month",
+    group_by: List[Literal["platform", "currency", "client"]] = Query(["platform"]),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    admin_user=Depends(get_admin_user),
+):
+    if not get_conn:
+        return {"granularity": granularity, "group_by": group_by, "items": []}
+    groups = list(dict.fromkeys(group_by))
+    select_cols = [f"f.{granularity} as period"] + [_PROFIT_ROLLUP_GROUPS[key][0] for key in groups]
+    group_cols = [f"f.{granularity}"] + [_PROFIT_ROLLUP_GROUPS[key][1] for key in groups]
+    join = "JOIN users u ON u.id = f.user_id" if "client" in groups else ""
+    where, params = _profit_fact_filters(date_from, date_to)
+    with get_conn() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {", ".join(select_cols)}, {_PROFIT_TOTALS_SQL}
+            FROM topup_profit_facts f
+            {join}
+            {where}
+            GROUP BY {", ".join(group_cols)}
+            ORDER BY period ASC, profit_total_kzt DESC
+            """,
+            params,
+        ).fetchall()
+    items = [dict(row) for row in rows]
+    for item in items:
+        for key in ("amount_input_total", "fee_total", "fee_amount_kzt", "fx_profit_kzt", "profit_total_kzt"):
+            item[key] = round(float(item[key] or 0), 2)
+    return {"granularity": granularity, "group_by": groups, "items": items}
+
+
 @app.patch("/admin/topups/{topup_id}")
 def admin_update_topup(topup_id: int, payload: AdminTopupUpdate, admin_user=Depends(get_admin_user)):
     if not get_conn:
@@ -10141,7 +12014,7 @@ def admin_update_topup(topup_id: int, payload: AdminTopupUpdate, admin_user=Depe
     if payload.amount_net is None and payload.fx_rate is None:
         raise HTTPException(status_code=400, detail="No fields to update")
     with get_conn() as conn:
-        row = conn.execute("SELECT id FROM topups WHERE id=?", (topup_id,)).fetchone()
+        row = conn.execute("SELECT id, status, account_id FROM topups WHERE id=?", (topup_id,)).fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Topup not found")
         updates = []
@@ -10154,6 +12027,11 @@ def admin_update_topup(topup_id: int, payload: AdminTopupUpdate, admin_user=Depe
             params.append(payload.fx_rate)
         params.append(topup_id)
         conn.execute(f"UPDATE topups SET {', '.join(updates)} WHERE id=?", params)
+        # Completed topups carry their profit in topup_profit_facts; recompute it from the new amounts.
+        _record_topup_profit_facts(conn, [topup_id])
+        if row["status"] == "completed":
+            # The account's funding event and the owner's client_summary row follow the new amount.
+            _sync_completed_topup_funding_events(conn, account_id=int(row["account_id"]))
         conn.commit()
         return {"id": topup_id, "status": "updated"}
 
@@ -10241,6 +12119,10 @@ def admin_update_account_request_status(
                     status=payload.status or str(row.get("status") or "new"),
                 )
         conn.execute("UPDATE account_requests SET status=? WHERE id=?", (payload.status, request_id))
+        if row["status"] != "approved" and payload.status == "approved":
+            _bump_unread_notifications(conn, int(row["user_id"]), "account_request", request_id)
+        elif row["status"] == "approved" and payload.status != "approved":
+            _drop_unread_notification(conn, int(row["user_id"]), "account_request", request_id)
         _insert_request_event(
             conn,
             request_id=request_id,
@@ -10251,6 +12133,10 @@ def admin_update_account_request_status(
             manager_email=payload.manager_email,
         )
         conn.commit()
+        if row["status"] == "new" and payload.status != "new":
+            _publish_admin_work_item_resolved("account_request", request_id)
+        if row["status"] != "approved" and payload.status == "approved":
+            _publish_client_notification(conn, "account_request", request_id)
         return {"id": request_id, "status": payload.status}
 
 
@@ -10376,10 +12262,6 @@ def list_my_agencies(current_user=Depends(get_current_user)):
         return {"items": []}
     with get_conn() as conn:
         memberships = _list_user_agency_memberships(conn, current_user["id"])
-        if not memberships:
-            _get_or_create_default_agency(conn, current_user["id"])
-            memberships = _list_user_agency_memberships(conn, current_user["id"])
-        conn.commit()
         return {"items": memberships}
 
 
@@ -10403,6 +12285,7 @@ def list_accounts_period_spend(
 
     with get_conn() as conn:
         account_rows = _list_accessible_accounts(conn, current_user)
+        conn.commit()
         accounts = [
             {
                 "id": row["id"],
@@ -10467,6 +12350,7 @@ def list_accounts_period_spend_daily(
 
     with get_conn() as conn:
         account_rows = _list_accessible_accounts(conn, current_user)
+        conn.commit()
         account_ids = [
             int(row.get("id") or 0)
             for row in account_rows
@@ -10534,6 +12418,7 @@ def sync_accounts_finance(
 
     with get_conn() as conn:
         accounts = [dict(row) for row in _list_accessible_accounts(conn, current_user)]
+        conn.commit()
         accounts = [row for row in accounts if str(row.get("platform") or "").lower().strip() in {"meta", "google", "tiktok"}]
         if account_id is not None:
             accounts = [row for row in accounts if int(row.get("id") or 0) == int(account_id)]
@@ -10549,23 +12434,26 @@ def sync_accounts_finance(
             }
             try:
                 daily_rows = _finance_collect_daily_rows_for_account(account, from_value, to_value)
-                _finance_upsert_daily_rows(conn, account=account, rows=daily_rows)
+                spend_delta = _finance_upsert_daily_rows(conn, account=account, rows=daily_rows)
                 snapshot = _finance_refresh_snapshot_for_account(
                     conn,
                     account=account,
                     refresh_live_billing=bool(refresh_live_billing),
+                    spend_delta=spend_delta,
                 )
+                # The stats upsert and the carried spend_total commit together or not at all.
+                conn.commit()
                 account_payload.update(snapshot)
                 account_payload["synced_days"] = len(daily_rows)
                 account_payload["status"] = "ok"
                 ok_count += 1
             except Exception as exc:
+                conn.rollback()
                 logging.exception("Finance sync failed for account_id=%s", account.get("id"))
                 account_payload["status"] = "error"
                 account_payload["error"] = str(exc)
             items.append(account_payload)
 
-        conn.commit()
         return {
             "ok": True,
             "date_from": from_value,
@@ -10586,6 +12474,7 @@ def accounts_finance_summary(
 
     with get_conn() as conn:
         accounts = [dict(row) for row in _list_accessible_accounts(conn, current_user)]
+        conn.commit()
         accounts = [row for row in accounts if str(row.get("platform") or "").lower().strip() in {"meta", "google", "tiktok"}]
         if account_id is not None:
             accounts = [row for row in accounts if int(row.get("id") or 0) == int(account_id)]
@@ -10846,6 +12735,7 @@ def admin_create_account_funding_event(account_id: int, payload: AdminAccountFun
             created_by=admin_user.get("email"),
             occurred_at=payload.occurred_at,
         )
+        _refresh_client_summaries(conn, [row["user_id"]])
         conn.commit()
         return {"status": "ok", "account_id": account_id, "currency": currency, "amount": payload.amount}
 
@@ -10901,6 +12791,7 @@ def admin_reverse_account_funding_event(
             """,
             (reversal_id, datetime.utcnow().isoformat(), admin_user.get("email"), event_id),
         )
+        _refresh_client_summaries(conn, [event["user_id"]])
         conn.commit()
         return {"status": "ok", "event_id": event_id, "reversal_event_id": reversal_id}
 
@@ -10996,7 +12887,9 @@ def create_topup(payload: TopupCreatePayload, current_user=Depends(get_current_u
             """,
             (resolved_user_id, account_id, -gross_amount, currency, "topup_hold", f"Topup hold #{topup_id}"),
         )
+        _refresh_client_summaries(conn, [resolved_user_id])
         conn.commit()
+        _publish_admin_work_item(conn, "topup", topup_id)
         account_name = conn.execute("SELECT name FROM ad_accounts WHERE id=?", (account_id,)).fetchone()
         _send_telegram_alert(
             "\n".join(
@@ -0,0 +1,187 @@
+"""WeasyPrint rendering in a pool of warm worker processes.
+
+Rendering is CPU bound and the first render in a process pays for font
+discovery and user-agent stylesheet parsing, so PDFs are rendered in
+separate processes that do that work once at start-up. Requests wait for a
+bounded number of slots; when the queue is full callers get PdfRendererBusy
+instead of piling up behind a long render.
+
+This module must stay importable without app.main: workers are started with
+the "spawn" method and only import this file.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2") or 0)
+PDF_RENDER_QUEUE_SIZE = int(os.getenv("PDF_RENDER_QUEUE_SIZE", "8") or 0)
+PDF_RENDER_QUEUE_TIMEOUT_SEC = float(os.getenv("PDF_RENDER_QUEUE_TIMEOUT_SEC", "5") or 0)
+PDF_RENDER_TIMEOUT_SEC = float(os.getenv("PDF_RENDER_TIMEOUT_SEC", "60") or 60)
+
+
+class PdfRendererUnavailable(RuntimeError):
+    pass
+
+
+class PdfRendererBusy(RuntimeError):
+    pass
+
+
+class PdfRenderTimeout(RuntimeError):
+    pass
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_SLOTS = threading.BoundedSemaphore(max(PDF_RENDER_WORKERS, 1) + max(PDF_RENDER_QUEUE_SIZE, 0))
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, float] = {
+    "renders": 0,
+    "failures": 0,
+    "timeouts": 0,
+    "rejected": 0,
+    "in_flight": 0,
+    "render_ms_total": 0.0,
+    "render_ms_max": 0.0,
+    "wait_ms_total": 0.0,
+}
+
+# Per-process state of a worker, filled in by _warm_worker.
+_WORKER_FONT_CONFIG = None
+
+
+def _warm_worker() -> None:
+    global _WORKER_FONT_CONFIG
+    try:
+        from weasyprint import HTML
+        from weasyprint.text.fonts import FontConfiguration
+    except Exception:
+        return
+    _WORKER_FONT_CONFIG = FontConfiguration()
+    try:
+        HTML(string="<html><body><p>warm-up</p></body></html>").write_pdf(font_config=_WORKER_FONT_CONFIG)
+    except Exception:
+        logging.exception("PDF worker warm-up render failed")
+
+
+def _render(html_doc: str, base_url: Optional[str]) -> Tuple[bytes, float]:
+    try:
+        from weasyprint import HTML
+    except Exception as exc:
+        raise PdfRendererUnavailable(str(exc)) from None
+    started = time.perf_counter()
+    pdf = HTML(string=html_doc, base_url=base_url).write_pdf(font_config=_WORKER_FONT_CONFIG)
+    return pdf, (time.perf_counter() - started) * 1000
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=PDF_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        return _POOL
+
+
+def _terminate_pool(pool: ProcessPoolExecutor) -> None:
+    # shutdown() only stops handing out work: a worker stuck in a render keeps running, so the
+    # processes are terminated and joined here. shutdown() drops the executor's process table.
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join(timeout=1)
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    _terminate_pool(pool)
+
+
+def shutdown() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        _terminate_pool(pool)
+
+
+atexit.register(shutdown)
+
+
+def _record(key: str, amount: float = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[key] += amount
+
+
+def render_stats() -> Dict[str, float]:
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    renders = stats["renders"] or 0
+    stats["render_ms_avg"] = round(stats["render_ms_total"] / renders, 1) if renders else 0.0
+    stats["wait_ms_avg"] = round(stats["wait_ms_total"] / renders, 1) if renders else 0.0
+    stats["workers"] = PDF_RENDER_WORKERS
+    stats["queue_size"] = PDF_RENDER_QUEUE_SIZE
+    return stats
+
+
+def render_pdf(html_doc: str, base_url: Optional[str] = None) -> bytes:
+    """Render HTML to PDF bytes on the worker pool.
+
+    With PDF_RENDER_WORKERS=0 the render runs in the calling thread, still
+    subject to the same slot limit.
+    """
+    if not _SLOTS.acquire(timeout=PDF_RENDER_QUEUE_TIMEOUT_SEC):
+        _record("rejected")
+        raise PdfRendererBusy("PDF renderer is busy")
+    _record("in_flight")
+    started = time.perf_counter()
+    try:
+        if PDF_RENDER_WORKERS <= 0:
+            pdf, render_ms = _render(html_doc, base_url)
+        else:
+            pool = _get_pool()
+            future = pool.submit(_render, html_doc, base_url)
+            try:
+                pdf, render_ms = future.result(timeout=PDF_RENDER_TIMEOUT_SEC)
+            except FutureTimeoutError:
+                # A worker stuck on a render cannot be interrupted: kill the pool's workers (other
+                # in-flight renders fail with BrokenProcessPool) and let the next call start a fresh one.
+                _record("timeouts")
+                _reset_pool(pool)
+                raise PdfRenderTimeout("PDF render timed out") from None
+            except BrokenProcessPool:
+                _reset_pool(pool)
+                raise
+    except Exception:
+        _record("failures")
+        raise
+    finally:
+        _record("in_flight", -1)
+        _SLOTS.release()
+    total_ms = (time.perf_counter() - started) * 1000
+    with _STATS_LOCK:
+        _STATS["renders"] += 1
+        _STATS["render_ms_total"] += render_ms
+        _STATS["render_ms_max"] = max(_STATS["render_ms_max"], render_ms)
+        _STATS["wait_ms_total"] += max(total_ms - render_ms, 0.0)
+    logging.info("PDF rendered in %.0f ms (%.0f ms total)", render_ms, total_ms)
+    return pdf
@@ -1,7 +1,10 @@
+-- Baseline schema (migration 1 in app/db.py). Add later changes as new numbered migrations.
+
 CREATE TABLE IF NOT EXISTS campaigns (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL,
   currency TEXT DEFAULT 'USD',
+  fact_version INTEGER DEFAULT 0,
   created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -30,6 +33,30 @@ CREATE TABLE IF NOT EXISTS fact_rows (
   created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE INDEX IF NOT EXISTS idx_fact_rows_campaign_date ON fact_rows(campaign_id, date);
+
+CREATE TABLE IF NOT EXISTS fact_weekly_agg (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+  match_strategy TEXT NOT NULL,
+  iso_year INTEGER NOT NULL,
+  iso_week INTEGER NOT NULL,
+  week_start DATE NOT NULL,
+  match_key TEXT NOT NULL,
+  platform TEXT NOT NULL,
+  cost DOUBLE PRECISION DEFAULT 0,
+  impressions DOUBLE PRECISION DEFAULT 0,
+  clicks DOUBLE PRECISION DEFAULT 0,
+  leads DOUBLE PRECISION DEFAULT 0,
+  conversions DOUBLE PRECISION DEFAULT 0,
+  views DOUBLE PRECISION DEFAULT 0,
+  days_mask INTEGER DEFAULT 0,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE(campaign_id, match_strategy, iso_year, iso_week, match_key, platform)
+);
+
+CREATE INDEX IF NOT EXISTS idx_fact_weekly_agg_campaign_week ON fact_weekly_agg(campaign_id, week_start);
+
 CREATE TABLE IF NOT EXISTS users (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   email TEXT NOT NULL UNIQUE,
@@ -333,3 +360,23 @@ CREATE TABLE IF NOT EXISTS user_documents (
   file_path TEXT NOT NULL,
   created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
+
+CREATE TABLE IF NOT EXISTS export_jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+  kind TEXT NOT NULL,
+  params TEXT,
+  status TEXT DEFAULT 'queued',
+  progress INTEGER DEFAULT 0,
+  error TEXT,
+  file_path TEXT,
+  filename TEXT,
+  media_type TEXT,
+  download_token TEXT,
+  expires_at TEXT,
+  started_at TEXT,
+  finished_at TEXT,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_jobs_user_created ON export_jobs(user_id, created_at);
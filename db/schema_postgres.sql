@@ -1,7 +1,10 @@
+-- Baseline schema (migration 1 in app/db.py). Add later changes as new numbered migrations.
+
 CREATE TABLE IF NOT EXISTS campaigns (
   id BIGSERIAL PRIMARY KEY,
   name TEXT NOT NULL,
   currency TEXT DEFAULT 'USD',
+  fact_version INTEGER DEFAULT 0,
   created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
@@ -30,6 +33,30 @@ CREATE TABLE IF NOT EXISTS fact_rows (
   created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+CREATE INDEX IF NOT EXISTS idx_fact_rows_campaign_date ON fact_rows(campaign_id, date);
+
+CREATE TABLE IF NOT EXISTS fact_weekly_agg (
+  id BIGSERIAL PRIMARY KEY,
+  campaign_id BIGINT REFERENCES campaigns(id) ON DELETE CASCADE,
+  match_strategy TEXT NOT NULL,
+  iso_year INTEGER NOT NULL,
+  iso_week INTEGER NOT NULL,
+  week_start DATE NOT NULL,
+  match_key TEXT NOT NULL,
+  platform TEXT NOT NULL,
+  cost DOUBLE PRECISION DEFAULT 0,
+  impressions DOUBLE PRECISION DEFAULT 0,
+  clicks DOUBLE PRECISION DEFAULT 0,
+  leads DOUBLE PRECISION DEFAULT 0,
+  conversions DOUBLE PRECISION DEFAULT 0,
+  views DOUBLE PRECISION DEFAULT 0,
+  days_mask INTEGER DEFAULT 0,
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  UNIQUE(campaign_id, match_strategy, iso_year, iso_week, match_key, platform)
+);
+
+CREATE INDEX IF NOT EXISTS idx_fact_weekly_agg_campaign_week ON fact_weekly_agg(campaign_id, week_start);
+
 CREATE TABLE IF NOT EXISTS users (
   id BIGSERIAL PRIMARY KEY,
   email TEXT NOT NULL UNIQUE,
@@ -332,3 +359,23 @@ CREATE TABLE IF NOT EXISTS user_documents (
   file_path TEXT NOT NULL,
   created_at TIMESTAMPTZ DEFAULT NOW()
 );
+
+CREATE TABLE IF NOT EXISTS export_jobs (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT REFERENCES users(id) ON DELETE CASCADE,
+  kind TEXT NOT NULL,
+  params TEXT,
+  status TEXT DEFAULT 'queued',
+  progress INTEGER DEFAULT 0,
+  error TEXT,
+  file_path TEXT,
+  filename TEXT,
+  media_type TEXT,
+  download_token TEXT,
+  expires_at TIMESTAMPTZ,
+  started_at TIMESTAMPTZ,
+  finished_at TIMESTAMPTZ,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_jobs_user_created ON export_jobs(user_id, created_at);
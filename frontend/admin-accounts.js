@@ -23,6 +23,7 @@ const accountCode = document.getElementById('account-code')
 const accountCurrency = document.getElementById('account-currency')
 const accountStatus = document.getElementById('account-status')
 let cachedAccountUsers = []
+let accountRows = []
 
 function authHeadersSafe() {
   const token = localStorage.getItem('auth_token')
@@ -56,13 +57,14 @@ function formatLiveBillingCell(liveBilling, fallbackCurrency) {
   return `${formatMoney(limit)} ${currency}`
 }
 
-async function fetchAccounts() {
+async function fetchAccounts(cursor = '') {
   try {
-    const res = await fetch(`${apiBase}/admin/accounts`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/accounts`, { headers: authHeadersSafe(), cursor })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load accounts')
-    const data = await res.json()
-    renderAccounts(data)
+    accountRows = cursor ? [...accountRows, ...rows] : rows
+    renderAccounts(accountRows)
+    renderLoadMore(accountsBody, nextCursor, fetchAccounts)
   } catch (e) {
     if (accountsStatus) accountsStatus.textContent = 'Ошибка загрузки аккаунтов.'
   }
@@ -106,13 +108,15 @@ function renderAccounts(rows) {
 async function fetchClients() {
   if (!accountUser) return
   try {
-    const [clientsRes, usersRes] = await Promise.all([
+    const [clientsRes, usersPages] = await Promise.all([
       fetch(`${apiBase}/admin/clients`, { headers: authHeadersSafe() }),
-      fetch(`${apiBase}/admin/users`, { headers: authHeadersSafe() }),
+      // The owner picker must offer every user, so this follows the cursor to the last page.
+      fetchAdminPages(`${apiBase}/admin/users`, { headers: authHeadersSafe(), maxPages: Infinity }),
     ])
+    const usersRes = usersPages.res
     if (handleAuthFailure(clientsRes) || handleAuthFailure(usersRes)) return
     if (!clientsRes.ok || !usersRes.ok) throw new Error('Failed to load users')
-    const [clients, users] = await Promise.all([clientsRes.json(), usersRes.json()])
+    const [clients, users] = [await clientsRes.json(), usersPages.rows]
     const merged = [...(Array.isArray(clients) ? clients : []), ...(Array.isArray(users) ? users : [])]
     const unique = new Map()
     merged.forEach((row) => {
@@ -33,28 +33,35 @@ function handleAuthFailure(res) {
   return false
 }
 
-async function fetchRequests() {
+async function fetchRequests(cursor = '') {
+  // Filters run on the server, so every matching request is reachable through "load more".
+  const params = new URLSearchParams()
+  const status = filterStatus?.value || ''
+  const platform = filterPlatform?.value || ''
+  const email = (filterEmail?.value || '').trim()
+  if (status) params.set('status', status)
+  if (platform) params.set('platform', platform)
+  if (email) params.set('q', email)
+  const query = params.toString()
   try {
-    const res = await fetch(`${apiBase}/admin/account-requests`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(
+      `${apiBase}/admin/account-requests${query ? `?${query}` : ''}`,
+      { headers: authHeadersSafe(), cursor }
+    )
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load requests')
-    const data = await res.json()
-    allRows = data
-    applyFilters()
+    allRows = cursor ? [...allRows, ...rows] : rows
+    renderRows(allRows)
+    renderLoadMore(tableBody, nextCursor, fetchRequests)
   } catch (e) {
     if (statusEl) statusEl.textContent = 'Ошибка загрузки заявок.'
   }
 }
 
+let filterTimer = null
 function applyFilters() {
-  let rows = [...allRows]
-  const status = filterStatus?.value || ''
-  const platform = filterPlatform?.value || ''
-  const email = (filterEmail?.value || '').trim().toLowerCase()
-  if (status) rows = rows.filter((row) => row.status === status)
-  if (platform) rows = rows.filter((row) => row.platform === platform)
-  if (email) rows = rows.filter((row) => (row.user_email || '').toLowerCase().includes(email))
-  renderRows(rows)
+  clearTimeout(filterTimer)
+  filterTimer = setTimeout(() => fetchRequests(), 250)
 }
 
 function renderRows(rows) {
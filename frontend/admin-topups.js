@@ -27,26 +27,33 @@ function handleAuthFailure(res) {
   return false
 }
 
-async function fetchTopups() {
+async function fetchTopups(cursor = '') {
+  // Filters run on the server, so only matching topups are paged in.
+  const params = new URLSearchParams()
+  const status = topupFilterStatus?.value || ''
+  const email = (topupFilterEmail?.value || '').trim()
+  if (status) params.set('status', status)
+  if (email) params.set('q', email)
+  const query = params.toString()
   try {
-    const res = await fetch(`${apiBase}/admin/topups`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/topups${query ? `?${query}` : ''}`, {
+      headers: authHeadersSafe(),
+      cursor,
+    })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load topups')
-    const data = await res.json()
-    topupRows = data
-    applyTopupFilters()
+    topupRows = cursor ? [...topupRows, ...rows] : rows
+    renderTopups(topupRows)
+    renderLoadMore(topupsBody, nextCursor, fetchTopups)
   } catch (e) {
     if (topupsStatus) topupsStatus.textContent = 'Ошибка загрузки пополнений.'
   }
 }
 
+let topupFilterTimer = null
 function applyTopupFilters() {
-  let rows = [...topupRows]
-  const status = topupFilterStatus?.value || ''
-  const email = (topupFilterEmail?.value || '').trim().toLowerCase()
-  if (status) rows = rows.filter((row) => row.status === status)
-  if (email) rows = rows.filter((row) => (row.user_email || '').toLowerCase().includes(email))
-  renderTopups(rows)
+  clearTimeout(topupFilterTimer)
+  topupFilterTimer = setTimeout(() => fetchTopups(), 250)
 }
 
 function renderTopups(rows) {
@@ -30,13 +30,16 @@ function formatDate(value) {
   return str.split(' ')[0]
 }
 
-async function fetchUsers() {
+let userRows = []
+
+async function fetchUsers(cursor = '') {
   try {
-    const res = await fetch(`${apiBase}/admin/users`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/users`, { headers: authHeadersSafe(), cursor })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load users')
-    const data = await res.json()
-    renderUsers(data)
+    userRows = cursor ? [...userRows, ...rows] : rows
+    renderUsers(userRows)
+    renderLoadMore(usersBody, nextCursor, fetchUsers)
   } catch (e) {
     if (usersStatus) usersStatus.textContent = 'Ошибка загрузки пользователей.'
   }
@@ -35,37 +35,50 @@ function handleAuthFailure(res) {
   return false
 }
 
-async function fetchWallets() {
+let walletRows = []
+let walletLowRows = []
+let walletTxRows = []
+
+async function fetchWallets(cursor = '') {
   try {
-    const res = await fetch(`${apiBase}/admin/wallets`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/wallets`, { headers: authHeadersSafe(), cursor })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load wallets')
-    const data = await res.json()
-    renderWallets(data)
+    walletRows = cursor ? [...walletRows, ...rows] : rows
+    renderWallets(walletRows)
+    renderLoadMore(walletsBody, nextCursor, fetchWallets)
   } catch (e) {
     if (walletsStatus) walletsStatus.textContent = 'Ошибка загрузки кошельков.'
   }
 }
 
-async function fetchWalletsLow() {
+async function fetchWalletsLow(cursor = '') {
   try {
-    const res = await fetch(`${apiBase}/admin/wallets?low_only=1`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/wallets?low_only=1`, {
+      headers: authHeadersSafe(),
+      cursor,
+    })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load low wallets')
-    const data = await res.json()
-    renderWalletsLow(data)
+    walletLowRows = cursor ? [...walletLowRows, ...rows] : rows
+    renderWalletsLow(walletLowRows)
+    renderLoadMore(walletsLowBody, nextCursor, fetchWalletsLow)
   } catch (e) {
     if (walletsLowStatus) walletsLowStatus.textContent = 'Ошибка загрузки уведомлений.'
   }
 }
 
-async function fetchWalletTransactions() {
+async function fetchWalletTransactions(cursor = '') {
   try {
-    const res = await fetch(`${apiBase}/admin/wallet-transactions`, { headers: authHeadersSafe() })
+    const { res, rows, nextCursor } = await fetchAdminPages(`${apiBase}/admin/wallet-transactions`, {
+      headers: authHeadersSafe(),
+      cursor,
+    })
     if (handleAuthFailure(res)) return
     if (!res.ok) throw new Error('Failed to load wallet transactions')
-    const data = await res.json()
-    renderWalletTransactions(data)
+    walletTxRows = cursor ? [...walletTxRows, ...rows] : rows
+    renderWalletTransactions(walletTxRows)
+    renderLoadMore(walletTxBody, nextCursor, fetchWalletTransactions)
   } catch (e) {
     if (walletTxStatus) walletTxStatus.textContent = 'Ошибка загрузки истории.'
   }
@@ -200,6 +213,30 @@ async function adjustWallet(sign) {
   }
 }
 
+// Suggest client emails from /admin/search so the exact address the adjustment needs is one pick away.
+const walletEmailOptions = document.getElementById('wallet-email-options')
+let walletEmailTimer = null
+async function suggestWalletEmails() {
+  const query = walletEmail?.value?.trim() || ''
+  if (!walletEmailOptions || query.length < 3) return
+  try {
+    const res = await fetch(`${apiBase}/admin/search?types=user&limit=10&q=${encodeURIComponent(query)}`, {
+      headers: authHeadersSafe(),
+    })
+    if (!res.ok) return
+    const data = await res.json()
+    walletEmailOptions.innerHTML = (data.items || []).map((item) => `<option value="${item.user_email}"></option>`).join('')
+  } catch (e) {
+    // Suggestions are optional; typing the full email still works.
+  }
+}
+if (walletEmail) {
+  walletEmail.addEventListener('input', () => {
+    clearTimeout(walletEmailTimer)
+    walletEmailTimer = setTimeout(suggestWalletEmails, 200)
+  })
+}
+
 if (walletAdd) walletAdd.addEventListener('click', () => adjustWallet(1))
 if (walletSubtract) walletSubtract.addEventListener('click', () => adjustWallet(-1))
 
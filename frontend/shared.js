@@ -302,6 +302,42 @@ function authHeaders() {
   return token ? { Authorization: `Bearer ${token}` } : {}
 }
 
+// Admin list endpoints answer one page at a time and put the next page's cursor in X-Next-Cursor.
+// Fetches up to maxPages pages starting at `cursor`; `res` is the last response for the caller's
+// error handling, and a non-empty nextCursor means more rows exist (see renderLoadMore).
+async function fetchAdminPages(url, { headers = {}, cursor = '', maxPages = 1 } = {}) {
+  const rows = []
+  let next = cursor
+  let res = null
+  for (let page = 0; page < maxPages; page += 1) {
+    const pageUrl = next ? `${url}${url.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(next)}` : url
+    res = await fetch(pageUrl, { headers })
+    if (!res.ok) break
+    rows.push(...(await res.json()))
+    next = res.headers.get('X-Next-Cursor') || ''
+    if (!next) break
+  }
+  const nextCursor = res?.ok ? next : ''
+  return { res, rows, nextCursor }
+}
+
+// "Показать ещё" under a paged admin table; shown while the server has a next cursor.
+function renderLoadMore(tableBody, nextCursor, loadPage) {
+  const anchor = tableBody?.closest('.table-wrapper') || tableBody?.closest('table')
+  if (!anchor) return
+  let button = anchor.parentElement.querySelector(`button[data-load-more="${tableBody.id}"]`)
+  if (!button) {
+    button = document.createElement('button')
+    button.type = 'button'
+    button.className = 'btn ghost small load-more'
+    button.dataset.loadMore = tableBody.id
+    button.textContent = 'Показать ещё'
+    anchor.insertAdjacentElement('afterend', button)
+  }
+  button.hidden = !nextCursor
+  button.onclick = nextCursor ? () => loadPage(nextCursor) : null
+}
+
 function loadWalletBalance() {
   const el = document.getElementById('header-balance')
   if (!el) return
@@ -541,44 +577,102 @@ enforceAdminRoutes()
 
 
 
-async function loadNotifications(isAdmin) {
+let notificationState = { items: [], unread: 0 }
+let notificationSource = null
+let notificationStreamFailed = false
+
+function renderNotificationState(isAdmin) {
   const listEl = document.getElementById('bell-list')
   const countEl = document.getElementById('bell-count')
   if (!listEl) return
+  const { items, unread } = notificationState
+  if (countEl) {
+    countEl.textContent = String(unread)
+    countEl.hidden = unread <= 0
+  }
+  if (!items.length) {
+    listEl.textContent = 'Нет уведомлений.'
+    return
+  }
+  if (isAdmin) {
+    const requests = items.filter((i) => i.type === 'account_request')
+    const topups = items.filter((i) => i.type === 'topup')
+    listEl.innerHTML = `
+      <div class="dropdown-section">
+        <div class="dropdown-subhead">Заявки на аккаунт</div>
+        ${renderNotifications(requests)}
+      </div>
+      <div class="dropdown-section">
+        <div class="dropdown-subhead">Пополнения</div>
+        ${renderNotifications(topups)}
+      </div>
+    `
+    return
+  }
+  listEl.innerHTML = renderNotifications(items)
+}
+
+function applyNotificationSnapshot(data) {
+  const items = Array.isArray(data) ? data : data.items || []
+  const unread = Array.isArray(data) ? items.length : Number(data.unread || 0)
+  notificationState = { items, unread }
+}
+
+function subscribeNotifications(isAdmin) {
+  const token = getAuthToken()
+  if (!token || !window.EventSource || notificationSource || notificationStreamFailed) return false
+  const base = window.API_BASE || 'https://envidicy-dash-client.onrender.com'
+  const path = isAdmin ? '/admin/notifications/stream' : '/notifications/stream'
+  const limit = isAdmin ? 12 : 10
+  // The server closes the stream periodically; EventSource reconnects and receives a fresh snapshot.
+  notificationSource = new EventSource(`${base}${path}?token=${encodeURIComponent(token)}`)
+  notificationSource.addEventListener('snapshot', (event) => {
+    applyNotificationSnapshot(JSON.parse(event.data))
+    renderNotificationState(isAdmin)
+  })
+  notificationSource.addEventListener('notification', (event) => {
+    const data = JSON.parse(event.data)
+    const item = data.item
+    const items = notificationState.items.filter((i) => !(i.type === item.type && i.id === item.id))
+    items.unshift(item)
+    const unread = isAdmin ? Math.min(items.length, limit) : Number(data.unread || 0)
+    notificationState = { items: items.slice(0, limit), unread }
+    renderNotificationState(isAdmin)
+  })
+  notificationSource.addEventListener('notification_resolved', (event) => {
+    const data = JSON.parse(event.data)
+    const items = notificationState.items.filter((i) => !(i.type === data.type && i.id === data.id))
+    notificationState = { items, unread: items.length }
+    renderNotificationState(isAdmin)
+  })
+  notificationSource.addEventListener('notifications_read', () => {
+    notificationState = { ...notificationState, unread: 0 }
+    renderNotificationState(isAdmin)
+  })
+  notificationSource.onerror = () => {
+    // CONNECTING means EventSource is retrying on its own. CLOSED means it gave up (e.g. the token was
+    // rejected), so drop the stream and load once over REST, which surfaces the failure in the list.
+    if (!notificationSource || notificationSource.readyState !== EventSource.CLOSED) return
+    notificationSource.close()
+    notificationSource = null
+    notificationStreamFailed = true
+    loadNotifications(isAdmin)
+  }
+  return true
+}
+
+async function loadNotifications(isAdmin) {
+  const listEl = document.getElementById('bell-list')
+  if (!listEl) return
+  if (subscribeNotifications(isAdmin)) return
   try {
     const url = isAdmin
       ? `${window.API_BASE || 'https://envidicy-dash-client.onrender.com'}/admin/notifications`
       : `${window.API_BASE || 'https://envidicy-dash-client.onrender.com'}/notifications`
     const res = await fetch(url, { headers: authHeaders() })
     if (!res.ok) throw new Error('notifications failed')
-    const data = await res.json()
-    const items = Array.isArray(data) ? data : data.items || []
-    const unread = Array.isArray(data) ? items.length : Number(data.unread || 0)
-    if (!items.length) {
-      listEl.textContent = 'Нет уведомлений.'
-      if (countEl) countEl.hidden = true
-      return
-    }
-    if (countEl) {
-      countEl.textContent = String(unread)
-      countEl.hidden = unread <= 0
-    }
-    if (isAdmin) {
-      const requests = items.filter((i) => i.type === 'account_request')
-      const topups = items.filter((i) => i.type === 'topup')
-      listEl.innerHTML = `
-        <div class="dropdown-section">
-          <div class="dropdown-subhead">Заявки на аккаунт</div>
-          ${renderNotifications(requests)}
-        </div>
-        <div class="dropdown-section">
-          <div class="dropdown-subhead">Пополнения</div>
-          ${renderNotifications(topups)}
-        </div>
-      `
-      return
-    }
-    listEl.innerHTML = renderNotifications(items)
+    applyNotificationSnapshot(await res.json())
+    renderNotificationState(isAdmin)
   } catch (e) {
     listEl.textContent = 'Не удалось загрузить уведомления.'
   }
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Create default agencies for existing users and map their own ad accounts into them.
+
+New users get their agency at registration; run this once after deploying that change
+(it is safe to re-run):
+    python scripts/backfill_agencies.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app.db import get_conn  # noqa: E402
+from app.main import backfill_default_agencies  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill default agencies and account mappings")
+    parser.add_argument("--batch-size", type=int, default=200, help="users bootstrapped per commit")
+    args = parser.parse_args()
+    with get_conn() as conn:
+        result = backfill_default_agencies(conn, batch_size=args.batch_size)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Record topup_profit_facts for topups completed before the table existed.
+
+Topups completing through the API get their fact at completion, and the API runs this backfill
+on startup; run it by hand to fill facts without restarting (it only fills in missing facts and
+is safe to re-run):
+    python scripts/backfill_profit_facts.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app.db import get_conn  # noqa: E402
+from app.main import backfill_topup_profit_facts  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill profit facts for completed topups")
+    parser.add_argument("--batch-size", type=int, default=500, help="topups recorded per commit")
+    args = parser.parse_args()
+    with get_conn() as conn:
+        recorded = backfill_topup_profit_facts(conn, batch_size=args.batch_size)
+    print(json.dumps({"recorded": recorded}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of per-query overhead in the DB layer.
+
+Compares the uncached and memoized _rewrite_query, per-row upserts against
+db.bulk_upsert, and — when DATABASE_URL points to Postgres — a hot lookup
+executed unprepared vs. auto-prepared by psycopg on a single connection.
+
+    python scripts/bench_db.py --iterations 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app import db  # noqa: E402
+
+QUERIES = [
+    "SELECT u.*, ut.login_email FROM user_tokens ut JOIN users u ON u.id = ut.user_id WHERE ut.token=?",
+    "SELECT * FROM ad_accounts WHERE user_id=? AND platform=?",
+    "INSERT OR IGNORE INTO agency_members (agency_id, user_id, role, status) VALUES (?, ?, ?, ?)",
+    "UPDATE account_requests SET payload=json(?) WHERE id=?",
+]
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def bench_rewrite(iterations: int) -> None:
+    uncached = db._rewrite_query.__wrapped__
+    before = _per_call_us(lambda: [uncached(q) for q in QUERIES], iterations) / len(QUERIES)
+    after = _per_call_us(lambda: [db._rewrite_query(q) for q in QUERIES], iterations) / len(QUERIES)
+    print(f"_rewrite_query   uncached {before:8.2f} us/query   memoized {after:8.2f} us/query")
+
+
+def bench_prepared(iterations: int) -> None:
+    if not db.is_postgres():
+        print("prepared statements: skipped (DATABASE_URL is not Postgres)")
+        return
+    query = "SELECT id FROM users WHERE id=?"
+    with db.get_conn() as conn:
+        conn._conn.prepare_threshold = None  # baseline: never prepare
+        before = _per_call_us(lambda: conn.execute(query, (1,)).fetchone(), iterations)
+        conn._conn.prepare_threshold = db.PG_PREPARE_THRESHOLD
+        after = _per_call_us(lambda: conn.execute(query, (1,)).fetchone(), iterations)
+    print(f"point lookup     unprepared {before:8.2f} us/query   prepared {after:8.2f} us/query")
+
+
+def bench_bulk_upsert(rows: int) -> None:
+    # 90 days x N accounts, shaped like _finance_upsert_daily_rows; written to a temp table and rolled back.
+    columns = ("account_id", "stat_date", "spend", "impressions", "clicks")
+    values = [(n // 90, f"day-{n % 90:02d}", float(n), n * 10.0, float(n % 7)) for n in range(rows)]
+    single = db._upsert_sql("bench_stats", columns, "account_id, stat_date", columns[2:])
+    with db.get_conn() as conn:
+        conn.execute(
+            "CREATE TEMP TABLE bench_stats (account_id BIGINT, stat_date TEXT, spend DOUBLE PRECISION, "
+            "impressions DOUBLE PRECISION, clicks DOUBLE PRECISION, UNIQUE(account_id, stat_date))"
+        )
+        started = time.perf_counter()
+        for row in values:
+            conn.execute(single, row)
+        per_row = time.perf_counter() - started
+        conn.execute("DELETE FROM bench_stats")
+        started = time.perf_counter()
+        db.bulk_upsert(conn, "bench_stats", columns, values, conflict="account_id, stat_date", update=columns[2:])
+        bulk = time.perf_counter() - started
+    print(f"upsert {rows} rows  per-row {rows / per_row:10.0f} rows/s   bulk {rows / bulk:10.0f} rows/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark DB layer per-query overhead")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--upsert-rows", type=int, default=4500)
+    args = parser.parse_args()
+    bench_rewrite(args.iterations)
+    bench_bulk_upsert(args.upsert_rows)
+    bench_prepared(max(args.iterations // 20, 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ The file `mediaplan_sample.xlsx` will be saved in the project root.
 """
 from pathlib import Path
 
+import shutil
 import sys
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -43,7 +44,7 @@ def main() -> None:
 
     out_path = Path(__file__).resolve().parent.parent / "mediaplan_sample.xlsx"
     with open(out_path, "wb") as f:
-        f.write(workbook.getvalue())
+        shutil.copyfileobj(workbook, f)
 
     print(f"Sample Excel saved to {out_path}")
 
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Apply pending database migrations (app.db.MIGRATIONS) and record them in schema_version.
+
+Run once per deploy, before starting the API:
+    python scripts/migrate.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app.db import SCHEMA_VERSION, current_schema_version, get_conn, migrate  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply pending Envidicy DB migrations")
+    parser.add_argument("--status", action="store_true", help="only print the current and target schema version")
+    args = parser.parse_args()
+    if args.status:
+        with get_conn() as conn:
+            print(f"schema version {current_schema_version(conn)}, code expects {SCHEMA_VERSION}")
+        return
+    applied = migrate()
+    if applied:
+        print(f"applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print(f"schema is up to date (version {SCHEMA_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
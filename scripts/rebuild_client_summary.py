@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Recompute the client_summary table behind /admin/clients.
+
+Write paths keep each client's row current; run this after bulk data fixes or imports that
+bypass the API (it is safe to re-run):
+    python scripts/rebuild_client_summary.py
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app.db import get_conn  # noqa: E402
+from app.main import rebuild_client_summaries  # noqa: E402
+
+
+def main() -> None:
+    with get_conn() as conn:
+        rows = rebuild_client_summaries(conn)
+    print(json.dumps({"rows": rows}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Check carried spend totals in ad_account_finance_snapshots against the full ad_account_stats sum.
+
+Finance syncs add per-sync deltas to spend_total; run this periodically (e.g. nightly cron)
+to catch and repair drift:
+    python scripts/reconcile_finance.py            # report and fix
+    python scripts/reconcile_finance.py --dry-run  # report only
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL at import time.
+load_dotenv()
+
+from app.db import get_conn  # noqa: E402
+from app.main import reconcile_finance_snapshots  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reconcile finance snapshot spend totals")
+    parser.add_argument("--dry-run", action="store_true", help="only report drifted accounts")
+    args = parser.parse_args()
+    with get_conn() as conn:
+        result = reconcile_finance_snapshots(conn, fix=not args.dry_run)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if result["drifted"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# app.db reads DATABASE_URL once on import, so this must run before any test module imports the app:
+# every session gets a throwaway SQLite file and never touches local.db or an exported database.
+_DB_DIR = tempfile.mkdtemp(prefix="tests-db-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import main  # noqa: E402
+
+TEST_ADMIN_EMAIL = "admin@tests.invalid"
+TEST_PASSWORD = "test-password"
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def _test_admin(monkeypatch):
+    """Only the test admin is an admin; the real ADMIN_EMAILS are never registered by tests."""
+    monkeypatch.setattr(main, "ADMIN_EMAILS", {TEST_ADMIN_EMAIL})
+
+
+@pytest.fixture
+def register_user():
+    """Register (or log back in) a user; returns (user_id, auth headers)."""
+    client = TestClient(main.app)
+
+    def register(email=None):
+        email = email or f"user-{os.urandom(4).hex()}@example.com"
+        credentials = {"email": email, "password": TEST_PASSWORD}
+        resp = client.post("/auth/register", json=credentials)
+        if resp.status_code != 200:
+            resp = client.post("/auth/login", json=credentials)
+        assert resp.status_code == 200
+        body = resp.json()
+        return body.get("id"), {"Authorization": f"Bearer {body['token']}"}
+
+    return register
+
+
+@pytest.fixture
+def admin_headers(register_user):
+    return register_user(TEST_ADMIN_EMAIL)[1]
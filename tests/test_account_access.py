@@ -0,0 +1,105 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import get_conn
+from app import main
+from app.main import app, backfill_default_agencies
+
+client = TestClient(app)
+
+def _account_ids(headers):
+    resp = client.get("/accounts", headers=headers)
+    assert resp.status_code == 200
+    return {row["id"] for row in resp.json()}
+
+
+def _is_materialized(user_id: int) -> bool:
+    with get_conn() as conn:
+        state = conn.execute(
+            "SELECT version, cached_version FROM user_visible_accounts_state WHERE user_id=?", (user_id,)
+        ).fetchone()
+        return bool(state) and state["cached_version"] == state["version"]
+
+
+def test_visible_accounts_are_materialized_and_invalidated_on_acl_changes(admin_headers, register_user):
+    owner_id, owner = register_user(f"owner-{os.urandom(4).hex()}@example.com")
+    viewer_id, viewer = register_user(f"viewer-{os.urandom(4).hex()}@example.com")
+
+    account_id = client.post(
+        "/admin/accounts", json={"user_id": owner_id, "platform": "meta", "name": "ACL account"}, headers=admin_headers
+    ).json()["id"]
+    assert _account_ids(owner) == {account_id}
+    assert _is_materialized(owner_id)
+
+    # Hiding the account from clients drops it from the owner's cached list.
+    client.patch(f"/admin/accounts/{account_id}", json={"visible_to_client": False}, headers=admin_headers)
+    assert not _is_materialized(owner_id)
+    assert _account_ids(owner) == set()
+    client.patch(f"/admin/accounts/{account_id}", json={"visible_to_client": True}, headers=admin_headers)
+    assert _account_ids(owner) == {account_id}
+
+    # A delegated viewer sees the account only after an explicit grant.
+    with get_conn() as conn:
+        agency_id = conn.execute(
+            "SELECT agency_id FROM agency_members WHERE user_id=? AND role='owner'", (owner_id,)
+        ).fetchone()["agency_id"]
+    client.post(f"/admin/agencies/{agency_id}/members", json={"user_id": viewer_id}, headers=admin_headers)
+    assert account_id not in _account_ids(viewer)
+    resp = client.post(f"/admin/agencies/{agency_id}/accounts/{account_id}/access", json={"user_id": viewer_id}, headers=admin_headers)
+    assert resp.status_code == 200
+    assert account_id in _account_ids(viewer)
+
+
+def test_rebuild_racing_an_invalidation_is_not_stored(monkeypatch, admin_headers, register_user):
+    owner_id, owner = register_user(f"race-{os.urandom(4).hex()}@example.com")
+    client.post("/admin/accounts", json={"user_id": owner_id, "platform": "meta", "name": "Race account"}, headers=admin_headers)
+    compute = main._compute_accessible_accounts
+
+    def compute_then_invalidate(conn, current_user):
+        accounts = compute(conn, current_user)
+        # An ACL change commits on another connection while this rebuild is in flight.
+        with get_conn() as other:
+            main._invalidate_visible_accounts(other, [owner_id])
+            other.commit()
+        return accounts
+
+    monkeypatch.setattr(main, "_compute_accessible_accounts", compute_then_invalidate)
+    assert len(_account_ids(owner)) == 1
+    assert not _is_materialized(owner_id)
+
+    monkeypatch.setattr(main, "_compute_accessible_accounts", compute)
+    assert len(_account_ids(owner)) == 1
+    assert _is_materialized(owner_id)
+
+
+def test_registration_bootstraps_agency_and_backfill_covers_existing_users(register_user):
+    _, headers = register_user(f"fresh-{os.urandom(4).hex()}@example.com")
+    items = client.get("/agencies/mine", headers=headers).json()["items"]
+    assert [item["role"] for item in items] == ["owner"]
+
+    with get_conn() as conn:
+        user_id = conn.execute("INSERT INTO users (email) VALUES (?)", (f"legacy-{os.urandom(4).hex()}@example.com",)).lastrowid
+        conn.executemany(
+            "INSERT INTO ad_accounts (user_id, platform, name) VALUES (?, 'meta', ?)",
+            [(user_id, f"Legacy {n}") for n in range(3)],
+        )
+        conn.commit()
+        result = backfill_default_agencies(conn)
+        assert result["agencies_created"] >= 1
+        mapped = conn.execute(
+            """
+            SELECT COUNT(*) AS c
+            FROM agency_ad_accounts aa
+            JOIN agency_members m ON m.agency_id = aa.agency_id AND m.role='owner'
+            WHERE m.user_id=?
+            """,
+            (user_id,),
+        ).fetchone()["c"]
+        assert mapped == 3
+        assert backfill_default_agencies(conn) == {"agencies_created": 0, "accounts_mapped": 0}
@@ -0,0 +1,99 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import CLIENT_SUMMARY_SELECT, get_conn
+from app.main import app
+
+client = TestClient(app)
+
+def _client_row(headers, email: str, **params):
+    resp = client.get("/admin/clients", params={"q": email, **params}, headers=headers)
+    assert resp.status_code == 200
+    rows = [row for row in resp.json() if row["email"] == email]
+    return rows[0] if rows else None
+
+
+def _seed_pending_topup(user_id: int, amount: float) -> int:
+    with get_conn() as conn:
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name, currency) VALUES (?, 'yandex', 'Summary', 'KZT')",
+            (user_id,),
+        ).lastrowid
+        topup_id = conn.execute(
+            """
+            INSERT INTO topups (account_id, user_id, amount_input, fee_percent, vat_percent, amount_net, currency, hold_applied, status, seen_by_admin)
+            VALUES (?, ?, ?, 0, 0, ?, 'KZT', 1, 'pending', 0)
+            """,
+            (account_id, user_id, amount, amount),
+        ).lastrowid
+        conn.commit()
+    return topup_id
+
+
+def test_client_summary_follows_write_paths(admin_headers, register_user):
+    email = f"summary-{os.urandom(4).hex()}@example.com"
+    user_id, _ = register_user(email)
+    assert _client_row(admin_headers, email) is None
+
+    client.post("/admin/wallets/adjust", json={"user_email": email, "amount": 500, "note": "seed"}, headers=admin_headers)
+    assert _client_row(admin_headers, email) is None
+    client.post(f"/admin/users/{user_id}/make-client", headers=admin_headers)
+    row = _client_row(admin_headers, email)
+    assert (row["completed_count"], row["unread_topups"]) == (0, 0)
+    assert row["last_activity"]
+
+    topup_id = _seed_pending_topup(user_id, 25000)
+    resp = client.post(f"/admin/topups/{topup_id}/status", params={"status": "completed"}, headers=admin_headers)
+    assert resp.status_code == 200
+    row = _client_row(admin_headers, email)
+    assert row["completed_count"] == 1
+    assert row["unread_topups"] == 1
+    assert row["pending_requests"] == 0
+    assert row["completed_total_kzt"] == row["completed_total"] == 25000.0
+    assert _client_row(admin_headers, email, unread_only=True)
+
+    # Correcting a completed topup's amount moves its funding event and the summary with it.
+    client.patch(f"/admin/topups/{topup_id}", json={"amount_net": 30000}, headers=admin_headers)
+    assert _client_row(admin_headers, email)["completed_total_kzt"] == 30000.0
+
+    client.post(f"/admin/clients/{user_id}/mark-seen", headers=admin_headers)
+    assert _client_row(admin_headers, email)["unread_topups"] == 0
+    assert _client_row(admin_headers, email, unread_only=True) is None
+
+    # The stored row matches a fresh aggregation, and a rebuild keeps it.
+    with get_conn() as conn:
+        fresh = dict(conn.execute(f"{CLIENT_SUMMARY_SELECT} WHERE u.id=?", (user_id,)).fetchone())
+        stored = dict(
+            conn.execute(
+                "SELECT user_id, unread_topups, pending_requests, completed_count, completed_total_kzt, last_activity "
+                "FROM client_summary WHERE user_id=?",
+                (user_id,),
+            ).fetchone()
+        )
+    assert stored == fresh
+    assert client.post("/admin/clients/rebuild-summary", headers=admin_headers).json()["rows"] >= 1
+    assert _client_row(admin_headers, email)["completed_total_kzt"] == 30000.0
+
+
+def test_admin_clients_sorts_server_side(admin_headers, register_user):
+    tag = os.urandom(4).hex()
+    emails = [f"sort-{tag}-{n}@example.com" for n in range(3)]
+    for n, email in enumerate(emails):
+        user_id, _ = register_user(email)
+        topup_id = _seed_pending_topup(user_id, 1000 * (n + 1))
+        client.post(f"/admin/topups/{topup_id}/status", params={"status": "completed"}, headers=admin_headers)
+
+    def listed(**params):
+        resp = client.get("/admin/clients", params={"q": f"sort-{tag}", **params}, headers=admin_headers)
+        assert resp.status_code == 200
+        return [row["email"] for row in resp.json()]
+
+    assert listed(sort="completed_total", order="desc") == emails[::-1]
+    assert listed(sort="email", order="asc") == emails
+    assert client.get("/admin/clients", params={"sort": "id"}, headers=admin_headers).status_code == 422
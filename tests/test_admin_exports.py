@@ -0,0 +1,130 @@
+import csv
+import os
+import sys
+import time
+from io import BytesIO, StringIO
+
+from fastapi.testclient import TestClient
+from openpyxl import load_workbook
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import get_conn
+from app import main
+from app.main import app
+
+client = TestClient(app)
+
+
+def _seed_topups(email: str):
+    with get_conn() as conn:
+        user_id = conn.execute("INSERT INTO users (email) VALUES (?)", (email,)).lastrowid
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name) VALUES (?, ?, ?)",
+            (user_id, "meta", "Export account"),
+        ).lastrowid
+        for day, status in [("2024-03-01 10:00:00", "completed"), ("2024-03-15 10:00:00", "pending"), ("2024-04-02 10:00:00", "completed")]:
+            conn.execute(
+                """
+                INSERT INTO topups (account_id, user_id, amount_input, fee_percent, vat_percent, amount_net, currency, status, created_at)
+                VALUES (?, ?, 100, 10, 12, 100, 'USD', ?, ?)
+                """,
+                (account_id, user_id, status, day),
+            )
+        conn.commit()
+    return user_id
+
+
+def test_topups_csv_export_filters_in_sql(admin_headers):
+    user_id = _seed_topups(f"export-{os.urandom(4).hex()}@example.com")
+    resp = client.get(
+        "/admin/export/topups.xlsx",
+        params={"format": "csv", "user_id": user_id, "date_from": "2024-03-01", "date_to": "2024-03-31"},
+        headers=admin_headers,
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(StringIO(resp.content.decode("utf-8-sig"))))
+    assert rows[0][0] == "Дата"
+    assert [row[9] for row in rows[1:]] == ["pending", "completed"]
+    assert rows[1][7] == "122.0"
+
+
+def test_topups_xlsx_export_streams_workbook(admin_headers):
+    user_id = _seed_topups(f"export-{os.urandom(4).hex()}@example.com")
+    resp = client.get("/admin/export/topups.xlsx", params={"user_id": user_id, "status": "completed"}, headers=admin_headers)
+    assert resp.status_code == 200
+    ws = load_workbook(BytesIO(resp.content)).active
+    values = list(ws.iter_rows(values_only=True))
+    assert ws.title == "Topups"
+    assert len(values) == 3
+
+
+def test_async_export_job_produces_expiring_download(monkeypatch, tmp_path, admin_headers):
+    monkeypatch.setattr(main, "_export_storage_dir", lambda: str(tmp_path))
+    user_id = _seed_topups(f"export-{os.urandom(4).hex()}@example.com")
+    params = {"format": "csv", "user_id": user_id, "status": "completed"}
+    resp = client.get("/admin/export/topups.xlsx", params={**params, "async": 1}, headers=admin_headers)
+    assert resp.status_code == 202
+    status_url = resp.json()["status_url"]
+
+    for _ in range(100):
+        job = client.get(status_url, headers=admin_headers).json()
+        if job["status"] not in {"queued", "running"}:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert job["progress"] == 100
+    assert job["filename"] == "topups.csv"
+
+    download = client.get(job["download_url"])
+    assert download.status_code == 200
+    expected = client.get("/admin/export/topups.xlsx", params=params, headers=admin_headers)
+    assert download.content == expected.content
+    assert client.get(job["download_url"].replace("token=", "token=x")).status_code == 404
+
+    with get_conn() as conn:
+        conn.execute("UPDATE export_jobs SET expires_at=? WHERE id=?", ("2000-01-01 00:00:00", job["job_id"]))
+        conn.commit()
+    assert client.get(job["download_url"]).status_code == 410
+    assert client.get(status_url, headers=admin_headers).json()["status"] == "expired"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_recover_export_jobs_fails_stale_runs_and_resubmits_queued(monkeypatch, admin_headers):
+    submitted = []
+    monkeypatch.setattr(main._EXPORT_JOB_EXECUTOR, "submit", lambda fn, job_id: submitted.append(job_id))
+    user_id = _seed_topups(f"recover-{os.urandom(4).hex()}@example.com")
+    with get_conn() as conn:
+        def insert_job(status, started_at):
+            return conn.execute(
+                "INSERT INTO export_jobs (user_id, kind, params, status, progress, download_token, started_at) VALUES (?, 'admin_topups', '{}', ?, 0, ?, ?)",
+                (user_id, status, os.urandom(8).hex(), started_at),
+            ).lastrowid
+
+        stale_id = insert_job("running", "2000-01-01 00:00:00")
+        live_id = insert_job("running", main._utc_timestamp())
+        queued_id = insert_job("queued", None)
+        conn.commit()
+
+    main._recover_export_jobs()
+
+    with get_conn() as conn:
+        statuses = {
+            row["id"]: row["status"]
+            for row in conn.execute("SELECT id, status FROM export_jobs WHERE user_id=?", (user_id,)).fetchall()
+        }
+    assert statuses[stale_id] == "failed"
+    assert statuses[live_id] == "running"
+    assert queued_id in submitted
+    assert live_id not in submitted
+
+
+def test_startup_tasks_run_in_the_server_lifespan(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "_recover_export_jobs", lambda: calls.append("recover"))
+    monkeypatch.setattr(main, "_backfill_profit_facts_on_startup", lambda: calls.append("backfill"))
+    with TestClient(app):
+        assert calls == ["recover", "backfill"]
@@ -0,0 +1,87 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import get_conn
+from app.main import app
+
+client = TestClient(app)
+
+def _pages(path, headers, **params):
+    """Follow X-Next-Cursor to the end; returns the pages as lists of ids."""
+    pages, cursor = [], None
+    while True:
+        resp = client.get(path, params={**params, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert resp.status_code == 200
+        pages.append([row["id"] for row in resp.json()])
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_topups_page_by_created_at_and_filter_in_sql(admin_headers, register_user):
+    email = f"lists-{os.urandom(4).hex()}@example.com"
+    user_id, _ = register_user(email)
+    with get_conn() as conn:
+        accounts = {
+            platform: conn.execute(
+                "INSERT INTO ad_accounts (user_id, platform, name, currency) VALUES (?, ?, 'Listed', 'KZT')",
+                (user_id, platform),
+            ).lastrowid
+            for platform in ("meta", "google")
+        }
+        topup_ids = []
+        # Two topups share every timestamp so pages have to break ties on id.
+        for n in range(6):
+            platform = ("meta", "google")[n % 2]
+            topup_ids.append(
+                conn.execute(
+                    """
+                    INSERT INTO topups (account_id, user_id, amount_input, fee_percent, vat_percent, amount_net, currency, status, created_at)
+                    VALUES (?, ?, 100, 0, 0, 100, 'KZT', ?, ?)
+                    """,
+                    (accounts[platform], user_id, ("pending", "completed")[n >= 4], f"2024-05-0{1 + n // 2} 12:00:00"),
+                ).lastrowid
+            )
+        conn.commit()
+
+    newest_first = sorted(topup_ids, key=lambda topup_id: (topup_ids.index(topup_id) // 2, topup_id), reverse=True)
+    pages = _pages("/admin/topups", admin_headers, user_id=user_id, limit=4)
+    assert pages == [newest_first[:4], newest_first[4:]]
+
+    assert _pages("/admin/topups", admin_headers, q=email, status="completed") == [topup_ids[4:][::-1]]
+    assert _pages("/admin/topups", admin_headers, user_id=user_id, platform="google", limit=2) == [
+        [topup_ids[5], topup_ids[3]],
+        [topup_ids[1]],
+    ]
+    assert _pages("/admin/topups", admin_headers, user_id=user_id, date_from="2024-05-02", date_to="2024-05-02") == [
+        topup_ids[2:4][::-1]
+    ]
+    assert client.get("/admin/topups", params={"cursor": "not-a-cursor"}, headers=admin_headers).status_code == 400
+    assert client.get("/admin/topups", params={"limit": 0}, headers=admin_headers).status_code == 422
+
+
+def test_wallets_low_only_and_users_are_filtered_in_sql(admin_headers, register_user):
+    tag = os.urandom(4).hex()
+    low_email, rich_email = f"low-{tag}@example.com", f"rich-{tag}@example.com"
+    low_id, _ = register_user(low_email)
+    rich_id, _ = register_user(rich_email)
+    for email, amount in ((low_email, 10), (rich_email, 900000)):
+        client.post("/admin/wallets/adjust", json={"user_email": email, "amount": amount, "note": "seed"}, headers=admin_headers)
+
+    resp = client.get("/admin/wallets", params={"q": tag, "low_only": True}, headers=admin_headers)
+    assert [row["user_id"] for row in resp.json()] == [low_id]
+    resp = client.get("/admin/wallets", params={"q": tag}, headers=admin_headers)
+    assert [row["user_id"] for row in resp.json()] == [low_id, rich_id]
+
+    resp = client.get("/admin/wallet-transactions", params={"user_id": rich_id, "type": "adjustment"}, headers=admin_headers)
+    assert [(row["user_email"], row["amount"]) for row in resp.json()] == [(rich_email, 900000)]
+
+    assert _pages("/admin/users", admin_headers, q=tag, limit=1) == [[rich_id], [low_id]]
+    client.post(f"/admin/users/{rich_id}/make-client", headers=admin_headers)
+    assert _pages("/admin/users", admin_headers, q=tag) == [[low_id]]
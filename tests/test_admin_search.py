@@ -0,0 +1,62 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import get_conn
+from app.main import app
+
+client = TestClient(app)
+
+def _search(headers, q, **params):
+    resp = client.get("/admin/search", params={"q": q, **params}, headers=headers)
+    assert resp.status_code == 200
+    return [(item["type"], item["id"]) for item in resp.json()["items"]]
+
+
+def test_search_finds_users_accounts_and_legal_entities(admin_headers, register_user):
+    tag = os.urandom(4).hex()
+    email = f"finder-{tag}@example.com"
+    user_id, _ = register_user(email)
+    bin_value = str(int(tag, 16)).zfill(12)[-12:]
+    with get_conn() as conn:
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name, external_id, account_code) VALUES (?, 'meta', ?, ?, ?)",
+            (user_id, f"Searchable {tag}", f"act_{tag}", f"CODE-{tag}"),
+        ).lastrowid
+        entity_id = conn.execute(
+            "INSERT INTO legal_entities (name, short_name, bin) VALUES (?, 'ТОО Поиск', ?)",
+            (f"Поиск {tag}", bin_value),
+        ).lastrowid
+        conn.execute("INSERT INTO user_legal_entities (user_id, legal_entity_id, is_default) VALUES (?, ?, 1)", (user_id, entity_id))
+        conn.commit()
+
+    assert set(_search(admin_headers, tag)) == {("user", user_id), ("account", account_id), ("legal_entity", entity_id)}
+    assert _search(admin_headers, f"act_{tag}") == [("account", account_id)]
+    assert _search(admin_headers, bin_value, types="legal_entity") == [("legal_entity", entity_id)]
+    assert _search(admin_headers, email.upper(), types="user") == [("user", user_id)]
+
+    resp = client.get("/admin/search", params={"q": f"code-{tag}"}, headers=admin_headers)
+    (item,) = resp.json()["items"]
+    assert (item["title"], item["platform"], item["user_email"]) == (f"Searchable {tag}", "meta", email)
+
+    # Writes to the source tables keep the index current.
+    with get_conn() as conn:
+        conn.execute("UPDATE ad_accounts SET external_id=? WHERE id=?", (f"renamed_{tag}", account_id))
+        conn.execute("DELETE FROM user_legal_entities WHERE legal_entity_id=?", (entity_id,))
+        conn.execute("DELETE FROM legal_entities WHERE id=?", (entity_id,))
+        conn.commit()
+    assert _search(admin_headers, f"act_{tag}") == []
+    assert _search(admin_headers, f"renamed_{tag}") == [("account", account_id)]
+    assert _search(admin_headers, bin_value) == []
+
+
+def test_search_requires_admin_and_three_characters(admin_headers, register_user):
+    _, user = register_user(f"finder-{os.urandom(4).hex()}@example.com")
+    assert client.get("/admin/search", params={"q": "example"}, headers=user).status_code == 403
+    assert client.get("/admin/search", params={"q": " ab "}, headers=admin_headers).status_code == 400
+    assert client.get("/admin/search", params={"q": "abc", "types": "campaign"}, headers=admin_headers).status_code == 422
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from fastapi import HTTPException
+
+from app.main import _dashboard_export_gather, _select_platform_accounts
+
+
+def _raise_http():
+    raise HTTPException(status_code=400, detail="bad account")
+
+
+def test_gather_falls_back_per_section():
+    started = time.monotonic()
+    results = _dashboard_export_gather(
+        {
+            "fast": (lambda: {"accounts": [1]}, {"accounts": []}),
+            "failing": (_raise_http, {"accounts": []}),
+            "slow": (lambda: time.sleep(2) or {"accounts": [2]}, {"accounts": []}),
+        },
+        time.monotonic() + 0.3,
+    )
+    assert time.monotonic() - started < 1.5
+    assert results["fast"] == {"accounts": [1]}
+    assert results["failing"] == {"accounts": [], "error": "bad account"}
+    assert results["slow"]["accounts"] == []
+    assert results["slow"]["error"]
+
+
+def test_select_platform_accounts_matches_sql_filter():
+    accounts = [
+        {"id": 1, "platform": "meta"},
+        {"id": 2, "platform": "google"},
+        {"id": 3, "platform": "meta"},
+    ]
+    assert [a["id"] for a in _select_platform_accounts(accounts, "meta")] == [1, 3]
+    assert [a["id"] for a in _select_platform_accounts(accounts, "meta", 3)] == [3]
+    assert _select_platform_accounts(accounts, "google", 3) == []
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.db import _ensure_fact_rows_natural_key, _rewrite_query, bulk_upsert
+
+
+def test_rewrite_query_is_memoized_without_changing_output():
+    query = "INSERT OR IGNORE INTO t (a, b) VALUES (?, json(?))"
+    expected = _rewrite_query.__wrapped__(query)
+    hits = _rewrite_query.cache_info().hits
+    assert _rewrite_query(query) == expected
+    assert _rewrite_query(query) == expected
+    assert _rewrite_query.cache_info().hits >= hits + 1
+
+
+def test_inserts_return_id_on_postgres():
+    assert _rewrite_query("INSERT INTO campaigns (name) VALUES (?)", returning_id=True) == (
+        "INSERT INTO campaigns (name) VALUES (%s) RETURNING id"
+    )
+    assert _rewrite_query("INSERT OR IGNORE INTO agencies (name) VALUES (?)", returning_id=True).endswith(
+        "ON CONFLICT DO NOTHING RETURNING id"
+    )
+    for query in (
+        "INSERT INTO user_profiles (user_id, name) VALUES (?, ?)",
+        "INSERT INTO topups (id) VALUES (?) RETURNING id, status",
+        "INSERT INTO fact_weekly_agg (campaign_id) SELECT id FROM campaigns",
+        "UPDATE campaigns SET name=? WHERE id=?",
+    ):
+        assert _rewrite_query(query, returning_id=True) == _rewrite_query(query)
+
+
+def test_bulk_upsert_inserts_and_updates_on_conflict():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE stats (id INTEGER PRIMARY KEY, day TEXT, account INTEGER, spend REAL, UNIQUE(account, day))")
+    columns = ("account", "day", "spend")
+    written = bulk_upsert(conn, "stats", columns, [(1, "d1", 1.0), (1, "d2", 2.0)], conflict="account, day", update=("spend",))
+    assert written == 2
+    bulk_upsert(conn, "stats", columns, [(1, "d2", 5.0), (2, "d1", 3.0)], conflict="account, day", update=("spend",))
+    rows = conn.execute("SELECT account, day, spend FROM stats ORDER BY account, day").fetchall()
+    assert rows == [(1, "d1", 1.0), (1, "d2", 5.0), (2, "d1", 3.0)]
+    assert bulk_upsert(conn, "stats", columns, [], conflict="account, day", update=("spend",)) == 0
+
+
+def test_fact_rows_natural_key_bumps_fact_versions_and_drops_stale_aggregates():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE campaigns (id INTEGER PRIMARY KEY, fact_version INTEGER DEFAULT 0)")
+    conn.execute(
+        "CREATE TABLE fact_rows (id INTEGER PRIMARY KEY, campaign_id INTEGER, date TEXT, platform TEXT, "
+        "ad_account_id TEXT, campaign_name TEXT, cost REAL)"
+    )
+    conn.execute("CREATE TABLE fact_weekly_agg (id INTEGER PRIMARY KEY, campaign_id INTEGER, cost REAL)")
+    conn.executemany("INSERT INTO campaigns (id, fact_version) VALUES (?, ?)", [(1, 3), (2, None)])
+    row = (1, "2021-01-04", "google_search", None, "Search", 10.0)
+    conn.executemany(
+        "INSERT INTO fact_rows (campaign_id, date, platform, ad_account_id, campaign_name, cost) VALUES (?, ?, ?, ?, ?, ?)",
+        [row, row],
+    )
+    conn.execute("INSERT INTO fact_weekly_agg (campaign_id, cost) VALUES (1, 20.0)")
+    _ensure_fact_rows_natural_key(conn)
+    assert conn.execute("SELECT id, fact_version FROM campaigns ORDER BY id").fetchall() == [(1, 4), (2, 1)]
+    assert conn.execute("SELECT COUNT(*) FROM fact_rows").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM fact_weekly_agg").fetchone()[0] == 0
@@ -0,0 +1,123 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import main
+from app.main import app, aggregate_weekly, parse_fact_csv, PlanRequest, estimate_plan
+
+client = TestClient(app)
+
+PLAN_PAYLOAD = {
+    "budget": 3000,
+    "goal": "traffic",
+    "avg_frequency": 1.5,
+    "period_days": 30,
+    "targeting_depth": "balanced",
+    "seasonality": 1.0,
+    "country": "kz",
+    "platforms": ["meta", "google_search"],
+}
+
+FACT_CSV = "\n".join(
+    [
+        "date,platform,ad_account_id,campaign_name,impressions,clicks,cost,leads,conversions,views",
+        "2020-12-31,meta,,Brand,1000,10,5.5,1,0,0",
+        "2021-01-01,meta,,Brand,1200,12,6,0,1,0",
+        "2021-01-03,meta,act_1,Brand,800,8,4,0,0,10",
+        "2021-01-04,meta,,Brand,900,9,4.5,2,0,0",
+        "2021-01-04,google_search,,Search,300,30,15,3,1,0",
+        "2021-01-05,google_search,,Search,310,31,16,0,0,0",
+        "2021-01-05,tiktok,,Video,5000,50,20,0,0,300",
+    ]
+)
+
+
+def _create_campaign_with_facts() -> int:
+    campaign_id = client.post("/campaigns", params={"name": "weekly-report"}).json()["id"]
+    resp = client.post("/plans/save", params={"campaign_id": campaign_id}, json=PLAN_PAYLOAD)
+    assert resp.status_code == 200
+    resp = client.post(
+        "/fact/import",
+        params={"campaign_id": campaign_id},
+        files={"file": ("facts.csv", FACT_CSV.encode("utf-8"), "text/csv")},
+    )
+    assert resp.status_code == 200
+    return campaign_id
+
+
+def test_report_weekly_matches_python_aggregation():
+    campaign_id = _create_campaign_with_facts()
+    resp = client.get("/reports/weekly", params={"campaign_id": campaign_id})
+    assert resp.status_code == 200
+    weekly, unmatched = resp.json()["weekly"]
+
+    plan = estimate_plan(PlanRequest(**PLAN_PAYLOAD))
+    expected_weekly, expected_unmatched = aggregate_weekly(plan, parse_fact_csv(FACT_CSV))
+    assert [(w["year"], w["week"], w["platform"]) for w in weekly] == [
+        (w["year"], w["week"], w["platform"]) for w in expected_weekly
+    ]
+    for got, expected in zip(weekly, expected_weekly):
+        for metric, value in expected["fact"].items():
+            assert abs(got["fact"][metric] - value) < 1e-9
+        for metric, value in expected["plan"].items():
+            assert abs(got["plan"][metric] - value) < 1e-6
+    assert [row["platform"] for row in unmatched] == [row.platform for row in expected_unmatched]
+
+
+def test_report_weekly_etag_follows_fact_version():
+    campaign_id = _create_campaign_with_facts()
+    first = client.get("/reports/weekly", params={"campaign_id": campaign_id})
+    etag = first.headers.get("etag")
+    assert etag
+    cached = client.get("/reports/weekly", params={"campaign_id": campaign_id}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+    extra_csv = "\n".join(
+        [
+            "date,platform,ad_account_id,campaign_name,impressions,clicks,cost,leads,conversions,views",
+            "2021-01-06,google_search,,Search,100,10,7,0,0,0",
+        ]
+    )
+    client.post(
+        "/fact/import",
+        params={"campaign_id": campaign_id},
+        files={"file": ("facts.csv", extra_csv.encode("utf-8"), "text/csv")},
+    )
+    updated = client.get("/reports/weekly", params={"campaign_id": campaign_id}, headers={"If-None-Match": etag})
+    assert updated.status_code == 200
+    assert updated.headers.get("etag") != etag
+    weekly, _ = updated.json()["weekly"]
+    search_week = next(w for w in weekly if w["platform"] == "google_search")
+    assert abs(search_week["fact"]["cost"] - 38.0) < 1e-9
+    plan = estimate_plan(PlanRequest(**PLAN_PAYLOAD))
+    daily_budget = next(line.budget for line in plan.lines if line.key == "google_search") / plan.period_days
+    assert abs(search_week["plan"]["budget"] - daily_budget * 3) < 1e-6
+
+
+def test_fact_import_is_idempotent():
+    campaign_id = _create_campaign_with_facts()
+    before = client.get("/reports/weekly", params={"campaign_id": campaign_id}).json()["weekly"]
+    resp = client.post(
+        "/fact/import",
+        params={"campaign_id": campaign_id},
+        files={"file": ("facts.csv", FACT_CSV.encode("utf-8"), "text/csv")},
+    )
+    assert resp.status_code == 200
+    after = client.get("/reports/weekly", params={"campaign_id": campaign_id}).json()["weekly"]
+    assert after == before
+
+
+def test_weekly_report_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(main, "_WEEKLY_REPORT_CACHE", main.OrderedDict())
+    monkeypatch.setattr(main, "_WEEKLY_REPORT_CACHE_MAX", 2)
+    main._weekly_report_cache_put((1, 1), {"version": 1, "data": "a"})
+    main._weekly_report_cache_put((2, 1), {"version": 1, "data": "b"})
+    assert main._weekly_report_cache_get((1, 1))["data"] == "a"
+    main._weekly_report_cache_put((3, 1), {"version": 1, "data": "c"})
+    assert list(main._WEEKLY_REPORT_CACHE) == [(1, 1), (3, 1)]
+    assert main._weekly_report_cache_get((2, 1)) is None
@@ -0,0 +1,83 @@
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.db import get_conn
+from app.main import _finance_refresh_snapshot_for_account, _finance_upsert_daily_rows, app, reconcile_finance_snapshots
+
+client = TestClient(app)
+
+
+def _sync(conn, account, rows):
+    delta = _finance_upsert_daily_rows(conn, account=account, rows=rows)
+    return _finance_refresh_snapshot_for_account(conn, account=account, spend_delta=delta)
+
+
+def _full_sum(conn, account_id):
+    row = conn.execute("SELECT COALESCE(SUM(spend), 0) AS total FROM ad_account_stats WHERE account_id=?", (account_id,)).fetchone()
+    return float(row["total"])
+
+
+def test_spend_total_follows_upsert_deltas_and_reconciles():
+    with get_conn() as conn:
+        user_id = conn.execute("INSERT INTO users (email) VALUES (?)", (f"finance-{os.urandom(4).hex()}@example.com",)).lastrowid
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name) VALUES (?, 'meta', 'Finance')", (user_id,)
+        ).lastrowid
+        account = {"id": account_id, "user_id": user_id, "platform": "meta", "currency": "USD"}
+
+        first = _sync(conn, account, [{"date": "2024-01-01", "spend": 10}, {"date": "2024-01-03", "spend": 5}])
+        assert first["spend_total"] == 15
+        # Overlapping window: one day revised, one new, and 2024-01-02 has no row at all.
+        second = _sync(conn, account, [{"date": "2024-01-03", "spend": 7}, {"date": "2024-01-04", "spend": 1.5}])
+        assert second["spend_total"] == _full_sum(conn, account_id) == 18.5
+
+        conn.execute("UPDATE ad_account_stats SET spend=spend+4 WHERE account_id=? AND stat_date='2024-01-01'", (account_id,))
+        result = reconcile_finance_snapshots(conn)
+        assert {"account_id": account_id, "spend_total": 18.5, "actual_total": 22.5} in result["drifted"]
+        snapshot = conn.execute("SELECT spend_total FROM ad_account_finance_snapshots WHERE account_id=?", (account_id,)).fetchone()
+        assert float(snapshot["spend_total"]) == 22.5
+        assert account_id not in [d["account_id"] for d in reconcile_finance_snapshots(conn, fix=False)["drifted"]]
+
+
+def test_sync_rolls_back_stats_when_the_snapshot_step_fails(monkeypatch, admin_headers, register_user):
+    owner_id, owner = register_user(f"finance-sync-{os.urandom(4).hex()}@example.com")
+    account_id = client.post(
+        "/admin/accounts",
+        json={"user_id": owner_id, "platform": "meta", "name": "Finance sync", "external_id": "act_1"},
+        headers=admin_headers,
+    ).json()["id"]
+    days = [{"date": "2024-02-01", "spend": 10}]
+    monkeypatch.setattr(main, "_finance_collect_daily_rows_for_account", lambda account, date_from, date_to: days)
+    refresh = main._finance_refresh_snapshot_for_account
+
+    def sync():
+        resp = client.post("/accounts/finance/sync", params={"account_id": account_id}, headers=owner)
+        assert resp.status_code == 200
+        return resp.json()["items"][0]
+
+    def carried_total():
+        with get_conn() as conn:
+            row = conn.execute("SELECT spend_total FROM ad_account_finance_snapshots WHERE account_id=?", (account_id,)).fetchone()
+            return float(row["spend_total"]), _full_sum(conn, account_id)
+
+    assert sync()["status"] == "ok"
+    assert carried_total() == (10, 10)
+
+    def failing_refresh(conn, **kwargs):
+        raise RuntimeError("live billing unavailable")
+
+    days = [{"date": "2024-02-01", "spend": 10}, {"date": "2024-02-02", "spend": 4}]
+    monkeypatch.setattr(main, "_finance_refresh_snapshot_for_account", failing_refresh)
+    assert sync()["status"] == "error"
+    assert carried_total() == (10, 10)
+
+    monkeypatch.setattr(main, "_finance_refresh_snapshot_for_account", refresh)
+    assert sync()["status"] == "ok"
+    assert carried_total() == (14, 14)
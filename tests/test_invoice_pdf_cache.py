@@ -0,0 +1,66 @@
+import os
+import sys
+import uuid
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import pdf_render
+from app.db import get_conn
+from app import main
+from app.main import app
+
+client = TestClient(app)
+
+
+def _user_with_topup_request():
+    email = f"invoice-{uuid.uuid4().hex[:8]}@example.com"
+    resp = client.post("/auth/register", json={"email": email, "password": "invoice-test-password"})
+    assert resp.status_code == 200
+    token = resp.json()["token"]
+    with get_conn() as conn:
+        user_id = conn.execute("SELECT id FROM users WHERE email=?", (email,)).fetchone()["id"]
+        request_id = conn.execute(
+            "INSERT INTO wallet_topup_requests (user_id, amount, currency, client_name) VALUES (?, ?, ?, ?)",
+            (user_id, 150000, "KZT", "Invoice Test LLP"),
+        ).lastrowid
+        conn.commit()
+    return request_id, {"Authorization": f"Bearer {token}"}
+
+
+def test_generated_invoice_pdf_is_rendered_once(monkeypatch, tmp_path):
+    renders = []
+
+    def fake_render(html_doc, base_url=None):
+        renders.append(html_doc)
+        return b"%PDF-1.7 " + str(len(renders)).encode()
+
+    monkeypatch.setattr(pdf_render, "render_pdf", fake_render)
+    monkeypatch.setattr(main, "_invoice_storage_dir", lambda: str(tmp_path))
+    request_id, headers = _user_with_topup_request()
+    url = f"/wallet/topup-requests/{request_id}/pdf-generated"
+
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    assert first.content == b"%PDF-1.7 1"
+    etag = first.headers["etag"]
+
+    second = client.get(url, headers=headers)
+    assert second.status_code == 200
+    assert second.headers["etag"] == etag
+    assert second.content == first.content
+
+    cached = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert len(renders) == 1
+
+    with get_conn() as conn:
+        conn.execute("UPDATE wallet_topup_requests SET amount=? WHERE id=?", (175000, request_id))
+        conn.commit()
+    changed = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(renders) == 2
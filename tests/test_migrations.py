@@ -0,0 +1,19 @@
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import app.main  # noqa: F401  (applies migrations on import)
+from app.db import SCHEMA_VERSION, current_schema_version, ensure_schema, get_conn, migrate
+
+
+def test_migrations_are_recorded_and_applied_once():
+    with get_conn() as conn:
+        assert current_schema_version(conn) == SCHEMA_VERSION
+        count = conn.execute("SELECT COUNT(*) AS c FROM schema_version").fetchone()["c"]
+    assert migrate() == []
+    assert ensure_schema() == SCHEMA_VERSION
+    with get_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) AS c FROM schema_version").fetchone()["c"] == count
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import events
+from app.db import _migration_0006_user_notification_counters, get_conn
+from app.main import app
+
+client = TestClient(app)
+
+def _token(headers):
+    """The bare token, for stream URLs: EventSource cannot send an Authorization header."""
+    return headers["Authorization"].split(" ", 1)[1]
+
+
+def _parse_sse(text: str):
+    parsed = []
+    for block in text.split("\n\n"):
+        event, data = None, None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if event:
+            parsed.append((event, data))
+    return parsed
+
+
+def _open_streams(*requests):
+    """Start each (path, token) stream in its own thread and wait until all are subscribed."""
+    streams_before = events.bus_stats()["streams"]
+    results = [None] * len(requests)
+
+    def run(index, path, token):
+        results[index] = client.get(path, params={"token": token})
+
+    threads = [threading.Thread(target=run, args=(i, path, token)) for i, (path, token) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while events.bus_stats()["streams"] < streams_before + len(requests) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    def finish():
+        for thread in threads:
+            thread.join(timeout=10)
+        return [_parse_sse(resp.text) for resp in results]
+
+    return finish
+
+
+def test_event_bus_fans_out_per_topic_and_flags_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 2)
+
+    async def scenario():
+        first = events.subscribe(["user:bus-1"])
+        other = events.subscribe(["user:bus-2"])
+        try:
+            publisher = threading.Thread(target=events.publish, args=("user:bus-1", "notification", {"n": 1}))
+            publisher.start()
+            publisher.join()
+            message = await first.get(1.0)
+            assert message["event"] == "notification" and message["data"] == {"n": 1}
+            assert await other.get(0.05) is None
+
+            for n in range(3):
+                events.publish("user:bus-2", "notification", {"n": n})
+            await asyncio.sleep(0)
+            assert other.overflowed and not first.overflowed
+        finally:
+            events.unsubscribe(first)
+            events.unsubscribe(other)
+
+    asyncio.run(scenario())
+    assert events.bus_stats()["streams"] == 0
+
+
+def test_streams_push_new_requests_to_admins_and_approvals_to_owner(monkeypatch, admin_headers, register_user):
+    monkeypatch.setattr(events, "EVENTS_STREAM_MAX_SEC", 1.5)
+    monkeypatch.setattr(events, "EVENTS_KEEPALIVE_SEC", 0.2)
+    admin_token = _token(admin_headers)
+    owner_email = f"stream-{os.urandom(4).hex()}@example.com"
+    _, owner = register_user(owner_email)
+    owner_token = _token(owner)
+
+    assert client.get("/admin/notifications/stream", params={"token": owner_token}).status_code == 403
+    assert client.get("/notifications/stream", params={"token": "nope"}).status_code == 401
+
+    finish = _open_streams(("/notifications/stream", owner_token), ("/admin/notifications/stream", admin_token))
+    request_id = client.post(
+        "/account-requests", json={"platform": "meta", "name": "Streamed", "payload": {}}, headers=owner
+    ).json()["id"]
+    resp = client.post(f"/admin/account-requests/{request_id}/status", json={"status": "approved"}, headers=admin_headers)
+    assert resp.status_code == 200
+    owner_events, admin_events = finish()
+
+    assert owner_events[0] == ("snapshot", {"items": [], "unread": 0})
+    assert owner_events[1:] == [
+        (
+            "notification",
+            {
+                "item": {
+                    "type": "account_request",
+                    "id": request_id,
+                    "created_at": owner_events[1][1]["item"]["created_at"],
+                    "title": "Аккаунт открыт",
+                    "status": "approved",
+                    "platform": "meta",
+                    "name": "Streamed",
+                },
+                "unread": 1,
+            },
+        )
+    ]
+    assert admin_events[0][0] == "snapshot"
+    pushed = [data for event, data in admin_events if event == "notification"]
+    assert [(item["item"]["id"], item["item"]["user_email"]) for item in pushed] == [(request_id, owner_email)]
+    assert ("notification_resolved", {"type": "account_request", "id": request_id}) in admin_events
+
+    # What was pushed matches what a poll returns afterwards.
+    polled = client.get("/notifications", headers=owner).json()
+    assert polled["items"] == [owner_events[1][1]["item"]]
+
+
+def test_stream_pushes_topup_completion_and_read_marker(monkeypatch, admin_headers, register_user):
+    monkeypatch.setattr(events, "EVENTS_STREAM_MAX_SEC", 1.5)
+    monkeypatch.setattr(events, "EVENTS_KEEPALIVE_SEC", 0.2)
+    owner_id, owner = register_user(f"stream-{os.urandom(4).hex()}@example.com")
+    owner_token = _token(owner)
+    with get_conn() as conn:
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name, currency) VALUES (?, 'meta', 'Stream topups', 'USD')",
+            (owner_id,),
+        ).lastrowid
+        topup_id = conn.execute(
+            """
+            INSERT INTO topups (account_id, user_id, amount_input, fee_percent, vat_percent, amount_net, currency, hold_applied, status)
+            VALUES (?, ?, 100, 0, 0, 100, 'USD', 1, 'pending')
+            """,
+            (account_id, owner_id),
+        ).lastrowid
+        conn.commit()
+
+    finish = _open_streams(("/notifications/stream", owner_token))
+    resp = client.post(f"/admin/topups/{topup_id}/status", params={"status": "completed"}, headers=admin_headers)
+    assert resp.status_code == 200
+    client.post("/notifications/read", headers=owner)
+    (owner_events,) = finish()
+
+    assert [event for event, _ in owner_events] == ["snapshot", "notification", "notifications_read"]
+    item = owner_events[1][1]["item"]
+    assert (item["type"], item["id"], item["amount"], item["currency"]) == ("topup", topup_id, 100, "USD")
+
+
+def test_unread_counter_follows_approvals_and_read_marker(admin_headers, register_user):
+    owner_id, owner = register_user(f"counter-{os.urandom(4).hex()}@example.com")
+    assert client.get("/notifications", headers=owner).json()["unread"] == 0
+
+    request_ids = [
+        client.post("/account-requests", json={"platform": "meta", "name": f"Counted {n}", "payload": {}}, headers=owner).json()["id"]
+        for n in range(2)
+    ]
+    for request_id in request_ids:
+        client.post(f"/admin/account-requests/{request_id}/status", json={"status": "approved"}, headers=admin_headers)
+    # Re-saving an approved request is not a new notification.
+    client.post(f"/admin/account-requests/{request_ids[0]}/status", json={"status": "approved"}, headers=admin_headers)
+    assert client.get("/notifications", headers=owner).json()["unread"] == 2
+    # Moving an approval back and forth does not inflate the count.
+    for status in ("processing", "approved"):
+        client.post(f"/admin/account-requests/{request_ids[0]}/status", json={"status": status}, headers=admin_headers)
+    assert client.get("/notifications", headers=owner).json()["unread"] == 2
+
+    client.post("/notifications/read", headers=owner)
+    assert client.get("/notifications", headers=owner).json()["unread"] == 0
+
+    # The migration seeds counters from notifications_seen_at for users without one.
+    with get_conn() as conn:
+        conn.execute("DELETE FROM user_notification_counters WHERE user_id=?", (owner_id,))
+        conn.execute("UPDATE user_profiles SET notifications_seen_at=NULL WHERE user_id=?", (owner_id,))
+        _migration_0006_user_notification_counters(conn)
+        conn.commit()
+    assert client.get("/notifications", headers=owner).json()["unread"] == 2
+
+
+def test_reverting_an_already_read_item_keeps_the_unread_count(admin_headers, register_user):
+    owner_id, owner = register_user(f"revert-{os.urandom(4).hex()}@example.com")
+    old_id, new_id = [
+        client.post("/account-requests", json={"platform": "meta", "name": f"Revert {n}", "payload": {}}, headers=owner).json()["id"]
+        for n in range(2)
+    ]
+
+    def set_status(request_id, status):
+        resp = client.post(f"/admin/account-requests/{request_id}/status", json={"status": status}, headers=admin_headers)
+        assert resp.status_code == 200
+
+    set_status(old_id, "approved")
+    client.post("/notifications/read", headers=owner)
+    # Pin the clock: the old approval was read, anything raised from now on is newer than the read marker.
+    with get_conn() as conn:
+        conn.execute("UPDATE account_requests SET notified_at='2000-01-01 00:00:00' WHERE id=?", (old_id,))
+        conn.execute("UPDATE user_profiles SET notifications_seen_at='2000-01-02 00:00:00' WHERE user_id=?", (owner_id,))
+        conn.commit()
+    set_status(new_id, "approved")
+    assert client.get("/notifications", headers=owner).json()["unread"] == 1
+
+    set_status(old_id, "processing")
+    assert client.get("/notifications", headers=owner).json()["unread"] == 1
+    set_status(new_id, "processing")
+    assert client.get("/notifications", headers=owner).json()["unread"] == 0
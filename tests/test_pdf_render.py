@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+from app import pdf_render
+
+
+def test_render_pdf_rejects_when_queue_is_full(monkeypatch):
+    monkeypatch.setattr(pdf_render, "_SLOTS", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(pdf_render, "PDF_RENDER_QUEUE_TIMEOUT_SEC", 0.01)
+    before = pdf_render.render_stats()["rejected"]
+    pdf_render._SLOTS.acquire()
+    try:
+        with pytest.raises(pdf_render.PdfRendererBusy):
+            pdf_render.render_pdf("<p>busy</p>")
+    finally:
+        pdf_render._SLOTS.release()
+    assert pdf_render.render_stats()["rejected"] == before + 1
+
+
+def test_render_pdf_records_timing(monkeypatch):
+    monkeypatch.setattr(pdf_render, "PDF_RENDER_WORKERS", 0)
+    monkeypatch.setattr(pdf_render, "_render", lambda html_doc, base_url: (b"%PDF-1.7", 12.0))
+    before = pdf_render.render_stats()
+    assert pdf_render.render_pdf("<p>ok</p>") == b"%PDF-1.7"
+    after = pdf_render.render_stats()
+    assert after["renders"] == before["renders"] + 1
+    assert after["render_ms_total"] == before["render_ms_total"] + 12.0
+    assert after["in_flight"] == 0
+
+
+def test_reset_pool_kills_a_hung_worker():
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    future = pool.submit(time.sleep, 60)
+    deadline = time.monotonic() + 10
+    while not future.running() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    (worker,) = pool._processes.values()
+    assert worker.is_alive()
+    pdf_render._reset_pool(pool)
+    assert not worker.is_alive()
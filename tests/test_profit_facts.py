@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import app.main as main
+from app.db import get_conn
+from app.main import app, backfill_topup_profit_facts
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def _offline_rates(monkeypatch):
+    def unavailable():
+        raise RuntimeError("rates are offline in tests")
+
+    monkeypatch.setattr(main, "_fetch_bcc_rates", unavailable)
+
+
+def _seed_topup(user_id: int, platform: str, account_currency: str, status: str = "pending", created_at=None, **topup):
+    values = {"amount_input": 0, "fee_percent": 0, "currency": "KZT", "fx_rate": None, **topup}
+    values.setdefault("amount_net", values["amount_input"])
+    with get_conn() as conn:
+        account_id = conn.execute(
+            "INSERT INTO ad_accounts (user_id, platform, name, currency) VALUES (?, ?, 'Profit', ?)",
+            (user_id, platform, account_currency),
+        ).lastrowid
+        topup_id = conn.execute(
+            """
+            INSERT INTO topups (account_id, user_id, amount_input, fee_percent, vat_percent, amount_net, currency, fx_rate, hold_applied, status, created_at)
+            VALUES (?, ?, ?, ?, 0, ?, ?, ?, 1, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            """,
+            (
+                account_id,
+                user_id,
+                values["amount_input"],
+                values["fee_percent"],
+                values["amount_net"],
+                values["currency"],
+                values["fx_rate"],
+                status,
+                created_at,
+            ),
+        ).lastrowid
+        conn.commit()
+    return topup_id
+
+
+def _fact(topup_id: int):
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM topup_profit_facts WHERE topup_id=?", (topup_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def test_completion_records_profit_and_rollups_read_it(admin_headers, register_user):
+    email = f"profit-{os.urandom(4).hex()}@example.com"
+    user_id, _ = register_user(email)
+    fx_topup = _seed_topup(user_id, "meta", "USD", amount_input=50000, amount_net=100, fx_rate=500, fee_percent=5)
+    kzt_topup = _seed_topup(user_id, "yandex", "KZT", amount_input=20000, fee_percent=10)
+    for topup_id in (fx_topup, kzt_topup):
+        resp = client.post(f"/admin/topups/{topup_id}/status", params={"status": "completed"}, headers=admin_headers)
+        assert resp.status_code == 200
+
+    fact = _fact(fx_topup)
+    assert (fact["our_rate"], fact["fx_profit_kzt"], fact["fee_amount_kzt"], fact["profit_total_kzt"]) == (490, 1000, 2500, 3500)
+    assert fact["day"] == main._utc_timestamp()[:10] and fact["month"] == fact["day"][:7]
+    assert _fact(kzt_topup)["profit_total_kzt"] == 2000
+
+    resp = client.get(
+        "/admin/topups/profit-rollup",
+        params={"granularity": "day", "group_by": ["client", "platform"], "date_from": fact["day"], "date_to": fact["day"]},
+        headers=admin_headers,
+    )
+    assert resp.status_code == 200
+    mine = {item["platform"]: item for item in resp.json()["items"] if item["user_email"] == email}
+    assert mine["meta"]["profit_total_kzt"] == 3500 and mine["meta"]["period"] == fact["day"]
+    assert mine["yandex"]["fee_amount_kzt"] == 2000
+
+    resp = client.get("/admin/topups/profit-rollup", params={"date_to": "2000-01-01"}, headers=admin_headers)
+    assert resp.json()["items"] == []
+
+    # Editing the rate of a completed topup recomputes its fact; un-completing drops it.
+    client.patch(f"/admin/topups/{fx_topup}", json={"fx_rate": 480}, headers=admin_headers)
+    assert _fact(fx_topup)["our_rate"] == 470
+    client.post(f"/admin/topups/{fx_topup}/status", params={"status": "failed"}, headers=admin_headers)
+    assert _fact(fx_topup) is None
+
+
+def test_backfill_dates_old_topups_by_created_at(register_user):
+    user_id, _ = register_user(f"profit-old-{os.urandom(4).hex()}@example.com")
+    topup_id = _seed_topup(
+        user_id, "yandex", "KZT", status="completed", created_at="2023-03-15 09:00:00", amount_input=1000, fee_percent=10
+    )
+    assert _fact(topup_id) is None
+    with get_conn() as conn:
+        assert backfill_topup_profit_facts(conn, batch_size=2) >= 1
+    fact = _fact(topup_id)
+    assert (fact["day"], fact["month"], fact["fee_amount_kzt"]) == ("2023-03-15", "2023-03", 100)
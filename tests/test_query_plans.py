@@ -0,0 +1,204 @@
+import os
+import sys
+import uuid
+from typing import NamedTuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import app.main  # noqa: F401  (applies migrations on import)
+from app.db import ADMIN_LIST_INDEXES, MANAGED_INDEXES, get_conn, is_postgres
+
+SEED_USERS = 300
+HOT_USER_INDEX = SEED_USERS // 2
+PLATFORMS_PER_USER = ("meta", "google", "tiktok", "meta", "google")
+
+
+class SeededDb(NamedTuple):
+    conn: object
+    tag: str
+    base_user: int
+    base_account: int
+
+    def hot_params(self, build):
+        # A user in the middle of the seeded range and their first (meta) account.
+        user_id = self.base_user + HOT_USER_INDEX + 1
+        account_id = self.base_account + HOT_USER_INDEX * len(PLATFORMS_PER_USER) + 1
+        return build(self.tag, user_id, account_id)
+
+# (table alias, expected index or None for "any index", query shaped like the endpoint's,
+#  params built from a seeded (tag, user_id, account_id) so lookups hit rows that exist)
+HOT_QUERIES = [
+    (
+        "ut",
+        None,
+        "SELECT u.*, ut.login_email FROM user_tokens ut JOIN users u ON u.id = ut.user_id WHERE ut.token=?",
+        lambda tag, user, account: (f"plan-token-{tag}-{user}",),
+    ),
+    (
+        "ad_accounts",
+        "idx_ad_accounts_user_platform",
+        "SELECT * FROM ad_accounts WHERE user_id=? AND platform=?",
+        lambda tag, user, account: (user, "meta"),
+    ),
+    (
+        "topups",
+        "idx_topups_user_status_created",
+        "SELECT id, amount_net, created_at FROM topups WHERE user_id=? AND status='completed' ORDER BY created_at DESC",
+        lambda tag, user, account: (user,),
+    ),
+    (
+        "topups",
+        "idx_topups_account",
+        "SELECT COUNT(1) AS cnt FROM topups WHERE account_id=?",
+        lambda tag, user, account: (account,),
+    ),
+    (
+        "account_requests",
+        "idx_account_requests_user_status_created",
+        "SELECT id, platform, name FROM account_requests WHERE user_id=? AND status='approved' ORDER BY created_at DESC",
+        lambda tag, user, account: (user,),
+    ),
+    (
+        "account_funding_events",
+        "idx_account_funding_events_user_account",
+        "SELECT id, amount FROM account_funding_events WHERE user_id=? AND account_id=? ORDER BY created_at DESC, id DESC",
+        lambda tag, user, account: (user, account),
+    ),
+    (
+        "account_funding_events",
+        "idx_account_funding_events_account",
+        "SELECT COALESCE(SUM(amount), 0) AS total FROM account_funding_events WHERE account_id=?",
+        lambda tag, user, account: (account,),
+    ),
+    (
+        "wallet_transactions",
+        "idx_wallet_transactions_user_created",
+        "SELECT id, amount, created_at FROM wallet_transactions WHERE user_id=? ORDER BY created_at DESC",
+        lambda tag, user, account: (user,),
+    ),
+    (
+        "topups",
+        "idx_topups_status_created_id",
+        "SELECT id FROM topups WHERE status=? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT 50",
+        lambda tag, user, account: ("pending", "2024-03-01 00:00:00", 10**9),
+    ),
+    (
+        "wallet_transactions",
+        "idx_wallet_transactions_created_id",
+        "SELECT id FROM wallet_transactions ORDER BY created_at DESC, id DESC LIMIT 50",
+        lambda tag, user, account: (),
+    ),
+]
+
+
+@pytest.fixture(scope="module")
+def seeded_db():
+    """Seed a realistic spread of rows under a unique tag so reruns on the same DB stay cheap."""
+    tag = uuid.uuid4().hex[:8]
+    with get_conn() as conn:
+        base_user = conn.execute("SELECT COALESCE(MAX(id), 0) AS m FROM users").fetchone()["m"]
+        base_account = conn.execute("SELECT COALESCE(MAX(id), 0) AS m FROM ad_accounts").fetchone()["m"]
+        users = [(base_user + i + 1, f"plan-{tag}-{i}@example.com") for i in range(SEED_USERS)]
+        conn.executemany("INSERT INTO users (id, email) VALUES (?, ?)", users)
+        conn.executemany(
+            "INSERT INTO user_tokens (user_id, token) VALUES (?, ?)",
+            [(user_id, f"plan-token-{tag}-{user_id}") for user_id, _ in users],
+        )
+        accounts = []
+        for user_id, _ in users:
+            for n, platform in enumerate(PLATFORMS_PER_USER):
+                accounts.append((base_account + len(accounts) + 1, user_id, platform, f"acc-{n}"))
+        conn.executemany("INSERT INTO ad_accounts (id, user_id, platform, name) VALUES (?, ?, ?, ?)", accounts)
+        topups, requests, events, wallet_tx = [], [], [], []
+        for account_id, user_id, platform, _ in accounts:
+            for day in range(4):
+                created_at = f"2024-0{1 + day}-1{day} 10:00:00"
+                status = ("completed", "pending", "completed", "failed")[day]
+                topups.append((account_id, user_id, 100 + day, 100 + day, status, created_at))
+                events.append(
+                    (account_id, user_id, platform, 100 + day, "USD", "topup", f"{tag}-{account_id}-{day}", created_at)
+                )
+                wallet_tx.append((user_id, account_id, -(100 + day), "topup", created_at))
+            requests.append((user_id, platform, "Request", "{}", ("new", "approved")[account_id % 2], "2024-02-01 10:00:00"))
+        conn.executemany(
+            "INSERT INTO topups (account_id, user_id, amount_input, amount_net, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            topups,
+        )
+        conn.executemany(
+            "INSERT INTO account_requests (user_id, platform, name, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            requests,
+        )
+        conn.executemany(
+            """
+            INSERT INTO account_funding_events (account_id, user_id, platform, amount, currency, source_type, source_key, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            events,
+        )
+        conn.executemany(
+            "INSERT INTO wallet_transactions (user_id, account_id, amount, type, created_at) VALUES (?, ?, ?, ?, ?)",
+            wallet_tx,
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
+        yield SeededDb(conn, tag, base_user, base_account)
+
+
+def _plan_indexes(conn, query, params, alias):
+    """Index names the planner uses to read `alias`; None means it scans the table instead."""
+    if is_postgres():
+        plan = conn.execute(f"EXPLAIN (FORMAT JSON) {query}", params).fetchone()
+        plan = plan["QUERY PLAN"] if isinstance(plan, dict) else plan[0]
+        found = set()
+        nodes = [(plan[0]["Plan"], None)]
+        while nodes:
+            node, heap_alias = nodes.pop()
+            node_alias = node.get("Alias") or heap_alias
+            if node.get("Alias") == alias and node.get("Node Type") == "Seq Scan":
+                return None
+            if node_alias == alias and node.get("Index Name"):
+                found.add(node["Index Name"])
+            # Bitmap index scans sit under the heap scan that names the table.
+            child_alias = node.get("Alias") if node.get("Node Type") == "Bitmap Heap Scan" else None
+            nodes.extend((child, child_alias) for child in node.get("Plans", []))
+        return found
+    found = set()
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall():
+        words = row["detail"].split()
+        if len(words) < 2 or words[0] not in {"SCAN", "SEARCH"} or words[1] != alias:
+            continue
+        if "INDEX" in words:
+            found.add(words[words.index("INDEX") + 1])
+        elif words[0] == "SCAN":
+            return None
+    return found
+
+
+def test_managed_indexes_exist(seeded_db):
+    for name, _table, _columns in MANAGED_INDEXES + ADMIN_LIST_INDEXES:
+        if is_postgres():
+            row = seeded_db.conn.execute("SELECT indexname FROM pg_indexes WHERE indexname=?", (name,)).fetchone()
+        else:
+            row = seeded_db.conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (name,)).fetchone()
+        assert row, name
+
+
+def test_hot_params_point_at_seeded_rows(seeded_db):
+    token, user_id, account_id = seeded_db.hot_params(lambda tag, user, account: (f"plan-token-{tag}-{user}", user, account))
+    row = seeded_db.conn.execute(
+        "SELECT a.user_id, a.platform FROM user_tokens ut JOIN ad_accounts a ON a.user_id = ut.user_id WHERE ut.token=? AND a.id=?",
+        (token, account_id),
+    ).fetchone()
+    assert row and (row["user_id"], row["platform"]) == (user_id, "meta")
+
+
+@pytest.mark.parametrize("alias,index_name,query,params", HOT_QUERIES)
+def test_hot_queries_use_indexes(seeded_db, alias, index_name, query, params):
+    indexes = _plan_indexes(seeded_db.conn, query, seeded_db.hot_params(params), alias)
+    assert indexes, f"{alias} is scanned without an index for: {query}"
+    if index_name:
+        assert index_name in indexes, f"expected {index_name}, planner used {sorted(indexes)}"
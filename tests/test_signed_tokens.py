@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import main
+from app.db import get_conn
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def signed_tokens(monkeypatch):
+    monkeypatch.setattr(main, "_AUTH_TOKEN_SECRET", b"test-secret")
+    monkeypatch.setattr(main, "_AUTH_SIGNED_TOKENS", True)
+    main._AUTH_EPOCH_CACHE.clear()
+
+
+def _register():
+    email = f"signed-{os.urandom(4).hex()}@example.com"
+    resp = client.post("/auth/register", json={"email": email, "password": "old-password"})
+    assert resp.status_code == 200
+    return email, resp.json()["token"]
+
+
+def test_signed_token_authenticates_without_token_table(signed_tokens):
+    email, token = _register()
+    assert token.startswith("s1.")
+    user = main.get_current_user(f"Bearer {token}")
+    assert user["email"] == email and user["primary_email"] == email and user["can_manage_accesses"]
+    with get_conn() as conn:
+        assert not conn.execute("SELECT id FROM user_tokens WHERE user_id=?", (user["id"],)).fetchone()
+
+    body, signature = token[3:].split(".")
+    forged = "s1." + main._b64url(main._b64url_decode(body).replace(b'"cma":true', b'"cma":false')) + "." + signature
+    assert main._user_from_signed_token(forged) is None
+
+
+def test_password_change_revokes_signed_tokens(signed_tokens):
+    email, token = _register()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/accounts", headers=headers).status_code == 200
+    resp = client.post(
+        "/auth/change-password",
+        json={"current_password": "old-password", "new_password": "new-password"},
+        headers=headers,
+    )
+    assert resp.status_code == 200, resp.text
+    assert client.get("/accounts", headers=headers).status_code == 401
+    new_headers = {"Authorization": f"Bearer {resp.json()['token']}"}
+    assert client.get("/accounts", headers=new_headers).status_code == 200
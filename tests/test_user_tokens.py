@@ -0,0 +1,48 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import main
+from app.db import get_conn
+
+
+def _stamp(delta: timedelta) -> str:
+    return (datetime.utcnow() + delta).isoformat(sep=" ", timespec="seconds")
+
+
+def test_expired_tokens_are_rejected_and_compacted(monkeypatch):
+    monkeypatch.setattr(main, "_AUTH_TOKENS_PER_LOGIN", 3)
+    with get_conn() as conn:
+        user_id = conn.execute("INSERT INTO users (email) VALUES (?)", (f"tokens-{os.urandom(4).hex()}@example.com",)).lastrowid
+        rows = [(user_id, f"tok-{os.urandom(8).hex()}", _stamp(timedelta(days=1)), f"2024-01-0{n + 1} 10:00:00") for n in range(5)]
+        expired_token = f"tok-{os.urandom(8).hex()}"
+        legacy_token = f"tok-{os.urandom(8).hex()}"
+        rows.append((user_id, expired_token, _stamp(timedelta(days=-1)), "2024-02-01 10:00:00"))
+        rows.append((user_id, legacy_token, None, "2024-02-02 10:00:00"))
+        conn.executemany("INSERT INTO user_tokens (user_id, token, expires_at, created_at) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+
+        with pytest.raises(HTTPException) as exc:
+            main.get_current_user(f"Bearer {expired_token}")
+        assert exc.value.status_code == 401
+        assert main.get_current_user(f"Bearer {legacy_token}")["id"] == user_id
+
+        result = main.compact_user_tokens(conn, batch_size=2)
+        assert result["expired"] >= 1 and result["superseded"] >= 3 and result["stamped"] >= 1
+        remaining = conn.execute(
+            "SELECT token, expires_at FROM user_tokens WHERE user_id=? ORDER BY created_at DESC", (user_id,)
+        ).fetchall()
+        # The legacy token is kept with a fresh expiry, plus the two newest of the rest.
+        assert [row["token"] for row in remaining] == [legacy_token, rows[4][1], rows[3][1]]
+        assert all(row["expires_at"] for row in remaining)
+
+        stats = main._user_tokens_stats(conn)
+        assert stats["lookups"] >= 2 and stats["lookup_misses"] >= 1
+        assert stats["table"]["total"] >= 3